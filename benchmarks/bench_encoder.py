@@ -0,0 +1,64 @@
+"""
+Compares the old per-value `is_jsonable` probing in `Model.to_repr` with `crudcast.encoders.encode_document`, over a
+batch of realistic documents.
+
+Usage::
+
+    python benchmarks/bench_encoder.py
+"""
+import timeit
+from datetime import datetime
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+from crudcast.encoders import encode_document
+from crudcast.utils import is_jsonable
+
+NUMBER = 20
+DOCUMENTS = [
+    {
+        '_id': ObjectId(),
+        'name': 'Book %s' % i,
+        'isbn': '978-3-16-148410-%s' % i,
+        'pages': 300 + i,
+        'published': True,
+        'price': Decimal128('12.99'),
+        'created': datetime.utcnow(),
+        'author': ObjectId(),
+        'authors': [ObjectId() for j in range(5)],
+        'tags': ['fiction', 'classic', 'paperback'],
+        'publisher': {'name': 'Penguin', 'city': 'London', 'founded': 1935},
+    }
+    for i in range(1000)
+]
+
+
+def old_to_repr(documents):
+    response = []
+    for item in documents:
+        obj = {}
+        for key, val in item.items():
+            if is_jsonable(val):
+                obj[key] = val
+            else:
+                obj[key] = str(val)
+        response.append(obj)
+    return response
+
+
+def new_to_repr(documents):
+    return [encode_document(document) for document in documents]
+
+
+def main():
+    before = timeit.timeit(lambda: old_to_repr(DOCUMENTS), number=NUMBER)
+    after = timeit.timeit(lambda: new_to_repr(DOCUMENTS), number=NUMBER)
+    per_document = NUMBER * len(DOCUMENTS)
+
+    print('is_jsonable probing: %.2f us/document' % (before / per_document * 1e6))
+    print('encode_document:     %.2f us/document' % (after / per_document * 1e6))
+    print('speedup:             %.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares the per-request cost of building a `Model` (what every resource used to do) against looking up the
+compiled model in the app's registry.
+
+Usage::
+
+    python benchmarks/bench_registry.py
+
+No MongoDB server is needed - pymongo connects lazily and no queries are made.
+"""
+import os
+import tempfile
+import timeit
+
+from crudcast.app import CrudcastApp
+from crudcast.models import Model
+
+CONFIG = """
+models:
+  author:
+    fields:
+      name:
+        required: true
+      email:
+        unique: true
+  publisher:
+    fields:
+      name:
+      authors:
+        type: manytomany
+        to: author
+  book:
+    fields:
+      name:
+        required: true
+      published:
+        type: auto_datetime
+      number:
+        type: autofield
+      author:
+        type: foreignkey
+        to: author
+      publisher:
+        type: foreignkey
+        to: publisher
+"""
+
+NUMBER = 20000
+
+
+def build_model(name, app):
+    """
+    Builds a model the way requests used to: the model itself, plus every related model, recursively
+    """
+    model = Model(name, app)
+    for field in model.fields:
+        if hasattr(field, 'to'):
+            build_model(field.to, app)
+    return model
+
+
+def main():
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        f.write(CONFIG)
+
+    try:
+        app = CrudcastApp(__name__, config_file=f.name)
+    finally:
+        os.remove(f.name)
+
+    before = timeit.timeit(lambda: build_model('book', app), number=NUMBER)
+    after = timeit.timeit(lambda: app.get_model('book'), number=NUMBER)
+
+    print('per-request model construction: %.2f us' % (before / NUMBER * 1e6))
+    print('registry lookup:                %.2f us' % (after / NUMBER * 1e6))
+    print('speedup:                        %.0fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
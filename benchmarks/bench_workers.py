@@ -0,0 +1,99 @@
+"""
+Load-tests the `--workers` serving mode, and reports the number of requests per second handled with different numbers
+of worker processes.
+
+Usage::
+
+    python benchmarks/bench_workers.py [--workers 1,2,4] [--threads 2] [--path /swagger] [--config-file config.yml]
+
+By default, the swagger document is requested, so no MongoDB server is needed. To include the database, pass a config
+file that points at a running server, and a model's path, e.g. `--path /api/book/`. Requests per second should grow
+with the number of workers, up to the number of CPU cores.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from urllib.error import URLError
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIG = """
+sync_indexes: false
+models:
+  book:
+    fields:
+      name:
+"""
+
+PORT = 5099
+
+
+def wait_for_server(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urlopen(url).read()
+            return
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('Server did not start')
+
+
+def load_test(url, requests, concurrency):
+    """
+    Sends `requests` requests from `concurrency` client threads, and returns the number of requests per second
+    """
+    def fetch(i):
+        urlopen(url).read()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fetch, range(requests)))
+    return requests / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='Comma separated numbers of workers to test')
+    parser.add_argument('--threads', default=2, type=int, help='Threads per worker')
+    parser.add_argument('--path', default='/swagger', help='Path to request')
+    parser.add_argument('--config-file', default=None, help='Config file. Defaults to a minimal config')
+    parser.add_argument('--requests', default=2000, type=int, help='Number of requests per test')
+    parser.add_argument('--concurrency', default=16, type=int, help='Number of concurrent clients')
+    args = parser.parse_args()
+
+    config_file = args.config_file
+    if config_file is None:
+        with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+            f.write(CONFIG)
+        config_file = f.name
+
+    url = 'http://127.0.0.1:%d%s' % (PORT, args.path)
+    print('%d CPU cores, %d requests, %d clients, %d threads per worker'
+          % (os.cpu_count(), args.requests, args.concurrency, args.threads))
+    print('workers  requests/sec')
+
+    try:
+        for workers in [int(n) for n in args.workers.split(',')]:
+            server = subprocess.Popen(
+                [sys.executable, '-c', 'from crudcast.entrypoint import main; main()', '--config-file', config_file,
+                 '--host', '127.0.0.1', '--port', str(PORT), '--workers', str(workers), '--threads', str(args.threads)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                wait_for_server(url)
+                load_test(url, min(args.requests, 100), args.concurrency)  # warm up
+                print('%7d  %12.0f' % (workers, load_test(url, args.requests, args.concurrency)))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        if args.config_file is None:
+            os.remove(config_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from crudcast.exceptions import ValidationError
+
+
+METRICS = ('count', 'sum', 'avg', 'min', 'max')  #: the metrics that can be requested from the aggregate endpoint
+DEFAULT_MAX_GROUPS = 1000  #: the maximum number of groups returned, unless a model sets `max_groups`
+
+
+def parse_group_by(model, group_by):
+    """
+    Parses the `group_by` query string argument - a comma separated list of field names
+
+    :type model: crudcast.models.Model
+    :type group_by: str
+    :rtype: list
+    """
+    names = [name.strip() for name in (group_by or '').split(',') if name.strip()]
+    if not names:
+        raise ValidationError('This field is required', field='group_by')
+
+    for name in names:
+        if name not in model.readable_fields:
+            raise ValidationError('Invalid field: %s' % name, field='group_by')
+    return names
+
+
+def parse_metrics(model, metric):
+    """
+    Parses the `metric` query string argument - a comma separated list of `count`, or `<metric>:<field name>`, where
+    metric is one of `sum`, `avg`, `min` or `max`, e.g. `count,avg:pages`
+
+    :type model: crudcast.models.Model
+    :type metric: str
+    :return: a list of `(metric, field name)` pairs. The field name is `None` for `count`
+    :rtype: list
+    """
+    metrics = []
+    for item in (metric or 'count').split(','):
+        name, sep, field_name = item.strip().partition(':')
+        if name not in METRICS or bool(field_name) == (name == 'count'):
+            raise ValidationError('Invalid metric: %s' % item, field='metric')
+        if field_name and field_name not in model.readable_fields:
+            raise ValidationError('Invalid field: %s' % field_name, field='metric')
+        metrics.append((name, field_name or None))
+    return metrics
+
+
+def get_pipeline(q, group_by, metrics, max_groups=DEFAULT_MAX_GROUPS):
+    """
+    Builds an aggregation pipeline that groups the documents matching a query, and computes metrics for each group
+
+    :param q: a MongoDB query document
+    :type q: dict
+    :param group_by: field names - see `parse_group_by`
+    :param metrics: see `parse_metrics`
+    :param max_groups: the maximum number of groups to return
+    :rtype: list
+    """
+    group = {'_id': {name: '$%s' % name for name in group_by}}
+    for name, field_name in metrics:
+        if name == 'count':
+            group['count'] = {'$sum': 1}
+        else:
+            group['%s_%s' % (name, field_name)] = {'$%s' % name: '$%s' % field_name}
+
+    pipeline = [{'$match': q}] if q else []
+    pipeline += [
+        {'$group': group},
+        {'$sort': {'_id.%s' % name: 1 for name in group_by}},
+        {'$limit': max_groups},
+    ]
+    return pipeline
@@ -0,0 +1,433 @@
+"""
+An optional asyncio engine, which serves the model endpoints from an ASGI app using Motor, so that a single process can
+keep many requests in flight while it waits for MongoDB. It reads the same `config.yml` as `crudcast.app.CrudcastApp`,
+and uses the same fields and validation. For example, with uvicorn::
+
+    pip install crudcast[async] uvicorn
+    CRUDCAST_CONFIG_FILE=config.yml uvicorn --factory crudcast.aio:create_app
+
+Only the list, create, retrieve, update and delete endpoints of the models are served. Models can only use the `token`
+auth type, and tokens must be issued by a `CrudcastApp` with the same `secret_key`
+"""
+from crudcast.app import CrudcastApp
+from crudcast.exceptions import ValidationError, ConfigException
+from crudcast.mongo import get_client_options, PoolStats, DEFAULT_MAX_POOL_SIZE
+from crudcast.models import Model
+from crudcast.pagination import Paginator, PAGINATION_PARAMS
+from crudcast.users import User
+from pymongo.collection import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import HTTPException, BadRequest, NotFound, MethodNotAllowed
+from flask import abort
+from types import MappingProxyType
+from urllib.parse import parse_qsl, urlencode
+from yaml import load
+import asyncio
+import copy
+import json
+import os
+
+try:
+    import motor.motor_asyncio
+except ImportError:  # pragma: no cover
+    motor = None
+
+
+class AsyncModel(Model):
+    """
+    A model whose database calls are coroutines. The collection must be a Motor collection, or an object with the same
+    interface. Validation that doesn't need the database is shared with `crudcast.models.Model`
+    """
+    async def existing_ids(self, ids):
+        return set(await self.validation_collection.distinct('_id', {'_id': {'$in': list(ids)}}))
+
+    async def get_unique_errors(self, items):
+        query, projection = self.get_unique_query(items)
+        documents = await self.validation_collection.find(query, projection).to_list(None) if query else []
+        return self.match_unique_errors(items, documents)
+
+    async def get_existing_references(self, items):
+        """
+        Looks up the IDs given for the reference fields of a batch of inputs. The related models are queried
+        concurrently
+
+        :rtype: dict
+        """
+        ids = self.get_reference_ids(items)
+        results = await asyncio.gather(*[
+            self.app.get_model(model_name).existing_ids(model_ids) if model_ids else self.no_ids()
+            for model_name, model_ids in ids.items()
+        ])
+        return dict(zip(ids, results))
+
+    @staticmethod
+    async def no_ids():
+        return set()
+
+    async def validate(self, data=None, _id=None):
+        data = self.clean_input(data, _id=_id)
+        unique_errors, existing = await asyncio.gather(
+            self.get_unique_errors([(data, _id)]), self.get_existing_references([data])
+        )
+        if unique_errors[0]:
+            raise ValidationError(errors=unique_errors[0])
+        self.check_references(data, existing=existing)
+        await self.set_auto_fields([(data, _id)])
+        return data
+
+    async def set_auto_fields(self, items):
+        """
+        Sets the values of the model's auto fields. Numbers for `autofield` fields are reserved from the counters
+        collection without blocking - see `reserve`
+        """
+        for f in self.auto_fields:
+            new = [data for data, _id in items if not _id]
+            values = await self.reserve(f, len(new)) if hasattr(f, 'counter_id') else f.set_many(len(new))
+            for data, value in zip(new, values):
+                data[f.name] = value
+
+            if f.auto_update:
+                for data, _id in items:
+                    if _id:
+                        data[f.name] = f.set(_id=_id)
+
+    async def reserve(self, field, count):
+        """
+        The async equivalent of `AutoField.set_many`. The `block_size` option is ignored, as each batch of numbers is
+        reserved with a single update anyway
+
+        :type field: crudcast.fields.AutoField
+        :type count: int
+        :rtype: list
+        """
+        if not count:
+            return []
+
+        if not field.seeded:
+            last = await self.validation_collection.find_one({field.name: {'$type': 'number'}}, {field.name: 1},
+                                                             sort=[(field.name, -1)])
+            if last:
+                await field.counters.update_one({'_id': field.counter_id}, {'$max': {'seq': last[field.name]}},
+                                                upsert=True)
+            field.seeded = True
+
+        counter = await field.counters.find_one_and_update({'_id': field.counter_id}, {'$inc': {'seq': count}},
+                                                           upsert=True, return_document=ReturnDocument.AFTER)
+        first = counter['seq'] - count + 1
+        return list(range(first, first + count))
+
+    async def list(self, args):
+        """
+        Lists the documents that match the query string arguments - see `crudcast.resources.Resource.list_response`
+
+        :param args: query string arguments
+        :type args: dict
+        :return: the serialized documents, and the pagination arguments for the next page, if any
+        :rtype: tuple
+        """
+        args = dict(args)
+        self.check_no_expand(args.pop('expand', None))
+        projection = self.get_projection(args.pop('fields', None))
+        sort = self.get_sort(args.pop('ordering', None))
+        paginator = Paginator.from_args(self, args, sort=sort)
+        q = self.get_query(**args)
+
+        if paginator.enabled:
+            documents = await paginator.get_cursor(q, projection=projection).to_list(None)
+            documents, next_args = paginator.get_result(documents)
+        else:
+            cursor = self.query(q, projection=projection, operation='list')
+            if sort:
+                cursor = cursor.sort(sort)
+            documents, next_args = await cursor.to_list(None), None
+
+        return [self.serialize(document) for document in documents], next_args
+
+    @staticmethod
+    def check_no_expand(expand):
+        if expand:
+            raise ValidationError('Expanding references is not supported by the async engine', field='expand')
+
+    async def retrieve(self, _id, expand=None, projection=None):
+        self.check_no_expand(expand)
+        if projection is None:
+            projection = self.default_projection
+        document = await self.get_read_collection('retrieve').find_one({'_id': self.get_object_id(_id)}, projection)
+        if document is None:
+            abort(404)
+        return self.serialize(document)
+
+    async def create(self, data):
+        data = await self.validate(data)
+        try:
+            obj = await self.collection.insert_one(data)
+        except DuplicateKeyError as err:
+            raise self.get_duplicate_key_error(err)
+        self.invalidate_cache()
+        data['_id'] = obj.inserted_id
+        return self.serialize(data)
+
+    async def update(self, _id, data):
+        object_id = self.get_object_id(_id)
+        try:
+            data = await self.validate(data, _id=_id)
+        except ValidationError:
+            if not await self.existing_ids({object_id}):
+                abort(404)
+            raise
+
+        if data:
+            try:
+                document = await self.collection.find_one_and_update({'_id': object_id}, {'$set': data},
+                                                                     projection=self.default_projection,
+                                                                     return_document=ReturnDocument.AFTER)
+            except DuplicateKeyError as err:
+                raise self.get_duplicate_key_error(err)
+            self.invalidate_cache()
+        else:
+            document = await self.collection.find_one({'_id': object_id}, self.default_projection)
+
+        if document is None:
+            abort(404)
+        return self.serialize(document)
+
+    async def delete(self, _id):
+        result = await self.collection.delete_one({'_id': self.get_object_id(_id)})
+        if not result.deleted_count:
+            abort(404)
+        self.invalidate_cache()
+        return {}
+
+
+class Request(object):
+    """
+    The parts of an ASGI request that are used by the async engine and the auth classes
+    """
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([(key.decode('latin-1'), val.decode('latin-1')) for key, val in scope['headers']])
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+        self.body = body
+
+    @property
+    def json(self):
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise BadRequest('Failed to decode JSON object')
+
+    @property
+    def base_url(self):
+        host = self.headers.get('Host')
+        if not host:
+            server_host, server_port = self.scope['server']
+            host = '%s:%s' % (server_host, server_port)
+        return '%s://%s%s%s' % (self.scope.get('scheme', 'http'), host, self.scope.get('root_path', ''), self.path)
+
+
+class AsyncCrudcastApp(object):
+    """
+    An ASGI app that serves the model endpoints of a `config.yml` with `AsyncModel`. The Motor client is created when
+    the app starts (or on its first request), in the process that serves it
+
+    :param config_file: Local path to a valid `config.yml`
+    :param client: a Motor client, or a stand-in with the same interface. If this isn't provided, one is created from
+                   the `mongo_url` option
+    """
+    user_manager = None
+    user_model = None
+    pool_stats = None
+
+    def __init__(self, config_file, client=None):
+        with open(config_file, 'r') as f:
+            options = load(f.read())
+
+        self.crudcast_config = copy.deepcopy(CrudcastApp.crudcast_config)
+        for key, val in options.items():
+            if key not in ['models', 'methods']:
+                self.crudcast_config[key] = val
+
+        self.models = {}
+        for model_name, model_options in options['models'].items():
+            self.models[model_name] = {
+                'name': model_name,
+                'collection': None,
+                'fields': model_options.pop('fields', {}),
+                'options': model_options
+            }
+
+        if 'users' in options.keys():
+            users = self.crudcast_config['users'] = options['users'] or {}
+            user_config = dict(CrudcastApp.user_config, **users)
+            self.models['user'] = {
+                'name': 'user',
+                'collection': None,
+                'fields': user_config['fields'],
+                'options': user_config['options']
+            }
+
+        self.registry = MappingProxyType({
+            model_name: AsyncModel(model_name, self) for model_name in self.models if model_name != 'user'
+        })
+        if 'users' in self.crudcast_config:
+            self.user_manager = User(app=self, **self.crudcast_config['users'])
+            # the user endpoints aren't served, but `foreignkey` and `manytomany` fields can still refer to users
+            self.user_model = AsyncModel('user', self)
+
+        for model in self.registry.values():
+            auth_type = model.options.get('auth_type')
+            if auth_type and auth_type != 'token':
+                raise ConfigException('%s: the async engine only supports the token auth type' % model.name)
+
+        self.client = None
+        if client is not None:
+            self.connect(client)
+
+    def connect(self, client=None):
+        """
+        Creates the Motor client, with the options in the `mongo` section of the config file, and points every model at
+        its collection. Motor clients belong to the event loop they are first used in, so this is done when the app
+        starts rather than when it is created
+
+        :param client: an existing client to use instead
+        """
+        if client is None:
+            if motor is None:
+                raise ImportError('The async engine requires motor. Install it with `pip install crudcast[async]`')
+            options = get_client_options(self.crudcast_config.get('mongo'))
+            self.pool_stats = PoolStats(max_pool_size=options.get('maxPoolSize', DEFAULT_MAX_POOL_SIZE))
+            client = motor.motor_asyncio.AsyncIOMotorClient(self.crudcast_config['mongo_url'],
+                                                            event_listeners=self.pool_stats.listeners, **options)
+
+        self.client = client
+        db = client[self.crudcast_config['db_name']]
+        for model_name, model in self.models.items():
+            model['collection'] = db[model_name]
+        for model in self.registry.values():
+            model.collection = db[model.name]
+        if self.user_manager:
+            self.user_manager.collection = db[self.user_manager.name]
+            self.user_model.collection = db[self.user_model.name]
+
+    def get_model(self, model_name):
+        """
+        :param model_name: the name of the model, as it appears in the config file. `user` returns a model that is
+                           only used to check references to users
+        :rtype: AsyncModel
+        """
+        if model_name == 'user' and self.user_model is not None:
+            return self.user_model
+        try:
+            return self.registry[model_name]
+        except KeyError:
+            abort(404)
+
+    def match(self, path):
+        """
+        Finds the model and ID, if any, for a request path, e.g. `/api/book/` or `/api/book/<id>/`
+
+        :rtype: tuple
+        """
+        base_path = self.crudcast_config['swagger']['basePath'].rstrip('/') + '/'
+        if not path.startswith(base_path):
+            raise NotFound()
+
+        parts = path[len(base_path):].strip('/').split('/')
+        if len(parts) > 2 or not parts[0] or parts[0] == 'user':
+            raise NotFound()
+        return self.get_model(parts[0]), parts[1] if len(parts) == 2 else None
+
+    async def dispatch(self, request):
+        """
+        Handles a request, and returns the response data and any extra headers
+        """
+        model, _id = self.match(request.path)
+        auth_type = model.get_auth_type()
+        if auth_type:
+            auth_type.authenticate(request=request, user=self.user_manager)
+
+        headers = {}
+        if _id is None and request.method == 'GET':
+            data, next_args = await model.list(request.args.to_dict())
+            if next_args is not None:
+                link_args = {key: val for key, val in request.args.items() if key not in PAGINATION_PARAMS}
+                link_args.update(next_args)
+                headers['Link'] = '<%s?%s>; rel="next"' % (request.base_url, urlencode(link_args))
+        elif _id is None and request.method == 'POST':
+            data = await model.create(request.json)
+        elif _id is not None and request.method == 'GET':
+            data = await model.retrieve(_id, expand=request.args.get('expand'),
+                                        projection=model.get_projection(request.args.get('fields')))
+        elif _id is not None and request.method == 'PUT':
+            data = await model.update(_id=_id, data=request.json)
+        elif _id is not None and request.method == 'DELETE':
+            data = await model.delete(_id)
+        else:
+            raise MethodNotAllowed()
+
+        return data, 200, headers
+
+    async def handle(self, request):
+        """
+        Converts errors into responses, in the same format as the Flask app
+        """
+        try:
+            return await self.dispatch(request)
+        except ValidationError as err:
+            return err.to_dict(), err.status_code, {}
+        except HTTPException as err:
+            return {'message': err.description}, err.code, {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise NotImplementedError('Unsupported ASGI scope: %s' % scope['type'])
+
+        if self.client is None:
+            self.connect()
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        data, status, headers = await self.handle(Request(scope, body))
+        headers['Content-Type'] = 'application/json'
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(key.lower().encode('latin-1'), val.encode('latin-1')) for key, val in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': (json.dumps(data) + '\n').encode('utf-8')})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.client is None:
+                    self.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    self.client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_app(config_file=None):
+    """
+    Creates an ASGI app. If no config file is given, the `CRUDCAST_CONFIG_FILE` environment variable is used, and then
+    `config.yml`
+
+    :param config_file: Local path to a valid `config.yml`
+    :rtype: AsyncCrudcastApp
+    """
+    return AsyncCrudcastApp(config_file or os.environ.get('CRUDCAST_CONFIG_FILE', 'config.yml'))
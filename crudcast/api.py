@@ -1,5 +1,8 @@
 from flask_restplus import Api
-from crudcast.resources import ModelResource, InstanceResource, UserModelResource, UserInstanceResource
+from crudcast.resources import (
+    ModelResource, InstanceResource, BulkResource, CountResource, AggregateResource, UserModelResource,
+    UserInstanceResource, UserTokenResource
+)
 
 
 def get_api(app):
@@ -12,11 +15,19 @@ def get_api(app):
     ir = InstanceResource
     ir.set_app(app)
 
+    br = BulkResource
+    br.set_app(app)
+
     api.add_resource(mr, '%s/<string:model_name>/' % base_path)
+    api.add_resource(br, '%s/<string:model_name>/bulk/' % base_path)
+
+    for resource, path in [(CountResource, 'count'), (AggregateResource, 'aggregate')]:
+        resource.set_app(app)
+        api.add_resource(resource, '%s/<string:model_name>/%s/' % (base_path, path))
     api.add_resource(ir, '%s/<string:model_name>/<string:_id>/' % base_path)
 
     for path, method in app.methods.items():
-        resource = method.get_resource()
+        resource = method.get_api_resource()
         resource.set_app(app)
         api.add_resource(resource, '%s/%s' % (base_path, path))
 
@@ -30,5 +41,15 @@ def get_api(app):
         api.add_resource(umr, '%s/user/' % app.crudcast_config['swagger']['basePath'])
         api.add_resource(uir, '%s/user/<string:_id>/' % app.crudcast_config['swagger']['basePath'])
 
+        utr = UserTokenResource
+        utr.set_app(app)
+
+        api.add_resource(utr, '%s/user/token/' % app.crudcast_config['swagger']['basePath'])
+
+        # `user/<_id>/` would otherwise take precedence over `<model_name>/count/` and `<model_name>/aggregate/`
+        for resource, path in [(CountResource, 'count'), (AggregateResource, 'aggregate')]:
+            api.add_resource(resource, '%s/user/%s/' % (base_path, path), endpoint='user-%s-resource' % path,
+                             defaults={'model_name': 'user'})
+
 
 
@@ -1,11 +1,17 @@
 import pymongo
 from yaml import load
-from flask import Flask
+from flask import Flask, abort
 from flask_swagger_ui import get_swaggerui_blueprint
 from crudcast.models import Model
 from crudcast.users import User
 from crudcast.methods import Method
+from crudcast.indexes import sync_indexes
+from crudcast.swagger import SwaggerDocument
+from crudcast.mongo import get_client_options, PoolStats, DEFAULT_MAX_POOL_SIZE
+from types import MappingProxyType
+import copy
 import os
+import threading
 
 
 class CrudcastApp(Flask):
@@ -45,7 +51,12 @@ class CrudcastApp(Flask):
         }
     }
 
+    registry = MappingProxyType({})  #: compiled `Model` objects, keyed by model name. See `compile_models`
+    swagger_document = None
+
     client = None
+    client_pid = None
+    pool_stats = None
     db = None
 
     def set_crudcast_config(self, config_file):
@@ -61,8 +72,7 @@ class CrudcastApp(Flask):
             if key not in ['models', 'methods']:
                 self.crudcast_config[key] = val
 
-        self.client = pymongo.MongoClient(self.crudcast_config['mongo_url'])
-        self.db = self.client[self.crudcast_config['db_name']]
+        self.connect()
 
         users = options.get('users')
         if not users:
@@ -90,9 +100,123 @@ class CrudcastApp(Flask):
                     'options': self.user_config['options']
                 }
 
+        reload_methods = self.crudcast_config.get('reload_methods', False)
         for method in options.get('methods', []):
             file = os.path.abspath(method.pop('file'))
-            self.methods[method['path']] = Method(file=file, **method)
+            self.methods[method['path']] = Method(file=file, reload=reload_methods, **method)
+
+        if self.crudcast_config.get('preload_methods'):
+            for method in self.methods.values():
+                method.get_resource()
+
+        self.compile_models()
+        self.swagger_document = None
+
+    def connect(self):
+        """
+        Creates a new `MongoClient` with the options in the `mongo` section of the config file (see
+        `crudcast.mongo.get_client_options`), and points every model at its collection in the new client's database.
+
+        The client only connects when it is first used. A `MongoClient` must not be used in more than one process, so a
+        new one is created for each request handled by a process other than the one that created the client - see
+        `check_connection`. The client being replaced is closed if it was created by this process. A client inherited
+        from the parent process is dropped without closing it, as its sockets are shared with the parent
+        """
+        old_client, old_client_pid = self.client, self.client_pid
+        options = get_client_options(self.crudcast_config.get('mongo'))
+        self.pool_stats = PoolStats(max_pool_size=options.get('maxPoolSize', DEFAULT_MAX_POOL_SIZE))
+        self.client = pymongo.MongoClient(self.crudcast_config['mongo_url'], connect=False,
+                                          event_listeners=self.pool_stats.listeners, **options)
+        self.client_pid = os.getpid()
+        self.db = self.client[self.crudcast_config['db_name']]
+
+        for model_name, model in self.models.items():
+            model['collection'] = self.db[model_name]
+        for model in self.registry.values():
+            model.collection = self.db[model.name]
+        if self.user_manager:
+            self.user_manager.collection = self.db[self.user_manager.name]
+
+        if old_client is not None and old_client_pid == self.client_pid:
+            old_client.close()
+
+    def check_connection(self):
+        """
+        Creates a new client if the app has been forked since the current one was created, e.g. by a WSGI server's
+        `--preload` option. This runs before every request, so the check is repeated under a lock to make sure that
+        concurrent requests in a threaded worker create a single client
+        """
+        if self.client_pid != os.getpid():
+            with self.connection_lock:
+                if self.client_pid != os.getpid():
+                    self.connect()
+
+    def get_stats(self):
+        """
+        Returns statistics for monitoring the current process: the MongoDB connection pool (see
+        `crudcast.mongo.PoolStats`), the user manager's `auth_cache` and the response cache of each model that has one
+
+        :rtype: dict
+        """
+        stats = {
+            'pid': os.getpid(),
+            'mongo': self.pool_stats.snapshot() if self.pool_stats else None,
+        }
+        if self.user_manager and self.user_manager.auth_cache is not None:
+            stats['auth_cache'] = self.user_manager.auth_cache.stats()
+        stats['cache'] = {
+            model.name: model.cache.stats() for model in self.registry.values() if model.cache is not None
+        }
+        return stats
+
+    def compile_models(self):
+        """
+        Builds a `Model` for each entry in `self.models` and stores them in `self.registry`. This is done once, when
+        the config is loaded, so that requests don't have to rebuild the fields of each model (and its related models)
+        every time they are handled
+        """
+        self.registry = MappingProxyType({model_name: Model(model_name, self) for model_name in self.models})
+
+    def get_model(self, model_name):
+        """
+        Returns the compiled model with the given name, or raises a 404 error if there is no such model. The `user`
+        model is the user manager, so that references to users are read and serialized without their passwords
+
+        :param model_name: the name of the model, as it appears in the config file
+        :rtype: crudcast.models.Model
+        """
+        if model_name == 'user' and self.user_manager is not None:
+            return self.user_manager
+        try:
+            return self.registry[model_name]
+        except KeyError:
+            abort(404)
+
+    def sync_indexes(self, dry_run=False):
+        """
+        Creates the indexes declared in the config file (see `crudcast.indexes.get_indexes`) for every model
+
+        :param dry_run: if True, report what would be done without creating anything
+        :return: a list of `(model name, index, status)` tuples
+        :rtype: list
+        """
+        models = dict(self.registry)
+        if self.user_manager:
+            models['user'] = self.user_manager
+
+        report = []
+        for model_name, model in models.items():
+            report += [(model_name, index, status) for index, status in sync_indexes(model, dry_run=dry_run)]
+        return report
+
+    def get_ordering_warnings(self):
+        """
+        Returns a warning for each field that can be ordered by, but can't be sorted using an index (see
+        `Model.get_ordering_warnings`)
+
+        :rtype: list
+        """
+        return [warning for model in self.registry.values() for warning in model.get_ordering_warnings()]
 
     def get_tag(self, model):
         """
@@ -113,19 +237,17 @@ class CrudcastApp(Flask):
         :type model: crudcast.models.Model
         :rtype: dict
         """
-        parameters = []
-
         auth_type = model.options.get('auth_type')
 
-        for field in model.fields:
-            parameter = {
-                'name': field.name,
-                'in': 'query',
-                'description': 'Filter for %s objects based on %s' % (model.name, field.name),
-                'required': False,
-            }
-
-            parameters.append(parameter)
+        parameters = self.get_filter_parameters(model) + self.get_read_parameters(model)
+        parameters.append({
+            'name': 'ordering',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Comma separated list of the fields to sort by. Prefix a field with `-` to sort it in '
+                           'descending order',
+        })
 
         post_parameters = [
             {
@@ -156,7 +278,7 @@ class CrudcastApp(Flask):
                 },
                 'security': [
                     {
-                        'basicAuth': []
+                        '%sAuth' % auth_type: []
                     }
                 ] if auth_type else []
             },
@@ -176,12 +298,125 @@ class CrudcastApp(Flask):
                 },
                 'security': [
                     {
-                        'basicAuth': []
+                        '%sAuth' % auth_type: []
                     }
                 ] if auth_type else []
             }
         }
 
+    def get_filter_parameters(self, model):
+        """
+        Returns a query parameter for filtering on each of the model's fields
+
+        :type model: crudcast.models.Model
+        :rtype: list
+        """
+        return [
+            {
+                'name': field.name,
+                'in': 'query',
+                'description': 'Filter for %s objects based on %s' % (model.name, field.name),
+                'required': False,
+            } for field in model.fields
+        ]
+
+    def get_count_path(self, model):
+        """
+        Returns the path entry for counting objects
+
+        :type model: crudcast.models.Model
+        :rtype: dict
+        """
+        auth_type = model.options.get('auth_type')
+        return {
+            'get': {
+                'tags': [model.name],
+                'summary': 'Count the %s objects that match the filters' % model.name,
+                'produces': 'application/json',
+                'parameters': self.get_filter_parameters(model),
+                'responses': {
+                    '200': {
+                        'description': 'the number of matching objects, as `{"count": <number>}`',
+                    }
+                },
+                'security': [{'%sAuth' % auth_type: []}] if auth_type else []
+            }
+        }
+
+    def get_aggregate_path(self, model):
+        """
+        Returns the path entry for aggregating objects
+
+        :type model: crudcast.models.Model
+        :rtype: dict
+        """
+        auth_type = model.options.get('auth_type')
+        parameters = [
+            {
+                'name': 'group_by',
+                'in': 'query',
+                'type': 'string',
+                'required': True,
+                'description': 'Comma separated list of the fields to group by',
+            },
+            {
+                'name': 'metric',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Comma separated list of metrics: `count`, or `sum`, `avg`, `min` or `max` followed by '
+                               'a field name, e.g. `count,avg:price`. Defaults to `count`',
+            },
+        ]
+        return {
+            'get': {
+                'tags': [model.name],
+                'summary': 'Group the %s objects that match the filters, and compute metrics for each group'
+                           % model.name,
+                'produces': 'application/json',
+                'parameters': parameters + self.get_filter_parameters(model),
+                'responses': {
+                    '200': {
+                        'description': 'a row for each group, with the values of the `group_by` fields and the '
+                                       'metrics',
+                    }
+                },
+                'security': [{'%sAuth' % auth_type: []}] if auth_type else []
+            }
+        }
+
+    def get_read_parameters(self, model):
+        """
+        Returns the query parameters that control how objects are read: `fields`, and `expand` for models that have
+        reference fields
+
+        :type model: crudcast.models.Model
+        :rtype: list
+        """
+        parameters = [
+            {
+                'name': 'fields',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Comma separated list of the fields to return',
+            }
+        ]
+
+        references = [field.name for field in model.fields if field.is_reference]
+        if references:
+            parameters.append({
+                'name': 'expand',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Comma separated list of reference fields (%s) to replace with the related objects. '
+                               'Fields of related objects can be expanded with `field.related_field`'
+                               % ', '.join(references),
+            })
+
+        return parameters
+
     def get_definition(self, model):
         """
         Returns the model definition based on the model's fields
@@ -245,7 +480,7 @@ class CrudcastApp(Flask):
             'get': {
                 'tags': [model.name],
                 'summary': 'Retrieve a %s object' % model.name,
-                'parameters': parameters,
+                'parameters': parameters + self.get_read_parameters(model),
                 'consumes': 'application/json',
                 'produces': 'application/json',
                 'responses': {
@@ -289,44 +524,171 @@ class CrudcastApp(Flask):
             }
         }
 
+    def get_bulk_path(self, model):
+        """
+        Returns the path entries for bulk calls, which create, update or delete a list of objects
+
+        :type model: crudcast.models.Model
+        :rtype: dict
+        """
+        auth_type = model.options.get('auth_type')
+        security = [{'%sAuth' % auth_type: []}] if auth_type else []
+        responses = {
+            '200': {
+                'description': 'the result of each item, in the order given. Each result has a `status`, and either '
+                               'the object as `data`, or `errors`',
+            },
+            '400': {
+                'description': 'the input is not a list, or has more than %d items' % model.max_bulk_size,
+            }
+        }
+
+        def get_body(description, schema):
+            return [
+                {
+                    'name': 'body',
+                    'in': 'body',
+                    'required': True,
+                    'description': description,
+                    'schema': {
+                        'type': 'array',
+                        'items': schema,
+                    }
+                }
+            ]
+
+        model_schema = {'$ref': '#/definitions/%s' % model.name}
+
+        return {
+            'post': {
+                'tags': [model.name],
+                'summary': 'Create a list of %s objects' % model.name,
+                'consumes': 'application/json',
+                'produces': 'application/json',
+                'parameters': get_body('New %s objects' % model.name, model_schema),
+                'responses': responses,
+                'security': security,
+            },
+            'patch': {
+                'tags': [model.name],
+                'summary': 'Update a list of %s objects' % model.name,
+                'consumes': 'application/json',
+                'produces': 'application/json',
+                'parameters': get_body('%s objects, each including its `_id`' % model.name, model_schema),
+                'responses': responses,
+                'security': security,
+            },
+            'delete': {
+                'tags': [model.name],
+                'summary': 'Delete a list of %s objects' % model.name,
+                'consumes': 'application/json',
+                'produces': 'application/json',
+                'parameters': get_body('IDs of %s objects' % model.name, {'type': 'string'}),
+                'responses': responses,
+                'security': security,
+            }
+        }
+
     def get_security_definitions(self):
         return {
                 'basicAuth': {
                     'type': 'basic',
+                },
+                'tokenAuth': {
+                    'type': 'apiKey',
+                    'in': 'header',
+                    'name': 'Authorization',
+                    'description': 'A token from the `/user/token/` endpoint, in the format `Bearer <token>`'
                 }
         }
 
-    @property
-    def swagger_config(self):
+    def get_token_path(self):
         """
-        Retrieves the complete swagger configuration
+        Returns the path entry for the endpoint that issues auth tokens
+
+        :rtype: dict
+        """
+        return {
+            'post': {
+                'tags': ['user'],
+                'summary': 'Get an auth token for use with the `token` auth type',
+                'consumes': 'application/json',
+                'produces': 'application/json',
+                'parameters': [
+                    {
+                        'name': 'body',
+                        'in': 'body',
+                        'required': True,
+                        'description': 'Username and password',
+                        'schema': {
+                            '$ref': '#/definitions/user'
+                        }
+                    }
+                ],
+                'responses': {
+                    '200': {
+                        'description': 'a token, and the number of seconds for which it is valid',
+                    },
+                    '401': {
+                        'description': 'invalid username or password',
+                    }
+                }
+            }
+        }
+
+    def build_swagger_config(self):
+        """
+        Builds the complete swagger configuration
 
         :rtype: dict
         """
-        config = self.crudcast_config['swagger']
+        config = copy.deepcopy(self.crudcast_config['swagger'])
         tags = []
         paths = {}
         definitions = {}
 
-        for model_name, model_attrs in self.models.items():
-            model = Model(model_name, self)
+        for model_name, model in self.registry.items():
             tags.append(self.get_tag(model))
             paths['/%s/' % model_name] = self.get_model_path(model)
             paths['/%s/{_id}/' % model_name] = self.get_instance_path(model)
+            paths['/%s/bulk/' % model_name] = self.get_bulk_path(model)
+            paths['/%s/count/' % model_name] = self.get_count_path(model)
+            paths['/%s/aggregate/' % model_name] = self.get_aggregate_path(model)
             definitions[model.name] = self.get_definition(model)
 
         for method_path, method in self.methods.items():
             paths['/' + method_path] = method.swagger_definition
 
+        if self.user_manager:
+            paths['/user/token/'] = self.get_token_path()
+            config['securityDefinitions'] = self.get_security_definitions()
+
         config['tags'] = tags
         config['paths'] = paths
         config['definitions'] = definitions
 
-        if self.user_manager:
-            config['securityDefinitions'] = self.get_security_definitions()
-
         return config
 
+    def get_swagger_document(self):
+        """
+        Returns the swagger document. It is only built once, and is rebuilt when the config is reloaded, or when a
+        method's file changes in `reload_methods` mode
+
+        :rtype: crudcast.swagger.SwaggerDocument
+        """
+        if self.swagger_document is None or any(method.is_stale() for method in self.methods.values()):
+            self.swagger_document = SwaggerDocument(self.build_swagger_config())
+        return self.swagger_document
+
+    @property
+    def swagger_config(self):
+        """
+        Retrieves the complete swagger configuration
+
+        :rtype: dict
+        """
+        return self.get_swagger_document().config
+
     def get_swagger_ui_view(self):
         """
         Creates a swagger view using `flask_swagger_ui`
@@ -339,12 +701,14 @@ class CrudcastApp(Flask):
         )
 
     def __init__(self, import_name, config_file, **kwargs):
+        self.connection_lock = threading.Lock()
         self.set_crudcast_config(config_file)
 
         if 'users' in self.crudcast_config.keys():
             self.user_manager = User(app=self, **self.crudcast_config['users'])
 
         super().__init__(import_name, **kwargs)
+        self.before_request(self.check_connection)
 
 
 
@@ -11,16 +11,60 @@ class BaseAuthHandler(object):
 class BasicAuth(object):
     @classmethod
     def authenticate(cls, request, user):
+        """
+        Authenticates a request using the `Authorization` header. Verified credentials are cached by the user manager
+        (see `crudcast.users.User.auth_cache`), so password hashes only need to be checked on the first request
+        """
         auth_header = request.headers.get('Authorization')
 
         if not auth_header:
             abort(401)
 
-        enc = auth_header.split()[1]
-        decoded = base64.b64decode(enc.encode())
-        username, password = decoded.decode().split(':')
+        cache = user.auth_cache
+        if cache is not None:
+            key = user.get_credentials_key(auth_header)
+            cached_user = cache.get(key)
+            if cached_user is not None:
+                return cached_user
+
+        try:
+            enc = auth_header.split()[1]
+            decoded = base64.b64decode(enc.encode())
+            username, password = decoded.decode().split(':', 1)
+        except (IndexError, ValueError):
+            abort(401)
+
+        authenticated_user = user.authenticate(username, password)
+        if cache is not None:
+            cache.set(key, authenticated_user)
+
+        return authenticated_user
+
 
-        return user.authenticate(username, password)
 
 
 
+class TokenAuth(object):
+    @classmethod
+    def authenticate(cls, request, user):
+        """
+        Authenticates a request using a signed token in the `Authorization: Bearer <token>` header. Tokens are issued by
+        `crudcast.users.User.issue_token`, and are verified without a database lookup
+
+        :return: the token payload - the user's `_id` and username
+        :rtype: dict
+        """
+        auth_header = request.headers.get('Authorization')
+
+        if not auth_header:
+            abort(401)
+
+        try:
+            scheme, token = auth_header.split()
+        except ValueError:
+            abort(401)
+
+        if scheme.lower() != 'bearer':
+            abort(401)
+
+        return user.verify_token(token)
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from crudcast.exceptions import ConfigException
+import importlib
+import os
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    A bounded, thread-safe, in-process cache. Entries expire `ttl` seconds after they are set, and once the cache
+    holds `max_entries` entries, the least recently used entry is evicted to make room for a new one
+
+    :param ttl: number of seconds for which entries are kept
+    :param max_entries: the maximum number of entries
+    :param timer: function that returns the current time in seconds. Defaults to `time.monotonic`
+    """
+    def __init__(self, ttl=60, max_entries=1000, timer=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timer = timer
+        self.entries = OrderedDict()  # key -> (expiry time, value), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for `key`, or `default` if there isn't one, or it has expired
+        """
+        with self.lock:
+            try:
+                expires, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= self.timer():
+                del self.entries[key]
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.timer() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose value matches a predicate
+
+        :param predicate: a function that takes a cached value and returns True if it should be removed
+        """
+        with self.lock:
+            for key in [key for key, (expires, value) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the number of hits, misses and entries, and the hit rate
+
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
+
+
+def load_backend(path):
+    """
+    Imports a cache backend class from a dotted path, e.g. `myapp.cache.RedisCache`
+
+    :type path: str
+    """
+    module_name, sep, name = path.rpartition('.')
+    try:
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError):
+        raise ConfigException('Unable to import cache backend: %s' % path)
+
+
+def get_backend(options):
+    """
+    Creates the backend for a model's `cache` option. By default, this is an in-process `TTLCache`. A shared backend
+    can be given as a dotted path in `backend`; the other options are passed to its constructor. A backend must
+    implement `get(key)` and `set(key, value)`, like `TTLCache`. Keys are strings, and values are JSON-serializable
+
+    :param options: the `cache` option, e.g. `{'ttl': 30, 'max_entries': 10000}`
+    :type options: dict
+    """
+    options = dict(options)
+    backend_class = load_backend(options.pop('backend')) if 'backend' in options else TTLCache
+    try:
+        return backend_class(**options)
+    except TypeError as err:
+        raise ConfigException('Invalid cache options: %s' % err)
+
+
+class ResponseCache(object):
+    """
+    Caches the responses of a model's GET endpoints. Each key includes the model's current generation, which is
+    replaced whenever the model is written to (see `invalidate`), so that every response cached before the write is
+    no longer used. The generation is stored in the backend, so writes in one process invalidate the responses
+    cached by all the others, if the backend is shared
+
+    :param name: the model name
+    :param backend: see `get_backend`
+    """
+    def __init__(self, name, backend):
+        self.name = name
+        self.backend = backend
+        self.generation_key = 'crudcast:%s:generation' % name
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_key(self, *parts):
+        """
+        Returns the key for a response, in the current generation. The key must be taken before the response is read
+        from the database, so that a response that is read during a write is never used afterwards
+
+        :param parts: e.g. the ID of a document, or the normalised query string of a list
+        :rtype: str
+        """
+        generation = self.backend.get(self.generation_key)
+        if generation is None:
+            generation = self.new_generation()
+        return 'crudcast:%s:%s:%s' % (self.name, generation, ':'.join(parts))
+
+    def new_generation(self):
+        generation = os.urandom(8).hex()
+        self.backend.set(self.generation_key, generation)
+        return generation
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def invalidate(self):
+        """
+        Stops every response cached so far from being used. They are evicted from the backend in time
+        """
+        self.new_generation()
+        with self.lock:
+            self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns the number of hits, misses and invalidations, and the hit rate
+
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
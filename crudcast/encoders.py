@@ -0,0 +1,92 @@
+import base64
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+
+
+def identity(value):
+    return value
+
+
+def encode_document(document):
+    """
+    Converts a MongoDB document (or subdocument) into a JSON-serializable dict
+
+    :type document: dict
+    :rtype: dict
+    """
+    return {key: encode(val) for key, val in document.items()}
+
+
+def encode_list(values):
+    return [encode(val) for val in values]
+
+
+def encode_decimal128(value):
+    # converted via `str` rather than `float`, so that no precision is lost
+    return str(value.to_decimal())
+
+
+def encode_bytes(value):
+    return base64.b64encode(value).decode()
+
+
+def encode_datetime(value):
+    return value.isoformat()
+
+
+converters = {
+    str: identity,
+    int: identity,
+    float: identity,
+    bool: identity,
+    type(None): identity,
+    dict: encode_document,
+    list: encode_list,
+    tuple: encode_list,
+    ObjectId: str,
+    datetime: encode_datetime,
+    date: encode_datetime,
+    Decimal128: encode_decimal128,
+    Decimal: str,
+    UUID: str,
+    bytes: encode_bytes,
+}  #: maps a type to the function that converts it to JSON. Subclasses use the converter of their nearest base class
+
+_cache = dict(converters)
+
+
+def get_converter(cls):
+    """
+    Returns the converter for the given type. The result is cached, so the type's MRO is only looked up once
+
+    :type cls: type
+    :rtype: function
+    """
+    try:
+        return _cache[cls]
+    except KeyError:
+        pass
+
+    converter = str
+    for base in cls.__mro__:
+        if base in converters:
+            converter = converters[base]
+            break
+
+    _cache[cls] = converter
+    return converter
+
+
+def encode(value):
+    """
+    Converts a BSON value into a JSON-serializable value. Object IDs, UUIDs and decimals become strings, dates become
+    ISO 8601 strings, binary data becomes a base64 string, and arrays and subdocuments are converted recursively. Any
+    other type that isn't JSON-serializable is converted using `str`
+
+    :rtype: str, int, float, bool, None, list or dict
+    """
+    cls = type(value)
+    return (_cache.get(cls) or get_converter(cls))(value)
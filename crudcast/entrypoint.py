@@ -1,14 +1,10 @@
-from crudcast.api import get_api
 import argparse
 from crudcast.app import CrudcastApp
-from crudcast.exceptions import ValidationError, handle_invalid_usage
-import json
+from crudcast.wsgi import configure_app
+from crudcast.server import serve
 import getpass
 
 
-SWAGGER_URL = '/api/docs'  # URL for exposing Swagger UI (without trailing '/')
-
-
 def main():
     parser = argparse.ArgumentParser(description='Process some integers.')
     cf = parser.add_argument('--config-file', help='Path to yml config file', dest='config_file', default='config.yml')
@@ -19,6 +15,14 @@ def main():
                         action='store_true')
     parser.add_argument('--debug', help='Debug mode', dest='debug', default=False, type=bool)
     parser.add_argument('--import-name', help='Flask app import name', dest='import_name', default='Crudcast')
+    parser.add_argument('--sync-indexes', help='Create the indexes declared in the config file, then exit',
+                        dest='sync_indexes', default=False, action='store_true')
+    parser.add_argument('--dry-run', help='With --sync-indexes, list the indexes without creating them',
+                        dest='dry_run', default=False, action='store_true')
+    parser.add_argument('--workers', help='Number of worker processes. If this or --threads is given, a production '
+                        'server is used instead of the Flask development server', dest='workers', default=None, type=int)
+    parser.add_argument('--threads', help='Number of threads per worker process', dest='threads', default=None,
+                        type=int)
 
     args = parser.parse_args()
     create_admin = args.create_admin
@@ -48,17 +52,15 @@ def main():
         user_manager.create({'username': username, 'password': password})
         return 'Created user %s' % username
 
+    elif args.sync_indexes:
+        for model_name, index, status in app.sync_indexes(dry_run=args.dry_run):
+            print('%s: %s %s' % (model_name, index, status))
+
     else:
         load_dotenv = not args.no_load_dotenv
+        configure_app(app)
 
-        get_api(app)
-        app.register_error_handler(ValidationError, handle_invalid_usage)
-
-        app.register_blueprint(app.get_swagger_ui_view(), url_prefix=SWAGGER_URL)
-
-        @app.route('/swagger')
-        def swagger_file():
-            return json.dumps(app.swagger_config)
-
-        app.run(host=host, port=port, debug=debug, load_dotenv=load_dotenv)
-
+        if args.workers or args.threads:
+            serve(app, host=host, port=port, workers=args.workers or 1, threads=args.threads or 1)
+        else:
+            app.run(host=host, port=port, debug=debug, load_dotenv=load_dotenv)
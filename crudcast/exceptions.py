@@ -13,20 +13,25 @@ class ValidationError(BadRequest):
     :param message: The error message
     :param field: The name of the field that raised the exception, if applicable
     :param status_code: allows overwriting of the default bad request status code, 400
+    :param errors: if more than one field is invalid, a dict of error messages keyed by field name. If provided,
+                   `message` and `field` are ignored
     """
     status_code = 400
 
-    def __init__(self, message, field=None, status_code=None):
+    def __init__(self, message=None, field=None, status_code=None, errors=None):
         Exception.__init__(self)
         self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.field = field
+        self.errors = errors
 
     def to_dict(self):
         """
         Returns a REST-friendly API response
         """
+        if self.errors:
+            return dict(self.errors)
         return {self.field: self.message}
 
 
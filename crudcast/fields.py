@@ -1,8 +1,14 @@
 from datetime import datetime
 from crudcast.exceptions import ValidationError
-from pymongo.collection import ObjectId
+from crudcast.filters import parse_bool
+from pymongo.collection import ObjectId, ReturnDocument
 from bson.errors import InvalidId
-from werkzeug.exceptions import NotFound
+import threading
+import os
+
+
+COUNTERS_COLLECTION = 'crudcast_counters'  #: stores the last number handed out by each `AutoField`
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')  #: accepted by `AutoDateTimeField.parse`
 
 
 class BaseField(object):
@@ -12,11 +18,12 @@ class BaseField(object):
     :param name: Field name.
     :param model: the Model object to which the field belongs
     :type model: `models.Model`
-    :param options: field options. The available options vary based on field type. Only the `required` and `unique`
-                    options are implemented at this level
+    :param options: field options. The available options vary based on field type. Only the `required`, `unique`
+                    and `index` options are implemented at this level
 
     """
     auto = False  # if an autofield, this value is `True`
+    is_reference = False  # if the field refers to documents in another collection, this value is `True`
     type = ''  # used by swagger
 
     def __init__(self, name, model, **options):
@@ -24,6 +31,7 @@ class BaseField(object):
         self.model = model
         self.required = options.get('required', False)
         self.unique = options.get('unique', False)
+        self.index = options.get('index', False)
 
     def validate(self, data, _id=None):
         """
@@ -36,6 +44,36 @@ class BaseField(object):
 
         :rtype: dict
         """
+        self.check_unique(data, _id=_id)
+        return self.clean(data)
+
+    def clean(self, data):
+        """
+        Validates the input without querying the database. Field types that only accept certain inputs should extend
+        this method
+
+        :param data: data to validate
+        :rtype: dict
+        """
+        return data
+
+    def parse(self, value):
+        """
+        Converts a query string value into the type that the field stores in the database, so that it can be used to
+        filter on the field. Field types that don't store strings should extend this method
+
+        :param value: the query string value
+        :type value: str
+        """
+        return value
+
+    def check_unique(self, data, _id=None):
+        """
+        If the field is `unique`, checks that no other document has the same value
+
+        :param data: data to validate
+        :param _id: ID as a string, or None in case of new objects
+        """
         if self.unique:
             query = {self.name: data}
             if _id:
@@ -45,10 +83,9 @@ class BaseField(object):
                 """
                 query['_id'] = {'$not': {'$eq': ObjectId(_id)}}
 
-            if self.model.collection.find(query).count() > 0:
+            if self.model.exists_where(query):
                 raise ValidationError('%s with this %s already exists' % (self.model.name, self.name),
                                       field=self.name)
-        return data
 
 
 class AutoBaseField(BaseField):
@@ -58,6 +95,7 @@ class AutoBaseField(BaseField):
     manually will generate a ValidationError
     """
     auto = True
+    auto_update = True  # if `False`, `.set()` is only called when the object is created
 
     def get_original(self, _id):
         """
@@ -78,12 +116,25 @@ class AutoBaseField(BaseField):
         """
         raise NotImplementedError()
 
+    def set_many(self, count):
+        """
+        Returns the values for `count` new objects that are created at once. Fields that can generate several values
+        more cheaply than calling `.set()` repeatedly should extend this method
+
+        :type count: int
+        :rtype: list
+        """
+        return [self.set() for i in range(count)]
+
     def validate(self, data, _id=None):
         """
         Any attempt to set the value of an auto field will raise a validation error
         """
         raise ValidationError('Auto fields cannot be set manually', field=self.name)
 
+    def clean(self, data):
+        raise ValidationError('Auto fields cannot be set manually', field=self.name)
+
 
 class StringField(BaseField):
     """
@@ -100,11 +151,10 @@ class StringField(BaseField):
     def __init__(self, name, **options):
         super(StringField, self).__init__(name, **options)
 
-    def validate(self, data, _id=None):
+    def clean(self, data):
         """
         Validates that the input value is a string
         """
-        data = super().validate(data, _id=_id)
         try:
             assert isinstance(data, str)
         except AssertionError:
@@ -126,11 +176,10 @@ class DateTimeField(BaseField):
         self.format_string = options.get('format_string', '%Y-%m-%d %H:%M:%S.%f')
         super(DateTimeField, self).__init__(name, **options)
 
-    def validate(self, data, _id=None):
+    def clean(self, data):
         """
         Validates the input string by asserting that the time format is valid
         """
-        data = super().validate(data, _id=_id)
         try:
             datetime.strptime(data, self.format_string)
         except ValueError as err:
@@ -144,11 +193,10 @@ class NumberField(BaseField):
     """
     type = 'number'
 
-    def validate(self, data, _id=None):
+    def clean(self, data):
         """
         Asserts that the input is numeric
         """
-        data = super().validate(data, _id=_id)
         try:
             assert isinstance(data, (int, float, complex))
         except AssertionError:
@@ -156,21 +204,117 @@ class NumberField(BaseField):
 
         return data
 
+    def parse(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+
+        try:
+            return float(value)
+        except ValueError:
+            raise ValidationError('Must be a number', field=self.name)
+
 
 class AutoField(AutoBaseField):
     """
     An auto field, e.g. one that creates a sequential number, e.g. 1, 2, 3, etc. Cannot be set manually - fields that
     extend this must implement the `.set()` method
+
+    Numbers are handed out by an atomic counter, stored in the `crudcast_counters` collection, so they are never
+    repeated - even when several processes create objects at the same time, or objects are deleted.
+
+    :param name: field name
+    :param block_size: if greater than 1, each process reserves this many numbers at once and hands them out from
+                       memory, which saves a database call on most inserts. Numbers are then unique but not
+                       necessarily in order of creation, and unused numbers are skipped when the process stops
+    :type block_size: int
     """
+    auto_update = False
+
+    def __init__(self, name, model, **options):
+        super(AutoField, self).__init__(name, model, **options)
+        self.index = options.get('index', True)
+        self.block_size = options.get('block_size', 1)
+        self.lock = threading.Lock()
+        self.seeded = False
+        self.block = None  # (pid, next value, last value) of the numbers reserved by this process
+
+    def parse(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError('Must be a whole number', field=self.name)
+
+    @property
+    def counter_id(self):
+        return '%s.%s' % (self.model.name, self.name)
+
+    @property
+    def counters(self):
+        return self.model.collection.database[COUNTERS_COLLECTION]
+
+    def seed(self):
+        """
+        Makes sure that the counter starts after the highest number already in the collection, so that collections
+        created before the counter existed don't get duplicate numbers
+        """
+        with self.lock:
+            if self.seeded:
+                return
+
+            last = self.model.validation_collection.find_one({self.name: {'$type': 'number'}}, {self.name: 1},
+                                                             sort=[(self.name, -1)])
+            if last:
+                self.counters.update_one({'_id': self.counter_id}, {'$max': {'seq': last[self.name]}}, upsert=True)
+            self.seeded = True
+
+    def reserve(self, count):
+        """
+        Atomically reserves `count` numbers, and returns the first of them
+
+        :type count: int
+        :rtype: int
+        """
+        counter = self.counters.find_one_and_update({'_id': self.counter_id}, {'$inc': {'seq': count}}, upsert=True,
+                                                    return_document=ReturnDocument.AFTER)
+        return counter['seq'] - count + 1
 
     def set(self, _id=None):
         """
-        Returns the collection length + 1 when the object is created
+        Returns the next number in the sequence when the object is created
         """
         if _id:
             return self.get_original(_id)
-        else:
-            return self.model.collection.find({}).count() + 1
+
+        if not self.seeded:
+            self.seed()
+
+        if self.block_size <= 1:
+            return self.reserve(1)
+
+        with self.lock:
+            pid = os.getpid()
+            if self.block is None or self.block[0] != pid or self.block[1] > self.block[2]:
+                first = self.reserve(self.block_size)
+                self.block = (pid, first, first + self.block_size - 1)
+
+            pid, value, last = self.block
+            self.block = (pid, value + 1, last)
+            return value
+
+    def set_many(self, count):
+        """
+        Reserves the numbers for a batch of new objects with a single counter update
+        """
+        if self.block_size > 1 or count <= 1:
+            return super().set_many(count)
+
+        if not self.seeded:
+            self.seed()
+
+        first = self.reserve(count)
+        return list(range(first, first + count))
 
 
 class AutoDateTimeField(AutoBaseField):
@@ -181,6 +325,18 @@ class AutoDateTimeField(AutoBaseField):
         """
         super(AutoDateTimeField, self).__init__(name, model, **options)
         self.create_only = options.get('create_only', False)
+        self.auto_update = not self.create_only
+
+    def parse(self, value):
+        """
+        Accepts dates and times in ISO format, e.g. `2018-12-10`, `2018-12-10T15:00:00` or `2018-12-10T15:00:00.123000`
+        """
+        for format_string in DATETIME_FORMATS:
+            try:
+                return datetime.strptime(value, format_string)
+            except ValueError:
+                pass
+        raise ValidationError('Must be a date or time in ISO format', field=self.name)
 
     def set(self, _id=None):
         """
@@ -188,7 +344,9 @@ class AutoDateTimeField(AutoBaseField):
         and the value of `self.create_only` is `True`, then the date/time will be updated to the current time
         """
         if not self.create_only or not _id:
-            return datetime.utcnow()
+            # MongoDB stores times with millisecond precision
+            now = datetime.utcnow()
+            return now.replace(microsecond=now.microsecond // 1000 * 1000)
         else:
             return self.get_original(_id)
 
@@ -200,17 +358,19 @@ class BooleanField(BaseField):
     """
     type = 'boolean'
 
-    def validate(self, data, _id=None):
+    def clean(self, data):
         """
         Checks that the input value is a Boolean
         """
-        data = super().validate(data, _id=_id)
         try:
             assert data in [True, False]
         except AssertionError:
             raise ValidationError('Input must be true or false', field=self.name)
         return data
 
+    def parse(self, value):
+        return parse_bool(value, self.name)
+
 
 class ForeignKeyField(BaseField):
     """
@@ -221,6 +381,7 @@ class ForeignKeyField(BaseField):
     :param to:  the related model's name
     """
     type = 'object'
+    is_reference = True
 
     def get_related(self, related_model_name):
         """
@@ -229,36 +390,110 @@ class ForeignKeyField(BaseField):
         :param related_model_name: the name of another model in the app
         :rtype: crudcast.models.Model
         """
-        from crudcast.models import Model
-        return Model(name=related_model_name, app=self.model.app)
+        return self.model.app.get_model(related_model_name)
 
     def __init__(self, name, model, **options):
         super(ForeignKeyField, self).__init__(name, model, **options)
-        self.related = self.get_related(options['to'])
+        self.to = options['to']
+        self.index = options.get('index', True)
 
-    def validate(self, data, _id=None):
+    @property
+    def related(self):
         """
-        Checks to see if a document in the related model's collection matches the ID provided as `data`
+        The related model. This is resolved lazily from the app's model registry, so that models can refer to each
+        other (or to themselves) without being compiled recursively
+        """
+        return self.get_related(self.to)
+
+    def get_ids(self, data):
+        """
+        Returns the IDs referred to by the input
+
+        :rtype: list
+        """
+        return [data]
+
+    def clean(self, data):
+        """
+        Checks that the input is a valid ID
         """
-        data = super().validate(data, _id=_id)
         try:
-            self.related.retrieve(data)
-        except InvalidId:
+            ObjectId(data)
+        except (InvalidId, TypeError):
             raise ValidationError('Invalid id', field=self.name)
-        except NotFound:
-            raise ValidationError('Cannot find %s with ID %s' % (self.related.name, data), field=self.name)
+        return data
 
+    def validate(self, data, _id=None):
+        """
+        Checks to see if a document in the related model's collection matches the ID provided as `data`
+        """
+        data = super().validate(data, _id=_id)
+        self.check_references(data)
         return data
 
+    def check_references(self, data, existing=None):
+        """
+        Checks that every ID in the input refers to a document in the related model's collection
+
+        :param data: the (already cleaned) input
+        :param existing: the IDs that are known to exist in the related collection, as a set of `ObjectId`. If this
+                         isn't provided, the related collection is queried
+        """
+        ids = [ObjectId(value) for value in self.get_ids(data)]
+        if existing is None:
+            existing = self.related.existing_ids(ids)
+
+        missing = [str(value) for value in ids if value not in existing]
+        if missing:
+            self.raise_missing(missing)
+
+    def raise_missing(self, missing):
+        raise ValidationError('Cannot find %s with ID %s' % (self.to, missing[0]), field=self.name)
+
+    def expand(self, data, related):
+        """
+        Replaces the stored ID with the related document. IDs that can't be found are left as they are
+
+        :param data: the stored value
+        :param related: related documents, keyed by ID string
+        :type related: dict
+        """
+        return related.get(str(data), data)
+
 
 class ManyToManyField(ForeignKeyField):
+    """
+    A field that holds a list of IDs of documents in another collection
+
+    :param name: field name
+    :param model: parent model
+    :param to:  the related model's name
+    """
     type = 'array'
 
-    def validate(self, data, _id=None):
+    def get_ids(self, data):
+        return list(data)
+
+    def clean(self, data):
         """
-        Checks to see if a document in the related model's collection matches the ID provided as `data`
+        Checks that the input is a list of valid IDs. Errors are reported for each invalid ID
         """
-        for d in data:
-            super().validate(d, _id=_id)
-
+        if not isinstance(data, list):
+            raise ValidationError('Input must be a list of IDs', field=self.name)
+
+        errors = {}
+        for value in data:
+            try:
+                ObjectId(value)
+            except (InvalidId, TypeError):
+                errors[str(value)] = 'Invalid id'
+
+        if errors:
+            raise ValidationError(errors, field=self.name)
         return data
+
+    def raise_missing(self, missing):
+        raise ValidationError({value: 'Cannot find %s with this ID' % self.to for value in missing}, field=self.name)
+
+    def expand(self, data, related):
+        return [related.get(str(value), value) for value in data]
@@ -0,0 +1,125 @@
+from bson.errors import InvalidId
+from pymongo.collection import ObjectId
+from crudcast.exceptions import ValidationError
+
+
+OPERATORS = {
+    'gt': '$gt',
+    'gte': '$gte',
+    'lt': '$lt',
+    'lte': '$lte',
+    'ne': '$ne',
+    'in': '$in',
+    'exists': '$exists',
+}  #: maps the suffixes that can be added to a filter, e.g. `?age__gt=18`, to MongoDB query operators
+
+TRUE_VALUES = ('true', '1')
+FALSE_VALUES = ('false', '0')
+
+
+def parse_bool(value, name):
+    """
+    Converts a query string value into a Boolean
+
+    :param value: the query string value
+    :param name: the query string argument, for error messages
+    :rtype: bool
+    """
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValidationError('Must be true or false', field=name)
+
+
+def parse_object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValidationError('Invalid id', field='_id')
+
+
+def split_key(key):
+    """
+    Splits a query string argument into a field name and an operator suffix, e.g. `age__gt` into `('age', 'gt')`
+
+    :rtype: tuple
+    """
+    name, sep, operator = key.rpartition('__')
+    if sep and operator in OPERATORS:
+        return name, operator
+    return key, None
+
+
+class FilterCompiler(object):
+    """
+    Converts query string arguments into a MongoDB query for a model. Each value is converted to the type stored by
+    its field (see `BaseField.parse`), so that numbers, Booleans and dates can be filtered on, and comparison operators
+    can be added as suffixes, e.g. `?age__gte=18&age__lt=65&name__in=a,b`. Conditions on the same field are combined
+    into a single query on that field, so that they can be answered with one index range
+
+    :param model: the model whose collection is queried
+    :type model: crudcast.models.Model
+    """
+    def __init__(self, model):
+        self.model = model
+        self.parsers = {}
+        for name in model.readable_fields:
+            field = model.field_index.get(name)
+            if name == '_id':
+                self.parsers[name] = parse_object_id
+            elif field is not None:
+                self.parsers[name] = field.parse
+            else:
+                self.parsers[name] = str
+
+    def parse(self, key, name, operator, value):
+        """
+        Converts a single query string value
+
+        :param key: the query string argument
+        :param name: the field name
+        :param operator: the operator suffix, if any
+        :param value: the query string value. Values that aren't strings (i.e. queries built by the app rather than
+                      read from the query string) are used as they are
+        """
+        if not isinstance(value, str):
+            return value
+
+        if operator == 'exists':
+            return parse_bool(value, key)
+
+        if operator == 'in':
+            return [self.parsers[name](item) for item in value.split(',')]
+
+        return self.parsers[name](value)
+
+    def compile(self, args):
+        """
+        Builds the MongoDB query
+
+        :param args: query string arguments, excluding those used for pagination and other purposes
+        :type args: dict
+        :rtype: dict
+        """
+        equal = {}
+        conditions = {}
+        for key, value in args.items():
+            name, operator = split_key(key)
+            if name not in self.parsers:
+                raise ValidationError('Invalid filter', field=key)
+
+            value = self.parse(key, name, operator, value)
+            if operator is None:
+                equal[name] = value
+            else:
+                conditions.setdefault(name, {})[OPERATORS[operator]] = value
+
+        q = {}
+        for name, value in equal.items():
+            if name in conditions:
+                conditions[name]['$eq'] = value
+            else:
+                q[name] = value
+        q.update(conditions)
+        return q
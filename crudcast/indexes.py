@@ -0,0 +1,148 @@
+import pymongo
+from pymongo.errors import OperationFailure
+from crudcast.exceptions import ConfigException
+
+
+class Index(object):
+    """
+    A MongoDB index, as declared in `config.yml`
+
+    :param keys: a list of `(field name, direction)` pairs
+    :param unique: if True, a unique index is created
+    :param name: index name. Defaults to the name MongoDB would generate, e.g. `author_1_created_-1`
+    :param partial_filter: if given, only the documents that match this query are indexed
+    :type partial_filter: dict
+    """
+    def __init__(self, keys, unique=False, name=None, partial_filter=None):
+        self.keys = keys
+        self.unique = unique
+        self.name = name or '_'.join('%s_%s' % key for key in keys)
+        self.partial_filter = partial_filter
+
+    def get_options(self):
+        """
+        Returns the options for `Collection.create_index`
+
+        :rtype: dict
+        """
+        options = {'name': self.name, 'unique': self.unique}
+        if self.partial_filter:
+            options['partialFilterExpression'] = self.partial_filter
+        return options
+
+    def matches(self, info):
+        """
+        Checks if an existing index, as returned by `Collection.index_information`, has the same options
+
+        :type info: dict
+        :rtype: bool
+        """
+        return (info.get('unique', False) == self.unique and
+                info.get('partialFilterExpression') == self.partial_filter)
+
+    @property
+    def fieldnames(self):
+        return [key for key, direction in self.keys]
+
+    def supports_sort(self, keys):
+        """
+        Checks if MongoDB can use the index to return documents in a given order, without sorting them in memory. This
+        is the case if the sort keys are a prefix of the index keys, in the same or the opposite direction
+
+        :param keys: a list of `(field name, direction)` pairs
+        :rtype: bool
+        """
+        prefix = [tuple(key) for key in self.keys[:len(keys)]]
+        if len(prefix) < len(keys):
+            return False
+        return prefix == list(keys) or prefix == [(name, -direction) for name, direction in keys]
+
+    def __repr__(self):
+        return '%s%s' % (self.name, ' (unique)' if self.unique else '')
+
+
+def parse_key(key):
+    """
+    Converts a field name into a `(field name, direction)` pair. Names prefixed with `-` are indexed in descending
+    order
+
+    :type key: str
+    :rtype: tuple
+    """
+    if key.startswith('-'):
+        return key[1:], pymongo.DESCENDING
+    return key, pymongo.ASCENDING
+
+
+def parse_index(spec):
+    """
+    Creates an `Index` from an item in a model's `indexes:` list. Items can be a field name, a list of field names
+    (for a compound index), or a dict with a `fields` list and optional `unique` and `name` values
+
+    :rtype: Index
+    """
+    if isinstance(spec, str):
+        return Index([parse_key(spec)])
+    if isinstance(spec, list):
+        return Index([parse_key(key) for key in spec])
+    if isinstance(spec, dict) and spec.get('fields'):
+        return Index([parse_key(key) for key in spec['fields']], unique=spec.get('unique', False),
+                     name=spec.get('name'))
+    raise ConfigException('Invalid index: %s' % spec)
+
+
+def get_indexes(model):
+    """
+    Returns the indexes that a model needs: a unique index for each `unique` field, an index for each field with
+    `index: true` (which is the default for `foreignkey` and `manytomany` fields), and the model's `indexes:` option.
+    The unique index of a field that isn't `required` only covers the documents that have the field, so that any
+    number of documents can leave it out
+
+    :type model: crudcast.models.Model
+    :rtype: tuple
+    """
+    indexes = {}
+    for field in model.fields:
+        if field.unique or field.index:
+            partial_filter = {field.name: {'$exists': True}} if field.unique and not field.required else None
+            index = Index([(field.name, pymongo.ASCENDING)], unique=field.unique, partial_filter=partial_filter)
+            indexes[index.name] = index
+
+    for spec in model.options.get('indexes') or []:
+        index = parse_index(spec)
+        if index.name not in indexes or index.unique:
+            indexes[index.name] = index
+
+    return tuple(indexes.values())
+
+
+def sync_indexes(model, dry_run=False):
+    """
+    Creates any of the model's indexes that don't already exist in its collection
+
+    :type model: crudcast.models.Model
+    :param dry_run: if True, report what would be done without creating anything
+    :return: a list of `(index, status)` pairs
+    :rtype: list
+    """
+    existing = model.collection.index_information()
+    report = []
+
+    for index in model.indexes:
+        if index.name in existing:
+            if not index.matches(existing[index.name]):
+                status = 'conflicts with existing index'
+            else:
+                status = 'exists'
+        elif dry_run:
+            status = 'would be created'
+        else:
+            try:
+                model.collection.create_index(index.keys, background=True, **index.get_options())
+                status = 'created'
+            except OperationFailure as err:
+                status = 'failed: %s' % err
+
+        report.append((index, status))
+
+    return report
@@ -1,20 +1,96 @@
 import importlib.util
+import threading
+import os
+
+
+_modules = {}  # file path -> (modification time, module)
+_modules_lock = threading.Lock()
+
+
+def load_module(file, reload=False):
+    """
+    Executes a Python file and returns it as a module. Modules are cached by file path, so each file is only executed
+    once, and methods that share a file share the same classes
+
+    :param file: absolute path to the file
+    :param reload: if True, the file is executed again if it has been modified since it was last loaded
+    """
+    with _modules_lock:
+        cached = _modules.get(file)
+        if cached is not None and not reload:
+            return cached[1]
+
+        mtime = os.path.getmtime(file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        name = os.path.splitext(os.path.basename(file))[0]
+        spec = importlib.util.spec_from_file_location(name, file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[file] = (mtime, module)
+        return module
+
+
+def get_reloading_resource(method, resource):
+    """
+    Returns a subclass of `resource` that handles each request with the latest version of the method's resource
+    class, so that changes to the method's file take effect without restarting the server. HTTP methods that weren't
+    defined when the server started are not routed
+
+    :type method: Method
+    :type resource: crudcast.resources.Resource
+    """
+    class ReloadingResource(resource):
+        def dispatch_request(self, *args, **kwargs):
+            current = method.get_resource()
+            current.set_app(self.app)
+            self.__class__ = current
+            return current.dispatch_request(self, *args, **kwargs)
+
+    return ReloadingResource
 
 
 class Method(object):
-    def __init__(self, file, path, resource, **options):
+    """
+    A custom API method, loaded from a Python file
+
+    :param file: absolute path to the Python file
+    :param path: the path at which the method is added to the API
+    :param resource: the name of the resource class in the file
+    :param reload: if True, the file is loaded again whenever it changes. This is meant for development
+    :param options: any other options from the config file, e.g. `swagger`
+    """
+    def __init__(self, file, path, resource, reload=False, **options):
         self.file = file
         self.path = path
         self.code = resource
+        self.reload = reload
         self.options = options
 
     def get_resource(self):
         _cls = self.code.split('.')[-1]
-        spec = importlib.util.spec_from_file_location(self.code, self.file)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+        module = load_module(self.file, reload=self.reload)
         return getattr(module, _cls)
 
+    def get_api_resource(self):
+        """
+        Returns the resource class to be added to the API
+        """
+        resource = self.get_resource()
+        if self.reload:
+            return get_reloading_resource(self, resource)
+        return resource
+
+    def is_stale(self):
+        """
+        Returns True if the method's file has changed since it was loaded. This is only checked in reload mode
+        """
+        if not self.reload:
+            return False
+        cached = _modules.get(self.file)
+        return cached is None or cached[0] != os.path.getmtime(self.file)
+
     @property
     def swagger_definition(self):
         extra_swagger = self.options.get('swagger', {})
@@ -40,7 +116,7 @@ class Method(object):
                 },
                 'security': [
                     {
-                        'basicAuth': []
+                        '%sAuth' % auth_type: []
                     }
                 ] if auth_type else []
             }
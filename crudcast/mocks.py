@@ -1,4 +1,7 @@
 from crudcast.resources import Resource
+from crudcast.models import Model
+from crudcast.fields import COUNTERS_COLLECTION
+import threading
 
 
 class MockApi(object):
@@ -8,9 +11,24 @@ class MockApi(object):
 class MockCollection(object):
     items = []
 
-    def find(self, query):
+    def find(self, query, *args, **kwargs):
         return MockDocument(_count=self.count)
 
+    def distinct(self, key, query):
+        return []
+
+    def with_options(self, *args, **kwargs):
+        return self
+
+    def find_one(self, query, *args, **kwargs):
+        return {'test': 'test'} if self.count else None
+
+    def count_documents(self, query, *args, **kwargs):
+        return self.count
+
+    def estimated_document_count(self, *args, **kwargs):
+        return self.count
+
     def insert_one(self, *args, **kwargs):
         d = MockDocument()
         self.items.append(d)
@@ -18,6 +36,29 @@ class MockCollection(object):
 
     def __init__(self, *args, **kwargs):
         self.count = kwargs.get('count', 0)
+        self.database = {COUNTERS_COLLECTION: MockCounters()}
+
+
+class MockCounters(object):
+    """
+    A thread-safe stand-in for the counters collection used by `AutoField`
+    """
+    def __init__(self):
+        self.counters = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def find_one_and_update(self, query, update, **kwargs):
+        with self.lock:
+            self.calls += 1
+            seq = self.counters.get(query['_id'], 0) + update['$inc']['seq']
+            self.counters[query['_id']] = seq
+            return {'_id': query['_id'], 'seq': seq}
+
+    def update_one(self, query, update, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.counters[query['_id']] = max(self.counters.get(query['_id'], 0), update['$max']['seq'])
 
 
 class MockMethod(object):
@@ -48,6 +89,18 @@ class MockApp(object):
         }
     }
 
+    def get_model(self, model_name):
+        return Model(model_name, self)
+
+    def sync_indexes(self, dry_run=False):
+        return []
+
+    def get_ordering_warnings(self):
+        return []
+
+    def get_swagger_document(self):
+        pass
+
     def route(self, *args, **kwargs):
         return lambda x: print(x)
 
@@ -76,6 +129,10 @@ class MockArgs(object):
     host = '0.0.0.0'
     no_load_dotenv = False
     create_admin = False
+    sync_indexes = False
+    dry_run = False
+    workers = None
+    threads = None
 
 
 class MockParser(object):
@@ -112,19 +169,25 @@ class MockModel(object):
     models = ['test', 'test2']
     count = 0
     name = None
+    options = {}
     app = MockApp()
 
     def __init__(self, *args, **kwargs):
         self.name = kwargs.get('name')
         self.count = kwargs.get('count', 0)
-        self.collection = MockCollection(count=self.count)
-        pass
+        self.collection = self.validation_collection = MockCollection(count=self.count)
 
     def to_repr(self, _id):
         return [{
             'test': {}
         }]
 
+    def exists_where(self, query):
+        return self.collection.find_one(query) is not None
+
+    def estimated_count(self):
+        return self.collection.estimated_document_count()
+
 
 class MockValidationError(Exception):
     pass
@@ -143,4 +206,73 @@ class MockMongo(object):
 
 class TestResource(Resource):
     def get(self):
-        return {'hello': True}
\ No newline at end of file
+        return {'hello': True}
+
+
+class MockAsyncCursor(object):
+    """
+    A stand-in for a Motor cursor, over the result of a synchronous `find()`
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, *args, **kwargs):
+        self.cursor = self.cursor.skip(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs):
+        self.cursor = self.cursor.limit(*args, **kwargs)
+        return self
+
+    async def to_list(self, length):
+        return list(self.cursor)[:length]
+
+
+class MockAsyncCollection(object):
+    """
+    A stand-in for a Motor collection, which wraps a synchronous collection (e.g. a `MagicMock` or a `mongomock`
+    collection) in coroutines
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = getattr(collection, 'name', None)
+
+    @property
+    def database(self):
+        return MockAsyncDatabase(self.collection.database)
+
+    def find(self, *args, **kwargs):
+        return MockAsyncCursor(self.collection.find(*args, **kwargs))
+
+    def with_options(self, *args, **kwargs):
+        return MockAsyncCollection(self.collection.with_options(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def coroutine(*args, **kwargs):
+            return method(*args, **kwargs)
+        return coroutine
+
+
+class MockAsyncDatabase(object):
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return MockAsyncCollection(self.database[name])
+
+
+class MockAsyncClient(object):
+    def __init__(self, client):
+        self.client = client
+
+    def __getitem__(self, name):
+        return MockAsyncDatabase(self.client[name])
+
+    def close(self):
+        pass
@@ -1,18 +1,48 @@
-from crudcast.utils import is_jsonable
-from crudcast.exceptions import ValidationError
-from pymongo.collection import ObjectId
+from crudcast.encoders import encode_document
+from crudcast.exceptions import ValidationError, ConfigException
+from pymongo.collection import ObjectId, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo import UpdateOne
+from pymongo.read_preferences import ReadPreference
+from bson.errors import InvalidId
 from crudcast.fields import (
     StringField, NumberField, DateTimeField, BooleanField, ForeignKeyField, AutoField, AutoDateTimeField,
     ManyToManyField
 )
 from flask import abort
-from crudcast.authentication import BasicAuth
+from crudcast.authentication import BasicAuth, TokenAuth
+from crudcast.indexes import get_indexes, parse_key, Index
+from crudcast.mongo import get_read_preference, get_read_concern
+from crudcast.cache import ResponseCache, get_backend
+from crudcast.filters import FilterCompiler
+from crudcast.aggregation import parse_group_by, parse_metrics, get_pipeline, DEFAULT_MAX_GROUPS
+from crudcast.streaming import chunked, CHUNK_SIZE
+from types import MappingProxyType
+import re
+
+
+FIELD_TYPES = {
+    'string': StringField,
+    'number': NumberField,
+    'datetime': DateTimeField,
+    'boolean': BooleanField,
+    'foreignkey': ForeignKeyField,
+    'autofield': AutoField,
+    'auto_datetime': AutoDateTimeField,
+    'manytomany': ManyToManyField,
+}  #: maps the `type` option in `config.yml` to a field class
+
+DEFAULT_MAX_BULK_SIZE = 1000  #: the maximum number of items in a bulk request, unless a model sets `max_bulk_size`
+DUPLICATE_KEY_ERROR = 11000  #: the MongoDB error code for a unique index violation
+DEFAULT_MAX_EXPAND_DEPTH = 2  #: how many levels of references can be expanded, unless a model sets `max_expand_depth`
+READ_OPERATIONS = ('list', 'retrieve', 'count', 'aggregate')  #: reads that can use `read_preference` and `read_concern`
 
 
 class Model(object):
     def __init__(self, name, app):
         """
-        A model object - effectively a schema for the mongodb
+        A model object - effectively a schema for the mongodb. Models are compiled once, when the app is configured
+        (see `CrudcastApp.compile_models`), and are shared between requests, so they must not be modified afterwards
 
         :param name: model name
         """
@@ -23,117 +53,853 @@ class Model(object):
             self.object = self.app.models[name]
         except KeyError:
             abort(404)
+        self.options = self.object.get('options', {})
+        self.read_options = self.get_read_options()
         self.collection = self.object['collection']
         self.fields = self.set_fields(self.object['fields'])
-        self.options = self.object.get('options', {})
+
+        self.field_index = MappingProxyType({field.name: field for field in self.fields})
+        self.required_fields = tuple(field.name for field in self.fields if field.required)
+        self.unique_fields = tuple(field.name for field in self.fields if field.unique)
+        self.auto_fields = tuple(field for field in self.fields if field.auto)
+        self.indexes = self.get_indexes()
+        self.default_projection = self.get_default_projection()
+        self.filter_compiler = FilterCompiler(self)
+        self.cache = self.get_cache()
+
+    @property
+    def collection(self):
+        return self._collection
+
+    @collection.setter
+    def collection(self, collection):
+        """
+        Sets the model's collection, and the collections used for reads with the model's `read_preference` and
+        `read_concern` - see `get_read_collection`. Reads done to validate a write (e.g. checking uniqueness) use
+        `validation_collection`, which always reads from the primary, even if the client's `read_preference` is set
+        """
+        self._collection = collection
+        self.read_collections = {
+            operation: collection.with_options(**options)
+            for operation, options in self.read_options.items()
+        } if collection is not None else {}
+        self.validation_collection = collection.with_options(
+            read_preference=ReadPreference.PRIMARY
+        ) if collection is not None else None
+
+    def get_cache(self):
+        """
+        Creates the cache for the responses of the model's GET endpoints, if the model has the `cache` option, e.g.
+        `{ttl: 30, max_entries: 10000}` - see `crudcast.cache.get_backend`
+
+        :rtype: crudcast.cache.ResponseCache
+        """
+        options = self.options.get('cache')
+        if not options:
+            return None
+        return ResponseCache(self.name, get_backend({} if options is True else options))
+
+    def invalidate_cache(self):
+        """
+        Stops the responses cached so far from being used. This is called after every write to the model
+        """
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def get_read_options(self):
+        """
+        Reads the `read_preference` and `read_concern` options. Each option is either a single value, which applies to
+        all the operations in `READ_OPERATIONS`, or a value for each operation, e.g. `{list: secondaryPreferred}`
+
+        :return: the options for `Collection.with_options`, keyed by operation
+        :rtype: dict
+        """
+        read_options = {}
+        for name, parse in [('read_preference', get_read_preference), ('read_concern', get_read_concern)]:
+            value = self.options.get(name)
+            if value is None:
+                continue
+            if not isinstance(value, dict):
+                value = {operation: value for operation in READ_OPERATIONS}
+
+            for operation, setting in value.items():
+                if operation not in READ_OPERATIONS:
+                    raise ConfigException('%s: invalid %s operation: %s' % (self.name, name, operation))
+                read_options.setdefault(operation, {})[name] = parse(setting)
+        return read_options
+
+    def get_read_collection(self, operation=None):
+        """
+        Returns the collection to use for a read operation. Writes use `self.collection`, and the reads done to
+        validate them use `self.validation_collection`, so that they always see the primary
+
+        :param operation: one of `READ_OPERATIONS`, or `None`
+        """
+        return self.read_collections.get(operation, self._collection)
 
     def set_fields(self, fields):
         """
-        Sets the list of fields
+        Returns the model's fields as a tuple of field objects
         """
         cleaned_fields = []
-        field_types = {
-            'string': StringField,
-            'number': NumberField,
-            'datetime': DateTimeField,
-            'boolean': BooleanField,
-            'foreignkey': ForeignKeyField,
-            'autofield': AutoField,
-            'auto_datetime': AutoDateTimeField,
-            'manytomany': ManyToManyField,
-        }
 
         for field_name, options in fields.items():
             if not options:
                 options = {}
 
-            field_type = field_types[options.get('type', 'string')]
+            field_type = FIELD_TYPES[options.get('type', 'string')]
 
             field = field_type(name=field_name, model=self, **options)
 
             cleaned_fields.append(field)
 
-        return cleaned_fields
+        return tuple(cleaned_fields)
+
+    def get_indexes(self):
+        """
+        Returns the indexes declared for this model in the config file
+
+        :rtype: tuple
+        """
+        return get_indexes(self)
 
     @property
     def fieldnames(self):
-        return [field.name for field in self.fields]
+        return list(self.field_index)
 
     def get_field_by_name(self, key):
-        return list(filter(lambda x: x.name == key, self.fields))[0]
+        try:
+            return self.field_index[key]
+        except KeyError:
+            raise IndexError(key)
 
-    def validate(self, data=None, _id=None):
+    def clean_input(self, data=None, _id=None):
+        """
+        Performs the validation that doesn't need the database: checks that required fields are supplied and that
+        every key is a valid field, and runs each field's `clean()` method
+
+        :param data: input data
+        :param _id: ID as a string, or None in case of new objects
+        :rtype: dict
+        """
         # prevent 500 error on empty payload
         if not data:
             data = {}
 
+        if not isinstance(data, dict):
+            raise ValidationError('Input must be an object')
+
         # ensure that required fields are supplied, if creating
         if not _id:
-            required_fields = [field.name for field in self.fields if field.required]
-            for f in required_fields:
-                try:
-                    assert f in data.keys()
-                except AssertionError:
+            for f in self.required_fields:
+                if f not in data:
                     raise ValidationError('This field is required', field=f)
 
         # ensure that all input fields are valid field names
         for key, val in data.items():
-            if not key in self.fieldnames:
+            field = self.field_index.get(key)
+            if field is None:
                 raise ValidationError('Invalid field', field=key)
 
-            # perform field-level validation
-            field = self.get_field_by_name(key)
-            field.validate(val, _id=_id)
-
-        auto_fields = [field for field in self.fields if field.auto]
+            # perform field-level validation. Database lookups are done afterwards, in batches
+            field.clean(val)
 
-        for f in auto_fields:
-            data[f.name] = f.set(_id=_id)
+        return data
 
+    def validate(self, data=None, _id=None):
+        data = self.clean_input(data, _id=_id)
+        self.check_unique(data, _id=_id)
+        self.check_references(data)
+        self.set_auto_fields([(data, _id)])
         return data
 
+    def set_auto_fields(self, items):
+        """
+        Sets the values of the model's auto fields. Values for new objects are generated for the whole batch at once
+
+        :param items: a list of `(data, _id)` tuples, where `_id` is None for new objects
+        """
+        for f in self.auto_fields:
+            new = [data for data, _id in items if not _id]
+            for data, value in zip(new, f.set_many(len(new))):
+                data[f.name] = value
+
+            if f.auto_update:
+                for data, _id in items:
+                    if _id:
+                        data[f.name] = f.set(_id=_id)
+
+    def check_unique(self, data, _id=None):
+        """
+        Checks that no other document has the same value for any of the `unique` fields in the input, and reports
+        every field that is already taken
+
+        :param data: input data, which has already been cleaned
+        :type data: dict
+        :param _id: ID as a string, or None in case of new objects
+        """
+        errors = self.get_unique_errors([(data, _id)])[0]
+        if errors:
+            raise ValidationError(errors=errors)
+
+    def get_unique_errors(self, items):
+        """
+        Checks the `unique` fields of a batch of inputs with a single query. Values that are repeated within the batch
+        are reported for every item after the first. The unique indexes created by `CrudcastApp.sync_indexes` catch
+        any duplicates that are inserted between this check and the write
+
+        :param items: a list of `(data, _id)` tuples, where `_id` is None for new objects
+        :return: a dict of errors for each item, which is empty if the item is valid
+        :rtype: list
+        """
+        query, projection = self.get_unique_query(items)
+        documents = list(self.validation_collection.find(query, projection)) if query else []
+        return self.match_unique_errors(items, documents)
+
+    def get_unique_query(self, items):
+        """
+        Builds the query used by `get_unique_errors`
+
+        :param items: a list of `(data, _id)` tuples
+        :return: the query and projection, or `(None, None)` if none of the items have any `unique` fields
+        :rtype: tuple
+        """
+        values = {}
+        for data, _id in items:
+            for name in self.unique_fields:
+                if name in data:
+                    values.setdefault(name, []).append(data[name])
+
+        if not values:
+            return None, None
+
+        query = {'$or': [
+            {name: name_values[0]} if len(name_values) == 1 else {name: {'$in': name_values}}
+            for name, name_values in values.items()
+        ]}
+        return query, {name: 1 for name in values}
+
+    def match_unique_errors(self, items, documents):
+        """
+        Compares a batch of inputs with the documents found by the query from `get_unique_query`
+
+        :param items: a list of `(data, _id)` tuples
+        :param documents: the documents that matched the query
+        :return: a dict of errors for each item, which is empty if the item is valid
+        :rtype: list
+        """
+        errors = [{} for item in items]
+        claimed = set()
+        for (data, _id), item_errors in zip(items, errors):
+            object_id = ObjectId(_id) if _id else None
+            for name in self.unique_fields:
+                if name not in data:
+                    continue
+
+                key = (name, repr(data[name]))
+                taken = key in claimed or any(
+                    document.get(name) == data[name] and document.get('_id') != object_id for document in documents
+                )
+                if taken:
+                    item_errors[name] = '%s with this %s already exists' % (self.name, name)
+                claimed.add(key)
+
+        return errors
+
+    def get_duplicate_key_error(self, err):
+        """
+        Converts a `DuplicateKeyError`, raised by a unique index, into a `ValidationError`
+
+        :type err: pymongo.errors.DuplicateKeyError
+        :rtype: ValidationError
+        """
+        details = err.details or {}
+        fieldnames = list(details.get('keyValue', {}))
+        if not fieldnames:
+            # older MongoDB versions only give the index name in the error message
+            match = re.search(r'index: (\S+)', details.get('errmsg', str(err)))
+            indexes = {index.name: index for index in self.indexes}
+            if match and match.group(1) in indexes:
+                fieldnames = indexes[match.group(1)].fieldnames
+
+        if not fieldnames:
+            return ValidationError('%s already exists' % self.name, field='_id')
+
+        return ValidationError(errors={
+            name: '%s with this %s already exists' % (self.name, name) for name in fieldnames
+        })
+
+    def get_write_error(self, error):
+        """
+        Converts an item of a `BulkWriteError`'s `writeErrors` into a `ValidationError`
+
+        :type error: dict
+        :rtype: ValidationError
+        """
+        if error.get('code') == DUPLICATE_KEY_ERROR:
+            return self.get_duplicate_key_error(DuplicateKeyError(error.get('errmsg'), error['code'], error))
+        return ValidationError(error.get('errmsg'))
+
+    def check_references(self, data, existing=None):
+        """
+        Checks that the IDs given for `foreignkey` and `manytomany` fields refer to existing documents
+
+        :param data: input data, which has already been cleaned
+        :type data: dict
+        :param existing: the result of `get_existing_references`. If this isn't provided, it is looked up
+        """
+        if existing is None:
+            existing = self.get_existing_references([data])
+
+        for key in data:
+            field = self.field_index[key]
+            if field.is_reference:
+                field.check_references(data[key], existing=existing[field.to])
+
+    def get_existing_references(self, items):
+        """
+        Looks up the IDs given for the `foreignkey` and `manytomany` fields of a batch of inputs. The IDs are looked up
+        with a single query per related model, however many items, fields and IDs refer to it
+
+        :param items: input data, which has already been cleaned
+        :type items: list
+        :return: the set of existing IDs, keyed by related model name
+        :rtype: dict
+        """
+        return {
+            model_name: self.app.get_model(model_name).existing_ids(model_ids) if model_ids else set()
+            for model_name, model_ids in self.get_reference_ids(items).items()
+        }
+
+    def get_reference_ids(self, items):
+        """
+        Collects the IDs given for the `foreignkey` and `manytomany` fields of a batch of inputs
+
+        :param items: input data, which has already been cleaned
+        :type items: list
+        :return: sets of `ObjectId`, keyed by related model name
+        :rtype: dict
+        """
+        ids = {}
+        for data in items:
+            for key, val in data.items():
+                field = self.field_index[key]
+                if field.is_reference:
+                    ids.setdefault(field.to, set()).update(ObjectId(value) for value in field.get_ids(val))
+        return ids
+
+    def existing_ids(self, ids):
+        """
+        Returns the subset of the given IDs that refer to documents in the collection
+
+        :param ids: ObjectIds to look up
+        :rtype: set
+        """
+        return set(self.validation_collection.distinct('_id', {'_id': {'$in': list(ids)}}))
+
+    def get_query(self, **query):
+        """
+        Converts query string arguments into a MongoDB query - see `crudcast.filters.FilterCompiler`
+
+        :rtype: dict
+        """
+        return self.filter_compiler.compile(query)
+
+    def query(self, q, projection=None, operation=None):
+        """
+        Runs a MongoDB query against the model's collection
+
+        :param q: a MongoDB query document
+        :type q: dict
+        :param projection: the fields to fetch - see `get_projection`. If `None`, whole documents are fetched
+        :type projection: dict
+        :param operation: the operation the query is for, if it may be read from a secondary - see
+                          `get_read_collection`
+        :rtype: pymongo.cursor.Cursor
+        """
+        collection = self.get_read_collection(operation)
+        if projection:
+            return collection.find(q, projection)
+        return collection.find(q)
+
     def find(self, **query):
-        q = {}
-        for key, val in query.items():
-            try:
-                q[key] = ''.join(val)
-            except TypeError:
-                q[key] = val
-        return self.collection.find(q)
+        return self.query(self.get_query(**query))
 
-    def to_repr(self, **query):
-        items = self.find(**query)
-        response = []
-        for item in items:
-            obj = {}
-            for key, val in item.items():
-                if is_jsonable(val):
-                    obj[key] = val
-                else:
-                    obj[key] = str(val)
-
-            response.append(obj)
-
-        return response
-
-    def retrieve(self, _id):
-        if self.exists(_id):
-            return self.to_repr(_id=ObjectId(_id))[0]
+    @property
+    def readable_fields(self):
+        """
+        The names of the fields that can be requested with the `fields` query string argument
+        """
+        return ['_id'] + self.fieldnames
+
+    def get_default_projection(self):
+        """
+        Parses the model's `projection` option: a list of the fields to return by default, or of the fields to leave
+        out, prefixed with `-`
+
+        :rtype: dict or None
+        """
+        names = self.options.get('projection')
+        if not names:
+            return None
+
+        excluded = [name[1:] for name in names if name.startswith('-')]
+        if excluded and len(excluded) != len(names):
+            raise ConfigException('The projection of %s must either list the fields to include, or the fields to '
+                                  'exclude, not both' % self.name)
+
+        if excluded:
+            return {name: 0 for name in excluded}
+        return {name: 1 for name in names}
+
+    def get_projection(self, fields=None, expand=None):
+        """
+        Returns the MongoDB projection used to read documents, so that fields the client doesn't need are not fetched
+        from the database
+
+        :param fields: the `fields` query string argument - a comma separated list of the fields to return. If not
+                       given, the model's default projection is used
+        :type fields: str
+        :param expand: the references that will be expanded - see `get_expand_tree`. These fields are always fetched
+        :type expand: dict
+        :rtype: dict or None
+        """
+        if not fields:
+            projection = self.default_projection
         else:
+            names = [name.strip() for name in fields.split(',') if name.strip()]
+            for name in names:
+                if name not in self.readable_fields:
+                    raise ValidationError('Invalid field: %s' % name, field='fields')
+            projection = {name: 1 for name in names}
+
+        if not projection or not expand:
+            return projection
+        if all(projection.values()):
+            return dict(projection, **{name: 1 for name in expand})
+        return {key: val for key, val in projection.items() if key not in expand} or None
+
+    @property
+    def orderable_fields(self):
+        """
+        The names of the fields that can be used in the `ordering` query string argument. This is set with the model's
+        `ordering_fields` option, and defaults to every field
+        """
+        return self.options.get('ordering_fields') or self.readable_fields
+
+    def is_sort_indexed(self, keys):
+        """
+        Checks if one of the model's indexes (or the `_id` index) can be used to sort documents in a given order
+
+        :param keys: a list of `(field name, direction)` pairs
+        :rtype: bool
+        """
+        indexes = (Index([('_id', 1)]),) + self.indexes
+        return any(index.supports_sort(keys) for index in indexes)
+
+    def get_sort_keys(self, keys):
+        """
+        Adds `_id` to a list of sort keys, unless it is already in the list, so that documents with equal values are
+        always returned in the same order, and cursor pagination doesn't skip or repeat any of them. Cursors always
+        include `_id`, so it is added even after a unique field. `_id` is sorted in the same direction as the last
+        key, so that an index such as `[created, _id]` supports ordering by `created` and `-created`
+
+        :param keys: a list of `(field name, direction)` pairs
+        :rtype: list
+        """
+        if any(name == '_id' for name, direction in keys):
+            return list(keys)
+        return list(keys) + [('_id', keys[-1][1])]
+
+    def get_sort(self, ordering=None):
+        """
+        Parses the `ordering` query string argument
+
+        :param ordering: a comma separated list of field names. Names prefixed with `-` are sorted in descending order,
+                         e.g. `-created,name`
+        :type ordering: str
+        :return: a list of `(field name, direction)` pairs, or `None` if no ordering is given
+        :rtype: list
+        """
+        if not ordering:
+            return None
+
+        keys = [parse_key(name.strip()) for name in ordering.split(',') if name.strip()]
+        names = [name for name, direction in keys]
+        for name in names:
+            if name not in self.orderable_fields or names.count(name) > 1:
+                raise ValidationError('Cannot order by %s' % name, field='ordering')
+
+        keys = self.get_sort_keys(keys)
+        if self.options.get('indexed_ordering') and not self.is_sort_indexed(keys):
+            raise ValidationError('Cannot order by %s, because it is not indexed' % ordering, field='ordering')
+        return keys
+
+    def get_ordering_warnings(self):
+        """
+        Returns a warning for each of the model's `ordering_fields` that can't be sorted using an index
+
+        :rtype: list
+        """
+        warnings = []
+        for name in self.options.get('ordering_fields') or []:
+            if name not in self.readable_fields:
+                raise ConfigException('Cannot order %s by %s, because there is no such field' % (self.name, name))
+
+            keys = self.get_sort_keys([(name, 1)])
+            if not self.is_sort_indexed(keys):
+                index = '[%s]' % ', '.join(key for key, direction in keys)
+                warnings.append('%s: ordering by %s is not supported by an index. Add %s to the model\'s indexes'
+                                % (self.name, name, index))
+        return warnings
+
+    def serialize(self, document):
+        """
+        Returns a JSON-friendly representation of a single document
+
+        :type document: dict
+        :rtype: dict
+        """
+        return encode_document(document)
+
+    def to_repr(self, **query):
+        return [self.serialize(item) for item in self.find(**query)]
+
+    @property
+    def max_expand_depth(self):
+        return self.options.get('max_expand_depth', DEFAULT_MAX_EXPAND_DEPTH)
+
+    def get_expand_tree(self, expand):
+        """
+        Parses the `expand` query string argument - a comma separated list of reference fields, where a field of a
+        related model is given as `field.related_field` - into a tree
+
+        :param expand: e.g. `author,authors.publisher`
+        :type expand: str
+        :return: the reference fields to expand, mapped to the tree for the related model, e.g.
+                 `{'author': {}, 'authors': {'publisher': {}}}`
+        :rtype: dict
+        """
+        tree = {}
+        if not expand:
+            return tree
+
+        for path in expand.split(','):
+            names = path.strip().split('.')
+            if len(names) > self.max_expand_depth:
+                raise ValidationError('References can only be expanded %d levels deep' % self.max_expand_depth,
+                                      field='expand')
+
+            model, node = self, tree
+            for name in names:
+                field = model.field_index.get(name)
+                if field is None or not field.is_reference:
+                    raise ValidationError('%s is not a reference field of %s' % (name, model.name), field='expand')
+                model, node = field.related, node.setdefault(name, {})
+
+        return tree
+
+    def get_expanded_models(self, tree):
+        """
+        Yields every related model that is queried when a tree from `get_expand_tree` is expanded
+        """
+        for name, subtree in tree.items():
+            related = self.field_index[name].related
+            yield related
+            yield from related.get_expanded_models(subtree)
+
+    def expand(self, documents, tree):
+        """
+        Replaces the IDs in the `foreignkey` and `manytomany` fields of a list of documents with the related documents.
+        Each related model is queried once for the whole list
+
+        :param documents: documents from the model's collection, which are modified in place
+        :type documents: list
+        :param tree: the fields to expand - see `get_expand_tree`
+        :type tree: dict
+        :rtype: list
+        """
+        for name, subtree in tree.items():
+            field = self.field_index[name]
+            values = [document[name] for document in documents if document.get(name) is not None]
+            ids = {value for data in values for value in field.get_ids(data)}
+            related = field.related.get_documents_by_id(ids, expand=subtree)
+
+            for document in documents:
+                if document.get(name) is not None:
+                    document[name] = field.expand(document[name], related)
+
+        return documents
+
+    def iter_expanded(self, documents, tree, chunk_size=CHUNK_SIZE):
+        """
+        Expands the references in an iterable of documents, a chunk at a time, so that streamed responses are not
+        read into memory all at once
+        """
+        for chunk in chunked(documents, chunk_size):
+            yield from self.expand(chunk, tree)
+
+    def get_documents_by_id(self, ids, expand=None):
+        """
+        Fetches documents by ID, with a single query
+
+        :param ids: ID strings. Invalid IDs are ignored
+        :param expand: references to expand in the fetched documents - see `get_expand_tree`
+        :return: serialized documents, keyed by ID string
+        :rtype: dict
+        """
+        object_ids = []
+        for _id in ids:
+            try:
+                object_ids.append(ObjectId(_id))
+            except (InvalidId, TypeError):
+                pass
+
+        if not object_ids:
+            return {}
+
+        documents = list(self.query({'_id': {'$in': object_ids}}, projection=self.get_projection(expand=expand),
+                                    operation='retrieve'))
+        if expand:
+            self.expand(documents, expand)
+        return {str(document['_id']): self.serialize(document) for document in documents}
+
+    def get_object_id(self, _id):
+        """
+        Converts an ID string into an ObjectId, or raises a 404 error if it isn't a valid ID
+
+        :type _id: str
+        :rtype: ObjectId
+        """
+        try:
+            return ObjectId(_id)
+        except (InvalidId, TypeError):
             abort(404)
 
+    def retrieve(self, _id, expand=None, projection=None):
+        if projection is None:
+            projection = self.default_projection
+        document = self.get_read_collection('retrieve').find_one({'_id': self.get_object_id(_id)}, projection)
+        if document is None:
+            abort(404)
+        if expand:
+            self.expand([document], expand)
+        return self.serialize(document)
+
     def create(self, data):
         data = self.validate(data)
-        obj = self.collection.insert_one(data)
-        return self.retrieve(obj.inserted_id)
+        try:
+            obj = self.collection.insert_one(data)
+        except DuplicateKeyError as err:
+            raise self.get_duplicate_key_error(err)
+        self.invalidate_cache()
+        data['_id'] = obj.inserted_id
+        return self.serialize(data)
 
     def update(self, _id, data):
-        if not self.exists(_id):
+        object_id = self.get_object_id(_id)
+        try:
+            data = self.validate(data, _id=_id)
+        except ValidationError:
+            # an update to a missing document is a 404, whether or not the data is valid. The check is only needed
+            # when validation fails, as otherwise the write itself finds out that the document is missing
+            if not self.existing_ids({object_id}):
+                abort(404)
+            raise
+
+        if data:
+            try:
+                document = self.collection.find_one_and_update({'_id': object_id}, {'$set': data},
+                                                               projection=self.default_projection,
+                                                               return_document=ReturnDocument.AFTER)
+            except DuplicateKeyError as err:
+                raise self.get_duplicate_key_error(err)
+            self.invalidate_cache()
+        else:
+            document = self.collection.find_one({'_id': object_id}, self.default_projection)
+
+        if document is None:
             abort(404)
+        return self.serialize(document)
 
-        data = self.validate(data, _id=_id)
-        self.collection.find_one_and_update({'_id': ObjectId(_id)}, {'$set': data})
-        return self.retrieve(_id)
+    @property
+    def max_bulk_size(self):
+        return self.options.get('max_bulk_size', DEFAULT_MAX_BULK_SIZE)
+
+    def check_bulk_input(self, items):
+        """
+        Checks that the input of a bulk operation is a list, and isn't longer than the model's `max_bulk_size`
+        """
+        if not isinstance(items, list):
+            raise ValidationError('Input must be a list')
+
+        if len(items) > self.max_bulk_size:
+            raise ValidationError('A maximum of %d items can be sent at once' % self.max_bulk_size)
+
+    @staticmethod
+    def get_error_result(err):
+        """
+        Returns the result of a bulk operation item that raised an error
+
+        :type err: ValidationError
+        :rtype: dict
+        """
+        return {'status': err.status_code, 'errors': err.to_dict()}
+
+    def bulk_create(self, items):
+        """
+        Creates a list of objects. The whole list is validated with one query per unique/related lookup, and written
+        with a single `insert_many`. Invalid items don't prevent the others from being created
+
+        :param items: a list of new objects
+        :return: the result of each item, in the order given. Each result has a `status`, and either the created
+                 object as `data`, or `errors`
+        :rtype: list
+        """
+        self.check_bulk_input(items)
+        results = [None] * len(items)
+
+        valid = []
+        for position, data in enumerate(items):
+            try:
+                valid.append((position, self.clean_input(data)))
+            except ValidationError as err:
+                results[position] = self.get_error_result(err)
+
+        existing = self.get_existing_references([data for position, data in valid])
+        unique_errors = self.get_unique_errors([(data, None) for position, data in valid])
+
+        documents = []
+        for (position, data), errors in zip(valid, unique_errors):
+            try:
+                if errors:
+                    raise ValidationError(errors=errors)
+                self.check_references(data, existing=existing)
+                documents.append((position, data))
+            except ValidationError as err:
+                results[position] = self.get_error_result(err)
+
+        self.set_auto_fields([(data, None) for position, data in documents])
+
+        write_errors = {}
+        if documents:
+            try:
+                self.collection.insert_many([data for position, data in documents], ordered=False)
+            except BulkWriteError as err:
+                write_errors = {error['index']: error for error in err.details.get('writeErrors', [])}
+            self.invalidate_cache()
+
+        for index, (position, data) in enumerate(documents):
+            if index in write_errors:
+                results[position] = self.get_error_result(self.get_write_error(write_errors[index]))
+            else:
+                results[position] = {'status': 201, 'data': self.serialize(data)}
+
+        return results
+
+    def bulk_update(self, items):
+        """
+        Updates a list of objects, each of which must include its `_id`. The whole list is validated with one query per
+        unique/related lookup, written with a single `bulk_write`, and the updated objects are fetched with one query
+
+        :param items: a list of partial objects
+        :return: the result of each item, in the order given. Each result has a `status`, and either the updated
+                 object as `data`, or `errors`
+        :rtype: list
+        """
+        self.check_bulk_input(items)
+        results = [None] * len(items)
+
+        valid = []
+        for position, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValidationError('Input must be an object')
+
+                data = dict(item)
+                _id = data.pop('_id', None)
+                if not _id:
+                    raise ValidationError('This field is required', field='_id')
+                try:
+                    ObjectId(_id)
+                except (InvalidId, TypeError):
+                    raise ValidationError('Invalid id', field='_id')
+
+                valid.append((position, _id, self.clean_input(data, _id=_id)))
+            except ValidationError as err:
+                results[position] = self.get_error_result(err)
+
+        existing = self.get_existing_references([data for position, _id, data in valid])
+        unique_errors = self.get_unique_errors([(data, _id) for position, _id, data in valid])
+
+        updates = []
+        for (position, _id, data), errors in zip(valid, unique_errors):
+            try:
+                if errors:
+                    raise ValidationError(errors=errors)
+                self.check_references(data, existing=existing)
+                updates.append((position, _id, data))
+            except ValidationError as err:
+                results[position] = self.get_error_result(err)
+
+        self.set_auto_fields([(data, _id) for position, _id, data in updates])
+
+        write_errors = {}
+        operations = [UpdateOne({'_id': ObjectId(_id)}, {'$set': data}) for position, _id, data in updates if data]
+        if operations:
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as err:
+                write_errors = {error['index']: error for error in err.details.get('writeErrors', [])}
+            self.invalidate_cache()
+
+        documents = {}
+        if updates:
+            query = {'_id': {'$in': [ObjectId(_id) for position, _id, data in updates]}}
+            documents = {document['_id']: document for document in self.query(query, self.default_projection)}
+
+        index = 0
+        for position, _id, data in updates:
+            if data:
+                error = write_errors.get(index)
+                index += 1
+                if error is not None:
+                    results[position] = self.get_error_result(self.get_write_error(error))
+                    continue
+
+            document = documents.get(ObjectId(_id))
+            if document is None:
+                results[position] = {'status': 404}
+            else:
+                results[position] = {'status': 200, 'data': self.serialize(document)}
+
+        return results
+
+    def bulk_delete(self, ids):
+        """
+        Deletes a list of objects with a single `delete_many`
+
+        :param ids: a list of ID strings
+        :return: the result of each item, in the order given. Each result has a `status` of 200, or 404 if the object
+                 doesn't exist
+        :rtype: list
+        """
+        self.check_bulk_input(ids)
+
+        object_ids = []
+        for _id in ids:
+            try:
+                object_ids.append(ObjectId(_id))
+            except (InvalidId, TypeError):
+                object_ids.append(None)  # invalid IDs can't exist, so they are reported as not found
+
+        valid = set(object_ids) - {None}
+        existing = self.existing_ids(valid) if valid else set()
+        if existing:
+            self.collection.delete_many({'_id': {'$in': list(existing)}})
+            self.invalidate_cache()
+
+        return [{'status': 200} if object_id in existing else {'status': 404} for object_id in object_ids]
 
     def exists(self, _id):
         """
@@ -143,22 +909,90 @@ class Model(object):
         :type _id: str
         :rtype: bool
         """
-        return self.collection.find({'_id': ObjectId(_id)}).count() == 1
+        return self.exists_where({'_id': ObjectId(_id)})
+
+    def exists_where(self, query):
+        """
+        Check to see if any document matches a query. Only the `_id` of the first match is fetched, so this is a single
+        index lookup if the queried fields are indexed
+
+        :param query: a MongoDB query document
+        :type query: dict
+        :rtype: bool
+        """
+        return self.validation_collection.find_one(query, {'_id': 1}) is not None
+
+    def count(self, query, operation=None):
+        """
+        Returns the exact number of documents that match a query
+
+        :param query: a MongoDB query document
+        :type query: dict
+        :param operation: see `get_read_collection`
+        :rtype: int
+        """
+        return self.get_read_collection(operation).count_documents(query)
+
+    def estimated_count(self, operation=None):
+        """
+        Returns the number of documents in the collection, from the collection's metadata. This doesn't scan the
+        collection, but may be inaccurate after an unclean shutdown or while a chunk migration is in progress
+
+        :param operation: see `get_read_collection`
+        :rtype: int
+        """
+        return self.get_read_collection(operation).estimated_document_count()
+
+    def count_matching(self, q):
+        """
+        Returns the number of documents that match a query. If there are no filters, the count is read from the
+        collection's metadata rather than by scanning the collection - see `estimated_count`
+
+        :param q: a MongoDB query document
+        :type q: dict
+        :rtype: int
+        """
+        if q:
+            return self.count(q, operation='count')
+        return self.estimated_count(operation='count')
+
+    def aggregate(self, q, group_by=None, metric=None):
+        """
+        Groups the documents that match a query, and computes metrics for each group, in the database
+
+        :param q: a MongoDB query document
+        :type q: dict
+        :param group_by: the `group_by` query string argument - see `crudcast.aggregation.parse_group_by`
+        :param metric: the `metric` query string argument - see `crudcast.aggregation.parse_metrics`
+        :return: a row for each group, with the group's field values and metrics, e.g.
+                 `[{'author': '5c0d...', 'count': 3, 'avg_pages': 250.5}]`
+        :rtype: list
+        """
+        group_by = parse_group_by(self, group_by)
+        metrics = parse_metrics(self, metric)
+        pipeline = get_pipeline(q, group_by, metrics, max_groups=self.options.get('max_groups', DEFAULT_MAX_GROUPS))
+
+        results = []
+        for group in self.get_read_collection('aggregate').aggregate(pipeline):
+            row = dict(group.pop('_id'))
+            row.update(group)
+            results.append(encode_document(row))
+        return results
 
     def delete(self, _id):
-        if self.exists(_id):
-            self.collection.find_one_and_delete({'_id': ObjectId(_id)})
-            return {}
-        else:
+        if not self.collection.delete_one({'_id': self.get_object_id(_id)}).deleted_count:
             abort(404)
+        self.invalidate_cache()
+        return {}
 
     def get_auth_type(self):
         """
         Returns an auth class for the model, if any
         """
         mappings = {
-            'basic': BasicAuth
+            'basic': BasicAuth,
+            'token': TokenAuth,
         }
-        auth_type = self.app.models[self.name]['options'].get('auth_type')
+        auth_type = self.options.get('auth_type')
         if auth_type:
             return mappings.get(auth_type)
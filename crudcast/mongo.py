@@ -0,0 +1,201 @@
+from crudcast.exceptions import ConfigException
+from pymongo import monitoring
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import ReadPreference
+import threading
+
+
+MONGO_OPTIONS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+    'max_idle_time_ms': 'maxIdleTimeMS',
+    'wait_queue_timeout_ms': 'waitQueueTimeoutMS',
+    'server_selection_timeout_ms': 'serverSelectionTimeoutMS',
+    'connect_timeout_ms': 'connectTimeoutMS',
+    'socket_timeout_ms': 'socketTimeoutMS',
+    'read_preference': 'readPreference',
+    'w': 'w',
+    'j': 'j',
+    'wtimeout_ms': 'wTimeoutMS',
+    'retry_writes': 'retryWrites',
+    'app_name': 'appname',
+}  #: maps the options in the `mongo` section of `config.yml` to `MongoClient` options
+
+DEFAULT_MAX_POOL_SIZE = 100  #: pymongo's default `maxPoolSize`
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primarypreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondarypreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}  #: the read preferences that can be set in `config.yml`, by lower case name
+READ_CONCERNS = ('local', 'available', 'majority', 'linearizable')  #: the read concern levels that can be set
+
+
+def get_client_options(options):
+    """
+    Converts the `mongo` section of `config.yml` into keyword arguments for `MongoClient`. Options can be given either
+    in snake case, e.g. `max_pool_size`, or with pymongo's own name, e.g. `maxPoolSize`
+
+    :type options: dict
+    :rtype: dict
+    """
+    names = dict(MONGO_OPTIONS)
+    names.update({name.lower(): name for name in MONGO_OPTIONS.values()})
+
+    client_options = {}
+    for key, val in (options or {}).items():
+        try:
+            client_options[names[key.lower()]] = val
+        except KeyError:
+            raise ConfigException('Invalid mongo option: %s' % key)
+    return client_options
+
+
+def get_read_preference(name):
+    """
+    Converts a read preference name, e.g. `secondaryPreferred` or `secondary_preferred`, into a read preference
+
+    :type name: str
+    :rtype: pymongo.read_preferences.ServerMode
+    """
+    try:
+        return READ_PREFERENCES[str(name).replace('_', '').lower()]
+    except KeyError:
+        raise ConfigException('Invalid read preference: %s' % name)
+
+
+def get_read_concern(level):
+    """
+    Converts a read concern level, e.g. `majority`, into a read concern
+
+    :type level: str
+    :rtype: pymongo.read_concern.ReadConcern
+    """
+    if level not in READ_CONCERNS:
+        raise ConfigException('Invalid read concern: %s' % level)
+    return ReadConcern(level)
+
+
+class PoolStats(object):
+    """
+    Collects statistics about a `MongoClient`'s connection pool, from pymongo's monitoring events. Pass `listeners` to
+    the client's `event_listeners` option.
+
+    Operations in progress are counted from command events, as each one holds a connection from the pool. With pymongo
+    3.9 or later, connections opened and failed checkouts (e.g. when `wait_queue_timeout_ms` is exceeded) are also
+    counted. The statistics cover the current process only
+
+    :param max_pool_size: the client's `maxPoolSize`, used to report the pool's utilisation
+    """
+    def __init__(self, max_pool_size=DEFAULT_MAX_POOL_SIZE):
+        self.max_pool_size = max_pool_size
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.operations = 0
+        self.failed_operations = 0
+        self.connections = 0
+        self.connections_created = 0
+        self.checkout_failures = 0
+
+        self.listeners = [CommandStatsListener(self)]
+        if hasattr(monitoring, 'ConnectionPoolListener'):
+            self.listeners.append(PoolStatsListener(self))
+
+    def started(self):
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def finished(self, failed=False):
+        with self.lock:
+            self.in_use -= 1
+            self.operations += 1
+            if failed:
+                self.failed_operations += 1
+
+    def opened(self):
+        with self.lock:
+            self.connections += 1
+            self.connections_created += 1
+
+    def closed(self):
+        with self.lock:
+            self.connections -= 1
+
+    def checkout_failed(self):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def snapshot(self):
+        """
+        :rtype: dict
+        """
+        with self.lock:
+            stats = {
+                'max_pool_size': self.max_pool_size,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'utilisation': self.in_use / self.max_pool_size if self.max_pool_size else 0.0,
+                'operations': self.operations,
+                'failed_operations': self.failed_operations,
+            }
+            if len(self.listeners) > 1:
+                stats.update({
+                    'connections': self.connections,
+                    'connections_created': self.connections_created,
+                    'checkout_failures': self.checkout_failures,
+                })
+            return stats
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    def __init__(self, stats):
+        self.stats = stats
+
+    def started(self, event):
+        self.stats.started()
+
+    def succeeded(self, event):
+        self.stats.finished()
+
+    def failed(self, event):
+        self.stats.finished(failed=True)
+
+
+if hasattr(monitoring, 'ConnectionPoolListener'):
+    class PoolStatsListener(monitoring.ConnectionPoolListener):
+        def __init__(self, stats):
+            self.stats = stats
+
+        def connection_created(self, event):
+            self.stats.opened()
+
+        def connection_closed(self, event):
+            self.stats.closed()
+
+        def connection_check_out_failed(self, event):
+            self.stats.checkout_failed()
+
+        def pool_created(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_checked_out(self, event):
+            pass
+
+        def connection_checked_in(self, event):
+            pass
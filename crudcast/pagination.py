@@ -0,0 +1,230 @@
+import base64
+import json
+from bson.errors import InvalidId
+from pymongo.collection import ObjectId
+from crudcast.exceptions import ValidationError
+from crudcast.encoders import encode
+import pymongo
+
+
+PAGINATION_PARAMS = ('limit', 'offset', 'cursor')  #: query string arguments that are used for pagination, not filtering
+
+
+def encode_cursor(values):
+    """
+    Encodes the position of the last document on a page as an opaque, URL-safe token
+
+    :param values: the sort key values of the last document on the page
+    :type values: dict
+    :rtype: str
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(token):
+    """
+    Decodes a token created by `encode_cursor`
+
+    :param token: the `cursor` query string argument
+    :type token: str
+    :rtype: dict
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        values['_id'] = ObjectId(values['_id'])
+    except (ValueError, TypeError, KeyError, InvalidId):
+        raise ValidationError('Invalid cursor', field='cursor')
+    return values
+
+
+class Paginator(object):
+    """
+    Splits the result of a list query into pages. Two modes are supported:
+
+    - offset mode (`?limit=20&offset=40`), which skips a number of documents
+    - cursor (keyset) mode (`?limit=20&cursor=<token>`), which continues from the sort key values (by default, the
+      `_id`) of the last document of the previous page. The cost of fetching a page doesn't grow with its position in
+      the collection, so this is the mode that should be used to walk large collections. It is the default if the
+      model has a `page_size`
+
+    :param model: the model being listed
+    :type model: crudcast.models.Model
+    :param limit: the requested page size
+    :param offset: number of documents to skip, in offset mode
+    :param cursor: a token returned by a previous page, in cursor mode
+    :param sort: the sort order - see `Model.get_sort`. Defaults to `_id`
+    """
+    def __init__(self, model, limit=None, offset=None, cursor=None, sort=None):
+        self.model = model
+        self.sort = sort or [('_id', pymongo.ASCENDING)]
+        page_size = model.options.get('page_size')
+        max_page_size = model.options.get('max_page_size', page_size)
+
+        self.limit = self.clean_int('limit', limit, minimum=1) if limit is not None else page_size
+        if self.limit and max_page_size:
+            self.limit = min(self.limit, max_page_size)
+        elif max_page_size:
+            self.limit = max_page_size
+
+        self.offset = self.clean_int('offset', offset, minimum=0) if offset is not None else None
+        self.cursor = decode_cursor(cursor) if cursor is not None else None
+
+        if self.offset is not None and self.cursor is not None:
+            raise ValidationError('offset and cursor cannot be combined', field='cursor')
+
+    @classmethod
+    def from_args(cls, model, args, sort=None):
+        """
+        Creates a paginator by removing the pagination arguments from a dict of query string arguments
+
+        :type model: crudcast.models.Model
+        :param args: query string arguments. Pagination arguments are removed from the dict
+        :type args: dict
+        :param sort: the sort order - see `Model.get_sort`
+        :rtype: Paginator
+        """
+        return cls(model, sort=sort, **{param: args.pop(param) for param in PAGINATION_PARAMS if param in args})
+
+    @staticmethod
+    def clean_int(name, value, minimum):
+        try:
+            value = int(value)
+            assert value >= minimum
+        except (ValueError, TypeError, AssertionError):
+            raise ValidationError('Must be an integer greater than or equal to %s' % minimum, field=name)
+        return value
+
+    @property
+    def enabled(self):
+        """
+        Whether or not the response should be paginated
+        """
+        return bool(self.limit) or self.offset is not None or self.cursor is not None
+
+    @property
+    def keyset(self):
+        return self.offset is None
+
+    def get_cursor_value(self, name):
+        """
+        Returns the value of a sort key from the cursor, converted to the type stored in the database
+        """
+        try:
+            value = self.cursor[name]
+        except KeyError:
+            raise ValidationError('Invalid cursor', field='cursor')
+
+        field = self.model.field_index.get(name)
+        if field is not None and isinstance(value, str):
+            value = field.parse(value)
+        return value
+
+    def get_after_clause(self, name, direction):
+        """
+        Returns a query that matches the documents after the cursor's value for a single sort key. MongoDB sorts null
+        and missing values before every other value, but `$gt` and `$lt` never match them, so they are handled
+        explicitly for fields that are neither required nor set automatically
+
+        :return: a query document, or `None` if no document can come after the cursor's value
+        :rtype: dict
+        """
+        value = self.get_cursor_value(name)
+        if direction == pymongo.ASCENDING:
+            return {name: {'$ne': None}} if value is None else {name: {'$gt': value}}
+        if value is None:
+            return None
+
+        field = self.model.field_index.get(name)
+        if name == '_id' or field is not None and (field.required or field.auto):
+            return {name: {'$lt': value}}
+        return {'$or': [{name: {'$lt': value}}, {name: None}]}
+
+    def get_keyset_query(self):
+        """
+        Returns a query that matches the documents after the cursor, in the sort order. For a sort of `a, b`, this
+        is `a > x or (a == x and b > y)`
+
+        :rtype: dict
+        """
+        clauses = []
+        for position, (name, direction) in enumerate(self.sort):
+            after = self.get_after_clause(name, direction)
+            if after is None:
+                continue
+            clause = {key: self.get_cursor_value(key) for key, key_direction in self.sort[:position]}
+            clause.update(after)
+            clauses.append(clause)
+
+        if not clauses:
+            return {'_id': {'$exists': False}}
+        return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+    def get_projection(self, projection):
+        """
+        Makes sure that the sort keys are fetched in cursor mode, as they are needed to create the next cursor
+        """
+        if not projection or not self.keyset:
+            return projection
+
+        names = [name for name, direction in self.sort]
+        if all(projection.values()):
+            return dict(projection, **{name: 1 for name in names})
+        return {key: val for key, val in projection.items() if key not in names}
+
+    def get_cursor(self, q, projection=None):
+        """
+        Returns a cursor for the documents on the page. One extra document is fetched, to check if there is a next page
+
+        :param q: a MongoDB query document
+        :type q: dict
+        :param projection: the fields to fetch - see `Model.get_projection`
+        """
+        if self.keyset:
+            if self.cursor is not None:
+                after = self.get_keyset_query()
+                q = {'$and': [q, after]} if q else after
+            cursor = self.model.query(q, projection=self.get_projection(projection), operation='list').sort(self.sort)
+        else:
+            # without a sort, MongoDB doesn't return documents in a stable order, so pages could overlap
+            cursor = self.model.query(q, projection=projection, operation='list').sort(self.sort).skip(self.offset)
+
+        if self.limit:
+            cursor = cursor.limit(self.limit + 1)
+        return cursor
+
+    def get_result(self, documents):
+        """
+        Removes the extra document fetched by `get_cursor`, if there is one
+
+        :param documents: the documents returned by the cursor
+        :type documents: list
+        :return: the documents on the page, and the pagination arguments for the next page (or `None` if this is the
+                 last page)
+        :rtype: tuple
+        """
+        if not self.limit or len(documents) <= self.limit:
+            return documents, None
+
+        documents = documents[:self.limit]
+        if self.keyset:
+            last = documents[-1]
+            next_args = {'limit': self.limit, 'cursor': encode_cursor({
+                name: encode(last.get(name)) for name, direction in self.sort
+            })}
+        else:
+            next_args = {'limit': self.limit, 'offset': self.offset + self.limit}
+
+        return documents, next_args
+
+    def get_page(self, q, projection=None):
+        """
+        Fetches a single page of documents
+
+        :param q: a MongoDB query document
+        :type q: dict
+        :param projection: the fields to fetch - see `Model.get_projection`
+        :return: the documents on the page, and the pagination arguments for the next page (or `None` if this is the
+                 last page)
+        :rtype: tuple
+        """
+        return self.get_result(list(self.get_cursor(q, projection=projection)))
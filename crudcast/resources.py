@@ -1,7 +1,8 @@
-from flask import request
+from flask import request, Response, abort
 from flask_restplus import Resource as BaseResource
-from crudcast.models import Model
-from crudcast.users import User
+from crudcast.pagination import Paginator, PAGINATION_PARAMS
+from crudcast.streaming import iter_stream, JSON, NDJSON
+from urllib.parse import urlencode
 
 
 class Resource(BaseResource):
@@ -17,6 +18,99 @@ class Resource(BaseResource):
         if auth_type:
             return auth_type.authenticate(request=request, user=self.app.user_manager)
 
+    def get_expand(self, expand):
+        """
+        Parses the `expand` query string argument for `self.model`. If any of the expanded models require
+        authentication, the user is authenticated for them as well
+
+        :param expand: the `expand` query string argument, if any
+        :return: the tree of reference fields to expand - see `Model.get_expand_tree`
+        :rtype: dict
+        """
+        tree = self.model.get_expand_tree(expand)
+        for model in self.model.get_expanded_models(tree):
+            auth_type = model.get_auth_type()
+            if auth_type:
+                auth_type.authenticate(request=request, user=self.app.user_manager)
+        return tree
+
+    def get_stream_mimetype(self):
+        """
+        Returns the format in which a list response should be streamed, or `None` if it shouldn't be streamed. NDJSON
+        is streamed whenever the client asks for it in the `Accept` header. JSON arrays are streamed if the model has
+        the `stream` option
+        """
+        if request.accept_mimetypes.best_match([JSON, NDJSON]) == NDJSON:
+            return NDJSON
+        if self.model.options.get('stream'):
+            return JSON
+
+    def get_cache_key(self, *parts):
+        """
+        Returns the key under which the response to the current request is cached, or `None` if it isn't cached
+        because the model has no `cache` option, or references are expanded (the related documents can change without
+        the model being written to)
+
+        :param parts: identify the endpoint, e.g. `'id', _id`. The normalised query string is added to them
+        :rtype: str
+        """
+        if self.model.cache is None or 'expand' in request.args:
+            return None
+        return self.model.cache.get_key(*parts, urlencode(sorted(request.args.items(multi=True))))
+
+    def cached_response(self, key, get_response):
+        """
+        Returns the response cached under `key`, or gets the response and caches it
+
+        :param key: see `get_cache_key`. If `None`, the response is not cached
+        :param get_response: a function that returns the response data, status and headers
+        :rtype: tuple
+        """
+        if key is None:
+            return get_response()
+
+        cached = self.model.cache.get(key)
+        if cached is not None:
+            return cached['data'], 200, cached['headers']
+
+        data, status, headers = get_response()
+        self.model.cache.set(key, {'data': data, 'headers': headers})
+        return data, status, headers
+
+    def list_response(self):
+        """
+        Lists the instances of `self.model` that match the query string arguments. If pagination is requested, or the
+        model has a `page_size`, a single page is returned, and the URL of the next page is given in the `Link` header
+        """
+        args = request.args.to_dict()
+        expand = self.get_expand(args.pop('expand', None))
+        projection = self.model.get_projection(args.pop('fields', None), expand=expand)
+        sort = self.model.get_sort(args.pop('ordering', None))
+        paginator = Paginator.from_args(self.model, args, sort=sort)
+        headers = {}
+
+        if paginator.enabled:
+            documents, next_args = paginator.get_page(self.model.get_query(**args), projection=projection)
+            if next_args is not None:
+                link_args = {key: val for key, val in request.args.items() if key not in PAGINATION_PARAMS}
+                link_args.update(next_args)
+                headers['Link'] = '<%s?%s>; rel="next"' % (request.base_url, urlencode(link_args))
+        else:
+            documents = self.model.query(self.model.get_query(**args), projection=projection, operation='list')
+            if sort:
+                documents = documents.sort(sort)
+
+        if expand:
+            documents = self.model.iter_expanded(documents, expand)
+
+        items = (self.model.serialize(document) for document in documents)
+
+        mimetype = self.get_stream_mimetype()
+        if mimetype:
+            return Response(iter_stream(mimetype, items), mimetype=mimetype, headers=headers)
+
+        return list(items), 200, headers
+
     @classmethod
     def set_app(cls, app):
         """
@@ -38,9 +132,10 @@ class ModelResource(Resource):
         :param model_name: the name of the model, as it appears in the config file
         :return: a list of instances of the model object
         """
-        self.model = Model(model_name, self.app)
+        self.model = self.app.get_model(model_name)
         user = self.check_auth()
-        return self.model.to_repr(**request.args)
+        key = None if self.get_stream_mimetype() else self.get_cache_key('list')
+        return self.cached_response(key, self.list_response)
 
     def post(self, model_name):
         """
@@ -49,12 +144,91 @@ class ModelResource(Resource):
         :param model_name: the name of the model, as it appears in the config file
         :return: details of the created instance
         """
-        self.model = Model(model_name, self.app)
+        self.model = self.app.get_model(model_name)
         user = self.check_auth()
         response = self.model.create(request.json)
         return response
 
 
+class BulkResource(Resource):
+    """
+    Bulk resources - create, update or delete a list of objects in a single request
+    """
+    def get_model(self, model_name):
+        """
+        Returns the model for a bulk request. The user model has no bulk endpoint, as bulk writes would bypass password
+        hashing and the clearing of cached credentials
+        """
+        if model_name == 'user' and self.app.user_manager is not None:
+            abort(404)
+        return self.app.get_model(model_name)
+
+    def post(self, model_name):
+        """
+        Create a list of instances of a model
+
+        :param model_name: the name of the model, as it appears in the config file
+        :return: the result of each item
+        """
+        self.model = self.get_model(model_name)
+        user = self.check_auth()
+        return self.model.bulk_create(request.json)
+
+    def patch(self, model_name):
+        """
+        Update a list of instances of a model. Each item must include the `_id` of the instance to update
+
+        :param model_name: the name of the model, as it appears in the config file
+        :return: the result of each item
+        """
+        self.model = self.get_model(model_name)
+        user = self.check_auth()
+        return self.model.bulk_update(request.json)
+
+    def delete(self, model_name):
+        """
+        Delete a list of instances of a model
+
+        :param model_name: the name of the model, as it appears in the config file
+        :return: the result of each item
+        """
+        self.model = self.get_model(model_name)
+        user = self.check_auth()
+        return self.model.bulk_delete(request.json)
+
+
+class CountResource(Resource):
+    """
+    Counts the instances of a model that match the query string filters
+    """
+    def get(self, model_name):
+        """
+        :param model_name: the name of the model, as it appears in the config file
+        :return: the number of matching instances
+        """
+        self.model = self.app.get_model(model_name)
+        user = self.check_auth()
+        q = self.model.get_query(**request.args.to_dict())
+        return {'count': self.model.count_matching(q)}
+
+
+class AggregateResource(Resource):
+    """
+    Groups the instances of a model that match the query string filters, and computes metrics for each group
+    """
+    def get(self, model_name):
+        """
+        :param model_name: the name of the model, as it appears in the config file
+        :return: a row for each group
+        """
+        self.model = self.app.get_model(model_name)
+        user = self.check_auth()
+        args = request.args.to_dict()
+        group_by = args.pop('group_by', None)
+        metric = args.pop('metric', None)
+        return self.model.aggregate(self.model.get_query(**args), group_by=group_by, metric=metric)
+
+
 class InstanceResource(Resource):
     """
     Instance level resources - implements all REST methods for paths with an ID
@@ -67,10 +241,16 @@ class InstanceResource(Resource):
         :param _id: MongoDB _id string
         :return: the MongoDB document
         """
-        self.model = Model(model_name, self.app)
+        self.model = self.app.get_model(model_name)
         user = self.check_auth()
-        instance = self.model.retrieve(_id)
-        return instance
+
+        def retrieve():
+            expand = self.get_expand(request.args.get('expand'))
+            projection = self.model.get_projection(request.args.get('fields'), expand=expand)
+            instance = self.model.retrieve(_id, expand=expand, projection=projection)
+            return instance, 200, {}
+
+        return self.cached_response(self.get_cache_key('id', _id), retrieve)
 
     def put(self, model_name, _id):
         """
@@ -81,7 +261,7 @@ class InstanceResource(Resource):
         :return: the MongoDB document
         """
 
-        self.model = Model(model_name, self.app)
+        self.model = self.app.get_model(model_name)
         user = self.check_auth()
         instance = self.model.update(_id=_id, data=request.json)
         return instance
@@ -94,7 +274,7 @@ class InstanceResource(Resource):
         :param _id: MongoDB _id string
         """
 
-        self.model = Model(model_name, self.app)
+        self.model = self.app.get_model(model_name)
         user = self.check_auth()
         instance = self.model.delete(_id=_id)
         return instance
@@ -107,9 +287,9 @@ class UserModelResource(Resource):
 
         :return: a list of instances of the user object
         """
-        self.model = User(self.app)
+        self.model = self.app.user_manager
         user = self.check_auth()
-        return self.model.to_repr(**request.args)
+        return self.list_response()
 
     def post(self):
         """
@@ -117,7 +297,7 @@ class UserModelResource(Resource):
 
         :return: details of the created user
         """
-        self.model = User(self.app)
+        self.model = self.app.user_manager
         user = self.check_auth()
         return self.model.create(request.json)
 
@@ -133,10 +313,9 @@ class UserInstanceResource(Resource):
         :param _id: MongoDB _id string
         :return: the MongoDB document
         """
-        self.model = User(self.app)
-        print('manager', self.app.user_manager)
+        self.model = self.app.user_manager
         user = self.check_auth()
-        return self.model.retrieve(_id)
+        return self.model.retrieve(_id, projection=self.model.get_projection(request.args.get('fields')))
 
     def put(self, _id):
         """
@@ -147,7 +326,7 @@ class UserInstanceResource(Resource):
         :return: the MongoDB document
         """
 
-        self.model = User(self.app)
+        self.model = self.app.user_manager
         user = self.check_auth()
         return self.model.update(_id=_id, data=request.json)
 
@@ -158,6 +337,18 @@ class UserInstanceResource(Resource):
         :param _id: MongoDB _id string
         """
 
-        self.model = User(self.app)
+        self.model = self.app.user_manager
         user = self.check_auth()
         return self.model.delete(_id=_id)
+
+
+class UserTokenResource(Resource):
+    def post(self):
+        """
+        Exchange a username and password for a token, for use with the `token` auth type
+
+        :return: the token, and the number of seconds for which it is valid
+        """
+        user_manager = self.app.user_manager
+        data = request.json or {}
+        return user_manager.issue_token(data.get(user_manager.username_field), data.get('password'))
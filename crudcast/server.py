@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+import os
+import signal
+import time
+import traceback
+
+
+MIN_WORKER_UPTIME = 1  #: workers that exit within this many seconds of starting are counted as failing to start
+MAX_WORKER_FAILURES = 5  #: the server stops after this many workers in a row fail to start
+MAX_RESTART_DELAY = 10  #: the longest wait, in seconds, before replacing a worker that failed to start
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """
+    A WSGI server that handles requests with a fixed pool of threads
+
+    :param threads: number of threads. If 1, requests are handled one at a time, in the server's thread
+    """
+    def __init__(self, host, port, app, threads=1, **kwargs):
+        super().__init__(host, port, app, **kwargs)
+        self.threads = threads
+        self.executor = None
+
+    def process_request(self, request, client_address):
+        if self.threads <= 1:
+            return super().process_request(request, client_address)
+
+        # the pool is created lazily, so that it is only ever started in the worker processes
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def start_worker(app, server):
+    """
+    Forks a worker process that serves requests from the (already bound) server socket. The worker connects to
+    MongoDB itself, as a `MongoClient` must not be shared between processes
+
+    :return: the worker's process ID
+    :rtype: int
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 0
+    try:
+        app.connect()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(app, host, port, workers=1, threads=1):
+    """
+    Serves an app with a pre-forked pool of `workers` processes, each handling requests with `threads` threads.
+    Workers that stop unexpectedly are replaced. The server stops when it receives SIGINT or SIGTERM.
+
+    A worker that exits straight after starting (e.g. because MongoDB can't be reached) is replaced after a delay,
+    which doubles with each failure. After `MAX_WORKER_FAILURES` failures in a row, the server gives up and raises
+    `RuntimeError`
+
+    :type app: crudcast.app.CrudcastApp
+    :param host: host name
+    :param port: port number
+    :param workers: number of processes
+    :param threads: number of threads per process
+    """
+    if workers > 1 and not hasattr(os, 'fork'):
+        raise RuntimeError('Multiple workers are not supported on this platform')
+
+    server = PoolWSGIServer(host, int(port), app, threads=threads)
+    print(' * Running on http://%s:%s/ with %d worker(s) and %d thread(s) per worker (Press CTRL+C to quit)'
+          % (host, server.port, workers, threads))
+
+    if workers <= 1:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, stop)
+    pids = {}  # the time each worker was started, by process ID
+    failures = 0
+    try:
+        while True:
+            while len(pids) < workers:
+                pids[start_worker(app, server)] = time.monotonic()
+            pid, status = os.wait()
+            started = pids.pop(pid, None)
+            if started is None or time.monotonic() - started >= MIN_WORKER_UPTIME:
+                failures = 0
+                continue
+
+            failures += 1
+            if failures >= MAX_WORKER_FAILURES:
+                raise RuntimeError('%d workers in a row exited immediately after starting' % failures)
+            time.sleep(min(0.5 * 2 ** (failures - 1), MAX_RESTART_DELAY))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        server.server_close()
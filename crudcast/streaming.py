@@ -0,0 +1,64 @@
+import json
+from itertools import islice
+
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+CHUNK_SIZE = 100  #: number of documents serialized per chunk of a streamed response
+
+
+def chunked(items, size):
+    """
+    Splits an iterable into lists of up to `size` items, without consuming more of it than necessary
+
+    :type items: iterable
+    :type size: int
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_json_array(items, chunk_size=CHUNK_SIZE):
+    """
+    Yields a JSON array, chunk by chunk
+
+    :param items: JSON-serializable objects
+    :type items: iterable
+    :rtype: generator
+    """
+    yield '['
+    separator = ''
+    for chunk in chunked(items, chunk_size):
+        yield separator + ','.join(json.dumps(item) for item in chunk)
+        separator = ','
+    yield ']\n'
+
+
+def iter_ndjson(items, chunk_size=CHUNK_SIZE):
+    """
+    Yields newline-delimited JSON (one object per line), chunk by chunk
+
+    :param items: JSON-serializable objects
+    :type items: iterable
+    :rtype: generator
+    """
+    for chunk in chunked(items, chunk_size):
+        yield ''.join(json.dumps(item) + '\n' for item in chunk)
+
+
+def iter_stream(mimetype, items, chunk_size=CHUNK_SIZE):
+    """
+    Returns a generator that streams `items` in the given format
+
+    :param mimetype: either `application/json` or `application/x-ndjson`
+    :param items: JSON-serializable objects
+    :type items: iterable
+    :rtype: generator
+    """
+    if mimetype == NDJSON:
+        return iter_ndjson(items, chunk_size)
+    return iter_json_array(items, chunk_size)
@@ -0,0 +1,40 @@
+import gzip
+import hashlib
+import json
+from flask import Response
+
+
+class SwaggerDocument(object):
+    """
+    A pre-serialized swagger document. The JSON (and a gzipped copy of it) is built once, and served with an `ETag`
+    header, so that clients which poll the document don't cost any more than a `304 Not Modified` response
+
+    :param config: the complete swagger configuration
+    :type config: dict
+    """
+    def __init__(self, config):
+        self.config = config
+        self.content = json.dumps(config).encode()
+        self.gzipped = gzip.compress(self.content)
+        self.etag = hashlib.sha1(self.content).hexdigest()
+
+    def response(self, request):
+        """
+        Returns the document as a Flask response, gzipped if the client accepts it
+
+        :type request: flask.Request
+        :rtype: flask.Response
+        """
+        use_gzip = bool(request.accept_encodings['gzip'])
+        etag = self.etag + '-gzip' if use_gzip else self.etag
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif use_gzip:
+            response = Response(self.gzipped, mimetype='application/json', headers={'Content-Encoding': 'gzip'})
+        else:
+            response = Response(self.content, mimetype='application/json')
+
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
@@ -9,7 +9,10 @@ from models import Model
 from api import get_api
 from app import CrudcastApp
 import json
+import threading
+import time
 from datetime import datetime
+from bson import ObjectId
 
 
 crudcast_config = {
@@ -46,6 +49,151 @@ class CrudCastTestCase(unittest.TestCase):
             with mock.patch('flask_swagger_ui.get_swaggerui_blueprint'):
                 app.get_swagger_ui_view()
 
+    def test_mongo_options(self):
+        from crudcast.exceptions import ConfigException
+        from crudcast.mongo import get_client_options, PoolStats
+
+        self.assertEqual({'maxPoolSize': 50, 'waitQueueTimeoutMS': 1000, 'readPreference': 'secondaryPreferred', 'w': 1},
+                         get_client_options({'max_pool_size': 50, 'waitQueueTimeoutMS': 1000,
+                                             'read_preference': 'secondaryPreferred', 'w': 1}))
+        self.assertEqual({}, get_client_options(None))
+        with self.assertRaises(ConfigException):
+            get_client_options({'pool_size': 50})
+
+        stats = PoolStats(max_pool_size=4)
+        command_listener = stats.listeners[0]
+        for i in range(3):
+            command_listener.started(None)
+        command_listener.succeeded(None)
+        command_listener.failed(None)
+        snapshot = stats.snapshot()
+        self.assertEqual((1, 3, 2, 1), (snapshot['in_use'], snapshot['peak_in_use'], snapshot['operations'],
+                                        snapshot['failed_operations']))
+        self.assertEqual(0.25, snapshot['utilisation'])
+
+        config = dict(crudcast_config, mongo={'max_pool_size': 10, 'j': True})
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))), \
+                mock.patch('pymongo.MongoClient') as client:
+            app = CrudcastApp(__name__, config_file='file')
+            client.assert_called_once_with('mongodb://localhost:27017/', connect=False, maxPoolSize=10, j=True,
+                                           event_listeners=app.pool_stats.listeners)
+            self.assertEqual(10, app.get_stats()['mongo']['max_pool_size'])
+
+            # a new client is created after the app is forked. The parent's client is left open
+            app.check_connection()
+            self.assertEqual(1, client.call_count)
+            client.side_effect = lambda *args, **kwargs: time.sleep(0.05) or mock.MagicMock()
+            parent_client = app.client
+            with mock.patch('os.getpid', return_value=app.client_pid + 1):
+                threads = [threading.Thread(target=app.check_connection) for i in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(2, client.call_count)
+            self.assertEqual(app.db['test'], app.get_model('test').collection)
+            parent_client.close.assert_not_called()
+
+            # a client replaced in the same process is closed
+            forked_client = app.client
+            with mock.patch('os.getpid', return_value=app.client_pid):
+                app.connect()
+            forked_client.close.assert_called_once_with()
+        CrudcastApp.crudcast_config.pop('mongo')
+
+    def test_swagger_document(self):
+        import gzip
+        from flask import request
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(crudcast_config))):
+            app = CrudcastApp(__name__, config_file='file')
+
+        with mock.patch.object(app, 'build_swagger_config', wraps=app.build_swagger_config) as build:
+            document = app.get_swagger_document()
+            self.assertIs(document, app.get_swagger_document())
+            self.assertEqual(1, build.call_count)
+        self.assertNotIn('paths', app.crudcast_config['swagger'])
+
+        with app.test_request_context():
+            response = document.response(request)
+            self.assertEqual(document.config, json.loads(response.data.decode()))
+            etag = response.headers['ETag']
+
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+            response = document.response(request)
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            self.assertEqual(document.content, gzip.decompress(response.data))
+            self.assertNotEqual(etag, response.headers['ETag'])
+
+        with app.test_request_context(headers={'If-None-Match': etag}):
+            response = document.response(request)
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(b'', response.data)
+
+    def test_registry(self):
+        from werkzeug.exceptions import NotFound
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(crudcast_config))):
+            app = CrudcastApp(__name__, config_file='file')
+
+        model = app.get_model('test')
+        self.assertIs(model, app.get_model('test'))
+        self.assertEqual(('name',), model.required_fields)
+        self.assertEqual(('name',), model.unique_fields)
+        self.assertIs(app.get_model('test2'), model.get_field_by_name('m2m').related)
+
+        with self.assertRaises(NotFound):
+            app.get_model('does-not-exist')
+
+    def test_round_trips(self):
+        from crudcast.exceptions import ValidationError, handle_invalid_usage
+
+        config = {'models': {'book': {'fields': {'name': {}, 'pages': {'type': 'number'}}}}}
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))):
+            app = CrudcastApp(__name__, config_file='file')
+        get_api(app)
+        client = app.test_client()
+
+        _id = ObjectId()
+        collection = mock.MagicMock()
+        collection.insert_one.return_value.inserted_id = _id
+        collection.find_one.return_value = {'_id': _id, 'name': 'test'}
+        collection.find_one_and_update.return_value = {'_id': _id, 'name': 'test', 'pages': 10}
+        collection.find.return_value = [{'_id': _id, 'name': 'test'}]
+        collection.delete_one.return_value.deleted_count = 1
+        collection.with_options.return_value = collection
+        app.get_model('book').collection = collection
+
+        requests = [
+            (client.post, '/api/book/', {'name': 'test'}, {'_id': str(_id), 'name': 'test'}),
+            (client.get, '/api/book/', None, [{'_id': str(_id), 'name': 'test'}]),
+            (client.get, '/api/book/%s/' % _id, None, {'_id': str(_id), 'name': 'test'}),
+            (client.put, '/api/book/%s/' % _id, {'pages': 10}, {'_id': str(_id), 'name': 'test', 'pages': 10}),
+            (client.delete, '/api/book/%s/' % _id, None, {}),
+        ]
+        for method, url, data, expected in requests:
+            collection.reset_mock()
+            response = method(url, data=json.dumps(data) if data else None, content_type='application/json')
+            self.assertEqual(expected, json.loads(response.data.decode()))
+            self.assertEqual(1, len(collection.method_calls), collection.method_calls)
+
+        # invalid data is a 400 for an object that exists, and a 404 for one that doesn't
+        app.register_error_handler(ValidationError, handle_invalid_usage)
+        collection.distinct.return_value = [_id]
+        self.assertEqual(400, client.put('/api/book/%s/' % _id, data=json.dumps({'pages': 'many'}),
+                                         content_type='application/json').status_code)
+        collection.distinct.assert_called_once_with('_id', {'_id': {'$in': [_id]}})
+        collection.distinct.return_value = []
+        self.assertEqual(404, client.put('/api/book/%s/' % _id, data=json.dumps({'pages': 'many'}),
+                                         content_type='application/json').status_code)
+
+        collection.find_one.return_value = None
+        collection.find_one_and_update.return_value = None
+        collection.delete_one.return_value.deleted_count = 0
+        self.assertEqual(404, client.get('/api/book/%s/' % _id).status_code)
+        self.assertEqual(404, client.put('/api/book/%s/' % _id, data=json.dumps({'pages': 10}),
+                                         content_type='application/json').status_code)
+        self.assertEqual(404, client.delete('/api/book/%s/' % _id).status_code)
+        self.assertEqual(404, client.get('/api/book/invalid/').status_code)
+
     @mock.patch('crudcast.app.CrudcastApp', MockApp)
     @mock.patch('argparse.ArgumentParser', MockParser)
     def test_entrypoint(self, *args):
@@ -53,6 +201,66 @@ class CrudCastTestCase(unittest.TestCase):
             from entrypoint import main
             main()
 
+    def test_create_app(self):
+        import crudcast.app
+        from crudcast.wsgi import create_app, STATS_URL
+
+        config = dict(crudcast_config, stats=True)
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))) as mock_open, \
+                mock.patch.dict('os.environ', {'CRUDCAST_CONFIG_FILE': 'from_env.yml'}), \
+                mock.patch.object(crudcast.app.CrudcastApp, 'sync_indexes', return_value=[]) as sync_indexes:
+            app = create_app()
+            self.addCleanup(app.crudcast_config.pop, 'stats')
+            mock_open.assert_called_once_with('from_env.yml', 'r')
+            sync_indexes.assert_called_once_with()
+
+            create_app('config.yml')
+            mock_open.assert_called_with('config.yml', 'r')
+
+        rules = {rule.rule for rule in app.url_map.iter_rules()}
+        self.assertTrue({'/swagger', STATS_URL, '/api/<string:model_name>/', '/api/<string:model_name>/<string:_id>/'}
+                        <= rules)
+        self.assertEqual(200, app.test_client().get(STATS_URL).status_code)
+
+    def test_server(self):
+        from crudcast import server
+        from werkzeug.serving import BaseWSGIServer
+
+        wsgi_server = server.PoolWSGIServer('127.0.0.1', 0, MockApp(), threads=1)
+        self.addCleanup(wsgi_server.server_close)
+        with mock.patch.object(BaseWSGIServer, 'process_request') as process_request:
+            wsgi_server.process_request('request', 'address')
+        process_request.assert_called_once_with('request', 'address')
+        self.assertIsNone(wsgi_server.executor)
+
+        wsgi_server.threads = 2
+        with mock.patch.object(wsgi_server, 'finish_request', side_effect=[None, Exception]) as finish_request, \
+                mock.patch.object(wsgi_server, 'handle_error') as handle_error, \
+                mock.patch.object(wsgi_server, 'shutdown_request') as shutdown_request:
+            wsgi_server.process_request('first', 'address')
+            wsgi_server.process_request('second', 'address')
+            wsgi_server.executor.shutdown(wait=True)
+        self.assertEqual([mock.call('first', 'address'), mock.call('second', 'address')],
+                         finish_request.call_args_list)
+        handle_error.assert_called_once_with('second', 'address')
+        self.assertEqual([mock.call('first'), mock.call('second')], shutdown_request.call_args_list)
+
+        # workers that keep exiting straight away are restarted with a backoff, then the server gives up
+        started = []
+
+        def start_worker(app, wsgi_server):
+            started.append(100 + len(started))
+            return started[-1]
+
+        with mock.patch.object(server, 'PoolWSGIServer'), mock.patch.object(server, 'start_worker', start_worker), \
+                mock.patch('os.wait', side_effect=lambda: (started[-1], 256)) as wait, \
+                mock.patch('os.kill'), mock.patch('os.waitpid'), mock.patch('signal.signal'), \
+                mock.patch('time.sleep') as sleep, mock.patch('builtins.print'):
+            with self.assertRaises(RuntimeError):
+                server.serve(MockApp(), '127.0.0.1', 0, workers=2)
+        self.assertEqual(server.MAX_WORKER_FAILURES, wait.call_count)
+        self.assertEqual([0.5, 1, 2, 4], [call[0][0] for call in sleep.call_args_list])
+
     def test_exceptions(self, *args,):
         from crudcast.exceptions import handle_invalid_usage, ValidationError
         with self.assertRaises(RuntimeError):
@@ -124,6 +332,26 @@ class CrudCastTestCase(unittest.TestCase):
         with self.assertRaises(Exception):
             fk.validate('507f1f77bcf86cd799439011')
 
+    def test_autofield_concurrency(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from crudcast.fields import COUNTERS_COLLECTION
+
+        for block_size in [1, 7]:
+            model = MockModel()
+            af = AutoField('test', model=model, block_size=block_size)
+            counters = model.collection.database[COUNTERS_COLLECTION]
+
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                values = list(executor.map(lambda i: af.set(), range(700)))
+
+            self.assertEqual(set(range(1, 701)), set(values))
+            self.assertEqual(700 // block_size, counters.calls)
+
+        # numbering continues from the highest existing value
+        model = MockModel(count=1)
+        model.collection.find_one = lambda *args, **kwargs: {'test': 41}
+        self.assertEqual(42, AutoField('test', model=model).set())
+
     def test_model(self):
         app = MockApp()
         model = Model('test', app=app)
@@ -132,15 +360,937 @@ class CrudCastTestCase(unittest.TestCase):
             self.assertEqual([], model.get_field_by_name('test'))
 
         model.validate({})
-        model.find(test='test', test_two=['test'], test_three=False)
+        with self.assertRaises(Exception):
+            model.find(test='test')
         model.to_repr()
 
-        with self.assertRaises(Exception):
-            model.create({})
+        # the created object is returned without being fetched again
+        self.assertEqual({'_id': '507f1f77bcf86cd799439011'}, model.create({}))
 
         with self.assertRaises(Exception):
             model.update(_id='507f1f77bcf86cd799439011', data={})
 
+    def test_async_model(self):
+        import asyncio
+        from crudcast.aio import AsyncModel
+        from crudcast.fields import COUNTERS_COLLECTION
+        from mocks import MockAsyncCollection, MockCounters
+        from pymongo.read_preferences import ReadPreference
+        from werkzeug.exceptions import BadRequest, NotFound
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        collection.with_options.return_value = collection
+        collection.database = {COUNTERS_COLLECTION: MockCounters()}
+        app.models = {'test': {'collection': MockAsyncCollection(collection), 'fields': {
+            'name': {'unique': True, 'required': True}, 'number': {'type': 'autofield'}
+        }}}
+        model = AsyncModel('test', app=app)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        run = loop.run_until_complete
+
+        collection.find.return_value = []
+        collection.find_one.return_value = {'number': 10}
+        collection.insert_one.return_value.inserted_id = ObjectId('507f1f77bcf86cd799439011')
+        self.assertEqual({'_id': '507f1f77bcf86cd799439011', 'name': 'a', 'number': 11}, run(model.create({'name': 'a'})))
+        self.assertEqual({'_id': '507f1f77bcf86cd799439011', 'name': 'b', 'number': 12}, run(model.create({'name': 'b'})))
+        collection.find_one.assert_called_once()  # the counter is only seeded once
+
+        collection.find.return_value = [{'_id': ObjectId(), 'name': 'a'}]
+        with self.assertRaises(BadRequest) as context:
+            run(model.create({'name': 'a'}))
+        self.assertEqual({'name': 'test with this name already exists'}, context.exception.to_dict())
+        with self.assertRaises(BadRequest):
+            run(model.create({}))
+        collection.distinct.return_value = []
+        with self.assertRaises(NotFound):
+            run(model.update('507f1f77bcf86cd799439011', {'name': 'a'}))
+
+        cursor = collection.find.return_value = mock.MagicMock()
+        cursor.sort.return_value = cursor.limit.return_value = cursor
+        cursor.__iter__.return_value = iter([{'_id': ObjectId(), 'name': 'a'}, {'_id': ObjectId(), 'name': 'b'}])
+        documents, next_args = run(model.list({'limit': '1', 'name__in': 'a,b'}))
+        self.assertEqual(['a'], [document['name'] for document in documents])
+        self.assertEqual(1, next_args['limit'])
+        collection.find.assert_called_with({'name': {'$in': ['a', 'b']}})
+        cursor.limit.assert_called_with(2)
+
+        collection.find_one.return_value = None
+        with self.assertRaises(NotFound):
+            run(model.retrieve('507f1f77bcf86cd799439011'))
+        collection.delete_one.return_value.deleted_count = 0
+        with self.assertRaises(NotFound):
+            run(model.delete('507f1f77bcf86cd799439011'))
+
+        # read options wrap the Motor collection, so reads are still coroutines
+        secondary = mock.MagicMock()
+        collection.with_options.side_effect = lambda read_preference=None, **options: (
+            secondary if read_preference == ReadPreference.SECONDARY else collection
+        )
+        app.models['test']['options'] = {'read_preference': {'list': 'secondary'}}
+        model = AsyncModel('test', app=app)
+        secondary.find.return_value = [{'_id': ObjectId(), 'name': 'a'}]
+        documents, next_args = run(model.list({}))
+        self.assertEqual(['a'], [document['name'] for document in documents])
+        secondary.find.assert_called_once_with({})
+
+    def test_async_user_references(self):
+        import asyncio
+        from crudcast.aio import AsyncCrudcastApp
+        from mocks import MockAsyncClient
+        from werkzeug.exceptions import BadRequest, NotFound
+
+        config = {
+            'users': {},
+            'models': {'note': {'fields': {'owner': {'type': 'foreignkey', 'to': 'user'}}}},
+        }
+        client = mock.MagicMock()
+        collection = client['db']['collection']
+        collection.with_options.return_value = collection
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))):
+            app = AsyncCrudcastApp('config.yml', client=MockAsyncClient(client))
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        run = loop.run_until_complete
+
+        owner = ObjectId()
+        collection.distinct.return_value = [owner]
+        collection.insert_one.return_value.inserted_id = ObjectId()
+        run(app.get_model('note').create({'owner': str(owner)}))
+        collection.distinct.assert_called_once_with('_id', {'_id': {'$in': [owner]}})
+
+        collection.distinct.return_value = []
+        with self.assertRaises(BadRequest):
+            run(app.get_model('note').create({'owner': str(ObjectId())}))
+
+        # the user endpoints are still only served by the Flask app
+        with self.assertRaises(NotFound):
+            app.match('/api/user/')
+
+    def test_reference_validation(self):
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        authors = mock.MagicMock()
+        authors.with_options.return_value = authors
+        app.models = {
+            'author': {'collection': authors, 'fields': {}},
+            'publisher': {
+                'collection': mock.MagicMock(),
+                'fields': {
+                    'editor': {'type': 'foreignkey', 'to': 'author'},
+                    'authors': {'type': 'manytomany', 'to': 'author'},
+                },
+            },
+        }
+        app.get_model = lambda name: models[name]
+        models = {name: Model(name, app=app) for name in app.models}
+        publisher = models['publisher']
+
+        ids = [ObjectId() for i in range(500)]
+        authors.distinct.return_value = ids
+        data = {'editor': str(ids[0]), 'authors': [str(_id) for _id in ids] + [str(ids[1])]}
+        self.assertEqual(data, publisher.validate(dict(data)))
+        authors.distinct.assert_called_once_with('_id', {'_id': {'$in': mock.ANY}})
+        self.assertEqual(set(ids), set(authors.distinct.call_args[0][1]['_id']['$in']))
+
+        missing = [str(ObjectId()), str(ObjectId())]
+        with self.assertRaises(BadRequest) as context:
+            publisher.validate({'authors': [str(ids[0])] + missing})
+        self.assertEqual({'authors': {_id: 'Cannot find author with this ID' for _id in missing}},
+                         context.exception.to_dict())
+
+        with self.assertRaises(BadRequest) as context:
+            publisher.validate({'authors': ['invalid', str(ids[0])]})
+        self.assertEqual({'authors': {'invalid': 'Invalid id'}}, context.exception.to_dict())
+
+    def test_unique_validation(self):
+        from werkzeug.exceptions import BadRequest
+        from pymongo.errors import DuplicateKeyError
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        collection.with_options.return_value = collection
+        app.models = {'test': {'collection': collection, 'fields': {
+            'name': {'unique': True}, 'email': {'unique': True}, 'code': {'unique': True}, 'notes': {}
+        }}}
+        model = Model('test', app=app)
+
+        collection.find.return_value = [{'_id': ObjectId(), 'name': 'a'}, {'_id': ObjectId(), 'email': 'b'}]
+        with self.assertRaises(BadRequest) as context:
+            model.validate({'name': 'a', 'email': 'b', 'code': 'c', 'notes': 'd'})
+        self.assertEqual({'name': 'test with this name already exists', 'email': 'test with this email already exists'},
+                         context.exception.to_dict())
+        collection.find.assert_called_once_with(
+            {'$or': [{'name': 'a'}, {'email': 'b'}, {'code': 'c'}]}, {'name': 1, 'email': 1, 'code': 1})
+
+        _id = '507f1f77bcf86cd799439011'
+        collection.find.return_value = [{'_id': ObjectId(_id), 'code': 'c'}]
+        self.assertEqual({'code': 'c'}, model.validate({'code': 'c'}, _id=_id))
+        collection.find.assert_called_with({'$or': [{'code': 'c'}]}, {'code': 1})
+
+        collection.find.reset_mock()
+        model.validate({'notes': 'd'})
+        self.assertFalse(collection.find.called)
+
+        collection.insert_one.side_effect = DuplicateKeyError('E11000', 11000, {'keyValue': {'email': 'b'}})
+        with self.assertRaises(BadRequest) as context:
+            model.create({'email': 'b'})
+        self.assertEqual({'email': 'test with this email already exists'}, context.exception.to_dict())
+
+        collection.insert_one.side_effect = DuplicateKeyError('E11000', 11000, {
+            'errmsg': 'E11000 duplicate key error collection: test.test index: code_1 dup key: { : "c" }'
+        })
+        with self.assertRaises(BadRequest) as context:
+            model.create({'code': 'c'})
+        self.assertEqual({'code': 'test with this code already exists'}, context.exception.to_dict())
+
+    def test_bulk(self):
+        from pymongo.errors import BulkWriteError
+
+        app = MockApp()
+        authors = mock.MagicMock()
+        authors.with_options.return_value = authors
+        books = mock.MagicMock()
+        books.with_options.return_value = books
+        app.models = {
+            'author': {'collection': authors, 'fields': {}},
+            'book': {'collection': books, 'fields': {
+                'isbn': {'unique': True, 'required': True},
+                'author': {'type': 'foreignkey', 'to': 'author'},
+                'number': {'type': 'autofield'},
+            }, 'options': {'max_bulk_size': 6}},
+        }
+        app.get_model = lambda name: models[name]
+        models = {name: Model(name, app=app) for name in app.models}
+        book = models['book']
+        counters = books.database.__getitem__.return_value
+
+        author_id = ObjectId()
+        authors.distinct.return_value = [author_id]
+        books.find.return_value = [{'_id': ObjectId(), 'isbn': 'taken'}]
+        books.find_one.return_value = None
+        counters.find_one_and_update.return_value = {'seq': 2}
+        books.insert_many.side_effect = BulkWriteError({'writeErrors': [
+            {'index': 1, 'code': 11000, 'errmsg': 'E11000', 'keyValue': {'isbn': 'race'}}
+        ]})
+
+        results = book.bulk_create([
+            {'isbn': 'a', 'author': str(author_id)},
+            {'isbn': 'race'},
+            {'isbn': 'taken'},
+            {'isbn': 'a'},
+            {'isbn': 'b', 'author': str(ObjectId())},
+            {'author': str(author_id)},
+        ])
+        self.assertEqual([201, 400, 400, 400, 400, 400], [result['status'] for result in results])
+        self.assertEqual(1, results[0]['data']['number'])
+        for position in [1, 2, 3]:
+            self.assertEqual({'isbn': 'book with this isbn already exists'}, results[position]['errors'])
+        self.assertEqual({'isbn': 'This field is required'}, results[5]['errors'])
+
+        authors.distinct.assert_called_once()
+        books.find.assert_called_once()
+        counters.find_one_and_update.assert_called_once()
+        books.insert_many.assert_called_once()
+        self.assertFalse(books.insert_one.called)
+
+        with self.assertRaises(Exception):
+            book.bulk_create([{'isbn': str(i)} for i in range(7)])
+
+        _id = ObjectId()
+        missing = ObjectId()
+        books.find.reset_mock()
+        books.find.side_effect = [[], [{'_id': _id, 'isbn': 'c'}]]
+        results = book.bulk_update([{'_id': str(_id), 'isbn': 'c'}, {'_id': str(missing), 'isbn': 'd'}, {'isbn': 'e'}])
+        self.assertEqual([200, 404, 400], [result['status'] for result in results])
+        self.assertEqual(2, len(books.bulk_write.call_args[0][0]))
+        self.assertEqual(2, books.find.call_count)
+
+        authors.distinct.return_value = [_id]
+        book.collection = authors
+        self.assertEqual([{'status': 200}, {'status': 404}, {'status': 404}],
+                         book.bulk_delete([str(_id), str(missing), 'invalid']))
+        authors.delete_many.assert_called_once_with({'_id': {'$in': [_id]}})
+
+    def test_expand(self):
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        collections = {name: mock.MagicMock() for name in ['publisher', 'author', 'book']}
+        app.models = {
+            'publisher': {'collection': collections['publisher'], 'fields': {'name': {}}},
+            'author': {'collection': collections['author'], 'fields': {
+                'publisher': {'type': 'foreignkey', 'to': 'publisher'},
+            }},
+            'book': {'collection': collections['book'], 'fields': {
+                'author': {'type': 'foreignkey', 'to': 'author'},
+                'authors': {'type': 'manytomany', 'to': 'author'},
+                'title': {},
+            }},
+        }
+        app.get_model = lambda name: models[name]
+        models = {name: Model(name, app=app) for name in app.models}
+        book = models['book']
+
+        publisher = {'_id': ObjectId(), 'name': 'Penguin'}
+        authors = [{'_id': ObjectId(), 'publisher': str(publisher['_id'])} for i in range(2)]
+        missing = str(ObjectId())
+        collections['author'].find.return_value = authors
+        collections['publisher'].find.return_value = [publisher]
+
+        tree = book.get_expand_tree('author, authors.publisher')
+        self.assertEqual({'author': {}, 'authors': {'publisher': {}}}, tree)
+        self.assertEqual(['author', 'author', 'publisher'], [model.name for model in book.get_expanded_models(tree)])
+
+        documents = [
+            {'_id': ObjectId(), 'author': str(authors[0]['_id']), 'authors': [str(authors[1]['_id']), missing]}
+            for i in range(50)
+        ]
+        book.expand(documents, {'authors': {'publisher': {}}})
+        self.assertEqual(1, collections['author'].find.call_count)
+        self.assertEqual(1, collections['publisher'].find.call_count)
+        self.assertEqual([{'_id': str(authors[1]['_id']), 'publisher': {'_id': str(publisher['_id']), 'name': 'Penguin'}},
+                          missing], documents[0]['authors'])
+        self.assertEqual(str(authors[0]['_id']), documents[0]['author'])
+
+        for expand in ['title', 'author.nothing', 'authors.publisher.name']:
+            with self.assertRaises(BadRequest):
+                book.get_expand_tree(expand)
+
+        # expanded references are fetched even if they are not in `fields`
+        self.assertEqual({'title': 1, 'author': 1, 'authors': 1}, book.get_projection('title', expand=tree))
+        self.assertEqual({'title': 1}, book.get_projection('title', expand={}))
+        book.default_projection = {'title': 0, 'author': 0}
+        self.assertEqual({'title': 0}, book.get_projection(expand=tree))
+
+    def test_expand_user(self):
+        config = {
+            'users': {'options': {}},
+            'models': {'note': {'fields': {'text': {}, 'owner': {'type': 'foreignkey', 'to': 'user'}}}},
+        }
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))):
+            app = CrudcastApp(__name__, config_file='file')
+        self.addCleanup(CrudcastApp.crudcast_config.pop, 'users')
+        self.addCleanup(CrudcastApp.models.clear)
+        get_api(app)
+        self.assertIs(app.user_manager, app.get_model('user'))
+
+        owner = {'_id': ObjectId(), 'username': 'chris', 'password': b'hash', 'salt': b'salt'}
+        app.get_model('note').collection = mock.MagicMock()
+        app.get_model('note').collection.find.return_value = [{'_id': ObjectId(), 'owner': str(owner['_id'])}]
+        app.user_manager.collection = mock.MagicMock()
+        app.user_manager.collection.find.return_value = [owner]
+
+        response = app.test_client().get('/api/note/?expand=owner')
+        expanded = json.loads(response.data.decode())[0]['owner']
+        self.assertEqual({'_id': str(owner['_id']), 'username': 'chris'}, expanded)
+        self.assertEqual({'password': 0, 'salt': 0}, app.user_manager.collection.find.call_args[0][1])
+
+        app.get_model('note').collection.find.return_value = [{'_id': ObjectId(), 'owner': str(owner['_id'])}]
+        response = app.test_client().get('/api/note/?fields=text&expand=owner')
+        self.assertEqual(expanded, json.loads(response.data.decode())[0]['owner'])
+        self.assertEqual({'text': 1, 'owner': 1}, app.get_model('note').collection.find.call_args[0][1])
+
+    def test_user_routes(self):
+        config = {'users': {'options': {}}, 'models': {'note': {}}}
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))):
+            app = CrudcastApp(__name__, config_file='file')
+        self.addCleanup(CrudcastApp.crudcast_config.pop, 'users')
+        self.addCleanup(CrudcastApp.models.clear)
+        get_api(app)
+        client = app.test_client()
+
+        collection = app.user_manager.collection = app.user_manager.validation_collection = mock.MagicMock()
+        collection.count_documents.return_value = 3
+        response = client.get('/api/user/count/?username=chris')
+        self.assertEqual({'count': 3}, json.loads(response.data.decode()))
+        collection.count_documents.assert_called_once_with({'username': 'chris'})
+
+        collection.aggregate.return_value = [{'_id': {'username': 'chris'}, 'count': 1}]
+        response = client.get('/api/user/aggregate/?group_by=username')
+        self.assertEqual(200, response.status_code)
+        collection.aggregate.assert_called_once()
+
+        _id = ObjectId()
+        collection.find_one.return_value = {'_id': _id, 'username': 'chris'}
+        response = client.get('/api/user/%s/' % _id)
+        self.assertEqual({'_id': str(_id), 'username': 'chris'}, json.loads(response.data.decode()))
+
+        # bulk writes would skip password hashing and the auth cache, so users have no bulk endpoint
+        for method, data in [(client.post, [{'username': 'a', 'password': 'b'}]), (client.patch, [{'_id': str(_id)}]),
+                             (client.delete, [str(_id)])]:
+            response = method('/api/user/bulk/', data=json.dumps(data), content_type='application/json')
+            self.assertEqual(404, response.status_code)
+        collection.insert_many.assert_not_called()
+        collection.bulk_write.assert_not_called()
+        collection.delete_many.assert_not_called()
+
+    def test_projection(self):
+        from crudcast.users import User
+        from crudcast.exceptions import ConfigException
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {
+            'test': {'collection': collection, 'fields': {'name': {}, 'body': {}}, 'options': {'projection': ['-body']}},
+            'user': {'collection': collection, 'fields': {}},
+        }
+        model = Model('test', app=app)
+
+        self.assertEqual({'body': 0}, model.get_projection())
+        self.assertEqual({'_id': 1, 'name': 1}, model.get_projection('_id, name'))
+        with self.assertRaises(BadRequest):
+            model.get_projection('name,other')
+
+        _id = ObjectId()
+        collection.find_one.return_value = {'_id': _id, 'name': 'test'}
+        self.assertEqual({'_id': str(_id), 'name': 'test'}, model.retrieve(str(_id), projection={'name': 1}))
+        collection.find_one.assert_called_with({'_id': _id}, {'name': 1})
+        model.retrieve(str(_id))
+        collection.find_one.assert_called_with({'_id': _id}, {'body': 0})
+
+        model.query({}, projection={'name': 1})
+        collection.find.assert_called_with({}, {'name': 1})
+
+        user_manager = User(app)
+        user_manager.retrieve(str(_id))
+        collection.find_one.assert_called_with({'_id': _id}, {'password': 0, 'salt': 0})
+        self.assertEqual({'username': 1}, user_manager.get_projection('username'))
+        with self.assertRaises(BadRequest):
+            user_manager.get_projection('username,password')
+
+        app.models['test']['options']['projection'] = ['name', '-body']
+        with self.assertRaises(ConfigException):
+            Model('test', app=app)
+
+    def test_read_preference(self):
+        from crudcast.exceptions import ConfigException
+        from pymongo.read_concern import ReadConcern
+        from pymongo.read_preferences import ReadPreference
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        secondary, nearest, majority, primary = mock.MagicMock(), mock.MagicMock(), mock.MagicMock(), mock.MagicMock()
+        collection.with_options.side_effect = lambda read_preference=None, **options: (
+            secondary if read_preference == ReadPreference.SECONDARY_PREFERRED else
+            nearest if read_preference == ReadPreference.NEAREST else
+            primary if read_preference == ReadPreference.PRIMARY else majority
+        )
+        app.models = {'test': {'collection': collection, 'fields': {'name': {'unique': True}}, 'options': {
+            'read_preference': {'list': 'secondaryPreferred', 'count': 'nearest'}, 'read_concern': 'majority'
+        }}}
+        model = Model('test', app=app)
+        collection.with_options.assert_any_call(read_preference=ReadPreference.SECONDARY_PREFERRED,
+                                                read_concern=ReadConcern('majority'))
+        collection.with_options.assert_any_call(read_preference=ReadPreference.NEAREST,
+                                                read_concern=ReadConcern('majority'))
+        collection.with_options.assert_any_call(read_concern=ReadConcern('majority'))
+
+        self.assertIs(secondary, model.get_read_collection('list'))
+        self.assertIs(majority, model.get_read_collection('retrieve'))
+        self.assertIs(collection, model.get_read_collection())
+        model.query({'name': 'a'}, operation='list')
+        secondary.find.assert_called_once_with({'name': 'a'})
+        model.count_matching({'name': 'a'})
+        nearest.count_documents.assert_called_once_with({'name': 'a'})
+
+        # uniqueness checks and writes use the primary, even if the client reads from secondaries
+        collection.with_options.assert_any_call(read_preference=ReadPreference.PRIMARY)
+        primary.find.return_value = []
+        model.create({'name': 'a'})
+        primary.find.assert_called_once_with({'$or': [{'name': 'a'}]}, {'name': 1})
+        collection.insert_one.assert_called_once()
+        primary.find_one.return_value = None
+        self.assertFalse(model.exists_where({'name': 'b'}))
+        primary.find_one.assert_called_once_with({'name': 'b'}, {'_id': 1})
+
+        # the read collections follow the model to a new client
+        model.collection = mock.MagicMock()
+        self.assertIs(model.collection.with_options.return_value, model.get_read_collection('list'))
+
+        for options in [{'read_preference': 'fastest'}, {'read_concern': 'strong'},
+                        {'read_preference': {'create': 'secondary'}}]:
+            app.models['test']['options'] = options
+            with self.assertRaises(ConfigException):
+                Model('test', app=app)
+
+    def test_filters(self):
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        app.models = {'test': {'collection': mock.MagicMock(), 'fields': {
+            'name': {},
+            'age': {'type': 'number'},
+            'active': {'type': 'boolean'},
+            'number': {'type': 'autofield'},
+            'created': {'type': 'auto_datetime'},
+        }}}
+        model = Model('test', app=app)
+        _id = ObjectId()
+
+        self.assertEqual({
+            '_id': _id,
+            'name': {'$in': ['a', 'b']},
+            'age': {'$gte': 18, '$lt': 65.5, '$ne': 30},
+            'active': True,
+            'number': {'$exists': False, '$eq': 3},
+            'created': {'$gt': datetime(2018, 12, 10)},
+        }, model.get_query(**{
+            '_id': str(_id),
+            'name__in': 'a,b',
+            'age__gte': '18',
+            'age__lt': '65.5',
+            'age__ne': '30',
+            'active': 'true',
+            'number': '3',
+            'number__exists': 'false',
+            'created__gt': '2018-12-10',
+        }))
+        self.assertEqual({'_id': _id, 'age': 3}, model.get_query(_id=_id, age=3))
+
+        for args in [{'other': 'a'}, {'name__like': 'a'}, {'age': 'a'}, {'active': 'yes'}, {'_id': 'a'},
+                     {'created': '10/12/2018'}, {'name__exists': 'maybe'}]:
+            with self.assertRaises(BadRequest):
+                model.get_query(**args)
+
+    def test_existence(self):
+        app = MockApp()
+        collection = mock.MagicMock()
+        collection.with_options.return_value = collection
+        app.models = {'test': {'collection': collection, 'fields': {'name': {'unique': True}}}}
+        model = Model('test', app=app)
+
+        collection.find_one.return_value = None
+        self.assertFalse(model.exists('507f1f77bcf86cd799439011'))
+        collection.find_one.assert_called_with({'_id': ObjectId('507f1f77bcf86cd799439011')}, {'_id': 1})
+
+        collection.find_one.return_value = {'_id': ObjectId('507f1f77bcf86cd799439011')}
+        with self.assertRaises(Exception):
+            model.get_field_by_name('name').validate('test')
+        collection.find_one.assert_called_with({'name': 'test'}, {'_id': 1})
+
+        collection.count_documents.return_value = 3
+        self.assertEqual(3, model.count({'name': 'test'}))
+        collection.estimated_document_count.return_value = 10
+        self.assertEqual(10, model.estimated_count())
+        self.assertFalse(collection.find.called)
+
+    def test_indexes(self):
+        from crudcast.indexes import parse_index, sync_indexes
+        from crudcast.exceptions import ConfigException
+
+        self.assertEqual([('name', 1)], parse_index('name').keys)
+        self.assertEqual('author_1_created_-1', parse_index(['author', '-created']).name)
+        index = parse_index({'fields': ['isbn'], 'unique': True, 'name': 'isbn'})
+        self.assertEqual(('isbn', True), (index.name, index.unique))
+        with self.assertRaises(ConfigException):
+            parse_index({'unique': True})
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'test': {
+            'collection': collection,
+            'fields': {
+                'name': {'unique': True},
+                'author': {'type': 'foreignkey', 'to': 'test'},
+                'created': {'type': 'auto_datetime'},
+            },
+            'options': {'indexes': ['created', ['author', '-created']]}
+        }}
+        model = Model('test', app=app)
+        self.assertEqual(['name_1', 'author_1', 'created_1', 'author_1_created_-1'],
+                         [index.name for index in model.indexes])
+
+        collection.index_information.return_value = {
+            '_id_': {}, 'name_1': {'unique': True, 'partialFilterExpression': {'name': {'$exists': True}}},
+            'author_1': {'unique': True}
+        }
+        report = [(index.name, status) for index, status in sync_indexes(model, dry_run=True)]
+        self.assertEqual([('name_1', 'exists'), ('author_1', 'conflicts with existing index'),
+                          ('created_1', 'would be created'), ('author_1_created_-1', 'would be created')], report)
+        self.assertFalse(collection.create_index.called)
+
+        sync_indexes(model)
+        collection.create_index.assert_called_with([('author', 1), ('created', -1)], name='author_1_created_-1',
+                                                   unique=False, background=True)
+
+        # unique fields that aren't required can be left out of any number of documents
+        app.models['test']['fields']['code'] = {'unique': True, 'required': True}
+        model = Model('test', app=app)
+        collection.index_information.return_value = {}
+        collection.create_index.reset_mock()
+        sync_indexes(model)
+        collection.create_index.assert_any_call([('name', 1)], name='name_1', unique=True, background=True,
+                                                partialFilterExpression={'name': {'$exists': True}})
+        collection.create_index.assert_any_call([('code', 1)], name='code_1', unique=True, background=True)
+
+        collection.index_information.return_value = {'name_1': {'unique': True}}
+        report = dict((index.name, status) for index, status in sync_indexes(model, dry_run=True))
+        self.assertEqual('conflicts with existing index', report['name_1'])
+
+    def test_pagination(self):
+        from crudcast.pagination import Paginator, decode_cursor
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'test': {'collection': collection, 'fields': {}, 'options': {'max_page_size': 2}}}
+        model = Model('test', app=app)
+
+        documents = [{'_id': ObjectId()} for i in range(3)]
+        collection.find.return_value.sort.return_value.limit.return_value = documents
+
+        args = {'limit': '10', 'name': 'test'}
+        paginator = Paginator.from_args(model, args)
+        self.assertEqual({'name': 'test'}, args)
+        self.assertEqual(2, paginator.limit)
+
+        page, next_args = paginator.get_page({})
+        self.assertEqual(documents[:2], page)
+        self.assertEqual(documents[1]['_id'], decode_cursor(next_args['cursor'])['_id'])
+        collection.find.return_value.sort.return_value.limit.assert_called_with(3)
+
+        paginator = Paginator(model, cursor=next_args['cursor'])
+        collection.find.return_value.sort.return_value.limit.return_value = documents[2:]
+        page, next_args = paginator.get_page({'name': 'test'})
+        self.assertEqual(documents[2:], page)
+        self.assertIsNone(next_args)
+        collection.find.assert_called_with({'$and': [{'name': 'test'}, {'_id': {'$gt': documents[1]['_id']}}]})
+
+        collection.find.return_value.sort.return_value.skip.return_value.limit.return_value = documents
+        page, next_args = Paginator(model, offset='4').get_page({})
+        self.assertEqual({'limit': 2, 'offset': 6}, next_args)
+        collection.find.return_value.sort.assert_called_with([('_id', 1)])
+        collection.find.return_value.sort.return_value.skip.assert_called_with(4)
+
+        with self.assertRaises(BadRequest):
+            Paginator(model, limit='0')
+
+        with self.assertRaises(BadRequest):
+            Paginator(model, cursor='not a cursor')
+
+        self.assertFalse(Paginator(MockModel()).enabled)
+
+    def test_ordering(self):
+        from crudcast.pagination import Paginator, decode_cursor
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'test': {'collection': collection, 'fields': {
+            'name': {},
+            'email': {'unique': True},
+            'created': {'type': 'auto_datetime'},
+        }, 'options': {'indexes': [['created', '_id']], 'ordering_fields': ['name', 'email', 'created']}}}
+        model = Model('test', app=app)
+
+        self.assertEqual([('created', -1), ('name', 1), ('_id', 1)], model.get_sort('-created,name'))
+        self.assertEqual([('email', -1), ('_id', -1)], model.get_sort('-email'))
+        self.assertIsNone(model.get_sort(''))
+        for ordering in ['_id', 'other', 'name,-name']:
+            with self.assertRaises(BadRequest):
+                model.get_sort(ordering)
+
+        self.assertTrue(model.is_sort_indexed(model.get_sort('-created')))
+        self.assertFalse(model.is_sort_indexed(model.get_sort('created,name')))
+        self.assertEqual(['test: ordering by name is not supported by an index. Add [name, _id] to the model\'s '
+                          'indexes', 'test: ordering by email is not supported by an index. Add [email, _id] to the '
+                          'model\'s indexes'], model.get_ordering_warnings())
+
+        model.options['indexed_ordering'] = True
+        self.assertEqual([('created', 1), ('_id', 1)], model.get_sort('created'))
+        with self.assertRaises(BadRequest):
+            model.get_sort('name')
+
+        created = datetime(2018, 12, 10, 15, 0, 0, 123000)
+        documents = [{'_id': ObjectId(), 'created': created} for i in range(3)]
+        collection.find.return_value.sort.return_value.limit.return_value = documents
+        sort = model.get_sort('-created')
+        page, next_args = Paginator(model, limit='2', sort=sort).get_page({'name': 'a'}, projection={'name': 1})
+        collection.find.assert_called_with({'name': 'a'}, {'name': 1, 'created': 1, '_id': 1})
+        collection.find.return_value.sort.assert_called_with(sort)
+
+        cursor = decode_cursor(next_args['cursor'])
+        self.assertEqual(documents[1]['_id'], cursor['_id'])
+        Paginator(model, sort=sort, **next_args).get_page({})
+        collection.find.assert_called_with({'$or': [
+            {'created': {'$lt': created}},
+            {'created': created, '_id': {'$lt': documents[1]['_id']}},
+        ]})
+
+        # cursors over a required unique field still carry the `_id`, so every page can be decoded
+        model.options['indexed_ordering'] = False
+        model.field_index['email'].required = True
+        sort = model.get_sort('email')
+        self.assertEqual([('email', 1), ('_id', 1)], sort)
+        documents = [{'_id': ObjectId(), 'email': '%s@example.com' % i} for i in range(5)]
+        collection.find.return_value.sort.return_value.limit.return_value = documents[:3]
+        page, next_args = Paginator(model, limit='2', sort=sort).get_page({})
+        collection.find.return_value.sort.return_value.limit.return_value = documents[2:]
+        page, next_args = Paginator(model, sort=sort, **next_args).get_page({})
+        collection.find.assert_called_with({'$or': [
+            {'email': {'$gt': '1@example.com'}},
+            {'email': '1@example.com', '_id': {'$gt': documents[1]['_id']}},
+        ]})
+        self.assertEqual(documents[2:4], page)
+        cursor = decode_cursor(next_args['cursor'])
+        self.assertEqual({'email': '3@example.com', '_id': documents[3]['_id']}, cursor)
+        Paginator(model, sort=sort, **next_args).get_page({})
+
+    def test_ordering_nulls(self):
+        from crudcast.pagination import Paginator, decode_cursor
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'test': {'collection': collection, 'fields': {'name': {}}}}
+        model = Model('test', app=app)
+
+        documents = [{'_id': ObjectId()} for i in range(3)]
+        collection.find.return_value.sort.return_value.limit.return_value = documents
+        page, next_args = Paginator(model, limit='2', sort=model.get_sort('name')).get_page({})
+        self.assertIsNone(decode_cursor(next_args['cursor'])['name'])
+
+        last_id = documents[1]['_id']
+        Paginator(model, sort=model.get_sort('name'), **next_args).get_page({})
+        collection.find.assert_called_with({'$or': [
+            {'name': {'$ne': None}},
+            {'name': None, '_id': {'$gt': last_id}},
+        ]})
+
+        Paginator(model, sort=model.get_sort('-name'), **next_args).get_page({})
+        collection.find.assert_called_with({'name': None, '_id': {'$lt': last_id}})
+
+        documents[1]['name'] = 'a'
+        page, next_args = Paginator(model, limit='2', sort=model.get_sort('-name')).get_page({})
+        Paginator(model, sort=model.get_sort('-name'), **next_args).get_page({})
+        collection.find.assert_called_with({'$or': [
+            {'$or': [{'name': {'$lt': 'a'}}, {'name': None}]},
+            {'name': 'a', '_id': {'$lt': last_id}},
+        ]})
+
+    def test_aggregation(self):
+        from werkzeug.exceptions import BadRequest
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'book': {'collection': collection, 'fields': {
+            'author': {'type': 'foreignkey', 'to': 'author'},
+            'pages': {'type': 'number'},
+        }, 'options': {'max_groups': 10}}}
+        model = Model('book', app=app)
+
+        collection.count_documents.return_value = 3
+        self.assertEqual(3, model.count_matching(model.get_query(pages__gt='100')))
+        collection.count_documents.assert_called_once_with({'pages': {'$gt': 100}})
+        collection.estimated_document_count.return_value = 10
+        self.assertEqual(10, model.count_matching({}))
+        self.assertFalse(collection.find.called)
+
+        author = ObjectId()
+        collection.aggregate.return_value = [{'_id': {'author': author}, 'count': 2, 'avg_pages': 150.5}]
+        self.assertEqual([{'author': str(author), 'count': 2, 'avg_pages': 150.5}],
+                         model.aggregate({'pages': {'$gt': 100}}, group_by='author', metric='count,avg:pages'))
+        collection.aggregate.assert_called_once_with([
+            {'$match': {'pages': {'$gt': 100}}},
+            {'$group': {'_id': {'author': '$author'}, 'count': {'$sum': 1}, 'avg_pages': {'$avg': '$pages'}}},
+            {'$sort': {'_id.author': 1}},
+            {'$limit': 10},
+        ])
+
+        for group_by, metric in [(None, None), ('other', None), ('author', 'median:pages'), ('author', 'sum'),
+                                 ('author', 'count:pages'), ('author', 'max:other')]:
+            with self.assertRaises(BadRequest):
+                model.aggregate({}, group_by=group_by, metric=metric)
+
+    def test_response_cache(self):
+        from crudcast.cache import ResponseCache, TTLCache, get_backend
+        from crudcast.exceptions import ConfigException
+
+        config = {'models': {'book': {'cache': {'ttl': 30, 'max_entries': 100}, 'fields': {'name': {}}}}}
+        with mock.patch("builtins.open", mock.mock_open(read_data=json.dumps(config))):
+            app = CrudcastApp(__name__, config_file='file')
+        get_api(app)
+        client = app.test_client()
+
+        _id = ObjectId()
+        collection = mock.MagicMock()
+        collection.insert_one.return_value.inserted_id = _id
+        collection.find_one.return_value = {'_id': _id, 'name': 'test'}
+        collection.find.return_value = [{'_id': _id, 'name': 'test'}]
+        collection.delete_one.return_value.deleted_count = 1
+        model = app.get_model('book')
+        model.collection = collection
+
+        for url in ['/api/book/', '/api/book/?name=test&fields=name', '/api/book/%s/' % _id]:
+            expected = json.loads(client.get(url).data.decode())
+            collection.reset_mock()
+            self.assertEqual(expected, json.loads(client.get(url).data.decode()))
+            self.assertEqual([], collection.method_calls)
+
+        # the order of the query string doesn't matter, but references that are expanded are never cached
+        client.get('/api/book/?fields=name&name=test')
+        client.get('/api/book/?expand=')
+        self.assertEqual(1, len(collection.method_calls))
+        self.assertEqual({'hits': 4, 'misses': 3, 'hit_rate': 4 / 7, 'invalidations': 0}, model.cache.stats())
+
+        # writes invalidate the cached responses
+        for method, url, data in [(client.post, '/api/book/', {'name': 'test'}),
+                                  (client.delete, '/api/book/%s/' % _id, None),
+                                  (client.post, '/api/book/bulk/', [{'name': 'test'}])]:
+            method(url, data=json.dumps(data) if data else None, content_type='application/json')
+            collection.reset_mock()
+            client.get('/api/book/')
+            self.assertEqual(1, len(collection.find.mock_calls))
+        self.assertEqual(3, model.cache.stats()['invalidations'])
+        self.assertIn('book', app.get_stats()['cache'])
+
+        # errors aren't cached
+        collection.find_one.return_value = None
+        self.assertEqual(404, client.get('/api/book/%s/' % ObjectId()).status_code)
+        self.assertEqual(404, client.get('/api/book/%s/' % ObjectId()).status_code)
+
+        # a shared backend sees invalidations from other processes
+        backend = TTLCache()
+        cache, other = ResponseCache('book', backend), ResponseCache('book', backend)
+        key = cache.get_key('id', '1')
+        cache.set(key, {'data': {}, 'headers': {}})
+        self.assertEqual(key, other.get_key('id', '1'))
+        other.invalidate()
+        self.assertNotEqual(key, cache.get_key('id', '1'))
+
+        self.assertIsInstance(get_backend({'backend': 'crudcast.cache.TTLCache', 'ttl': 5}), TTLCache)
+        for options in [{'backend': 'crudcast.cache.Missing'}, {'ttl': 5, 'size': 10}]:
+            with self.assertRaises(ConfigException):
+                get_backend(options)
+
+    def test_streaming(self):
+        from crudcast.streaming import iter_stream, chunked, JSON, NDJSON
+        items = ({'n': i} for i in range(5))
+        self.assertEqual([[{'n': 0}, {'n': 1}], [{'n': 2}, {'n': 3}], [{'n': 4}]], list(chunked(items, 2)))
+
+        chunks = list(iter_stream(JSON, ({'n': i} for i in range(5)), chunk_size=2))
+        self.assertEqual(5, len(chunks))
+        self.assertEqual([{'n': i} for i in range(5)], json.loads(''.join(chunks)))
+        self.assertEqual([], json.loads(''.join(iter_stream(JSON, []))))
+
+        lines = ''.join(iter_stream(NDJSON, ({'n': i} for i in range(3)))).splitlines()
+        self.assertEqual([{'n': 0}, {'n': 1}, {'n': 2}], [json.loads(line) for line in lines])
+
+    def test_encoders(self):
+        from crudcast.encoders import encode, encode_document
+        from bson import ObjectId, Int64
+        from bson.decimal128 import Decimal128
+        from bson.binary import Binary
+
+        _id = ObjectId()
+        document = {
+            '_id': _id,
+            'name': 'test',
+            'count': Int64(3),
+            'created': datetime(2018, 12, 10, 15, 0, 0, 123000),
+            'price': Decimal128('10.10'),
+            'data': Binary(b'test'),
+            'authors': [ObjectId('507f1f77bcf86cd799439011'), {'added': datetime(2018, 12, 10)}],
+            'address': {'city': 'London', 'person': _id},
+            'deleted': None,
+        }
+
+        self.assertEqual({
+            '_id': str(_id),
+            'name': 'test',
+            'count': 3,
+            'created': '2018-12-10T15:00:00.123000',
+            'price': '10.10',
+            'data': 'dGVzdA==',
+            'authors': ['507f1f77bcf86cd799439011', {'added': '2018-12-10T00:00:00'}],
+            'address': {'city': 'London', 'person': str(_id)},
+            'deleted': None,
+        }, encode_document(document))
+        self.assertEqual(str(object), encode(object))
+
+    def test_auth_cache(self):
+        from crudcast.users import User
+        from crudcast.authentication import BasicAuth
+        from crudcast.cache import TTLCache
+        import base64
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'user': {'collection': collection, 'fields': {}}}
+        user_manager = User(app)
+
+        _id = ObjectId()
+        request = mock.MagicMock()
+        request.headers = {'Authorization': 'Basic %s' % base64.b64encode(b'chris:pass:word').decode()}
+        with mock.patch.object(User, 'authenticate', return_value={'_id': _id}) as authenticate:
+            for i in range(3):
+                self.assertEqual({'_id': _id}, BasicAuth.authenticate(request, user_manager))
+            authenticate.assert_called_once_with('chris', 'pass:word')
+            self.assertEqual({'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'entries': 1}, user_manager.auth_cache.stats())
+
+            # a request authenticated while the password is being changed doesn't keep the old one in the cache
+            def find_one_and_update(*args, **kwargs):
+                BasicAuth.authenticate(request, user_manager)
+                return {'_id': _id}
+            collection.find_one_and_update.side_effect = find_one_and_update
+            user_manager.update(str(_id), {'password': 'new'})
+            self.assertEqual(0, user_manager.auth_cache.stats()['entries'])
+            BasicAuth.authenticate(request, user_manager)
+            self.assertEqual(2, authenticate.call_count)
+
+            collection.delete_one.side_effect = Exception('connection lost')
+            with self.assertRaises(Exception):
+                user_manager.delete(str(_id))
+            self.assertEqual(0, user_manager.auth_cache.stats()['entries'])
+
+        request.headers = {'Authorization': 'Basic'}
+        with self.assertRaises(Exception):
+            BasicAuth.authenticate(request, user_manager)
+
+        now = [0]
+        cache = TTLCache(ttl=10, max_entries=2, timer=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((1, None, 3), (cache.get('a'), cache.get('b'), cache.get('c')))
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+
+    def test_token_auth(self):
+        from crudcast.users import User
+        from crudcast.authentication import TokenAuth
+        from werkzeug.exceptions import Unauthorized
+
+        app = MockApp()
+        collection = mock.MagicMock()
+        app.models = {'user': {'collection': collection, 'fields': {}}}
+        user_manager = User(app)
+
+        _id = ObjectId()
+        with mock.patch.object(User, 'authenticate', return_value={'_id': _id, 'username': 'chris'}):
+            response = user_manager.issue_token('chris', 'password')
+        self.assertEqual(3600, response['expires_in'])
+
+        request = mock.MagicMock()
+        request.headers = {'Authorization': 'Bearer %s' % response['token']}
+        collection.reset_mock()
+        self.assertEqual({'_id': str(_id), 'username': 'chris'}, TokenAuth.authenticate(request, user_manager))
+        self.assertEqual([], collection.method_calls)
+
+        for header in ['Bearer %sx' % response['token'], 'Basic %s' % response['token'], 'Bearer']:
+            request.headers = {'Authorization': header}
+            with self.assertRaises(Unauthorized):
+                TokenAuth.authenticate(request, user_manager)
+
+        request.headers = {'Authorization': 'Bearer %s' % response['token']}
+        user_manager.config = dict(User.config, token_expiry=-1)
+        with self.assertRaises(Unauthorized):
+            TokenAuth.authenticate(request, user_manager)
+
     def test_methods(self):
         from crudcast.methods import Method
         from crudcast.resources import Resource
@@ -151,3 +1301,40 @@ class CrudCastTestCase(unittest.TestCase):
         method = Method(file, '/test/<string:arg1>', 'mocks.TestResource')
         _cls = method.get_resource()
         self.assertTrue(issubclass(_cls, Resource))
+
+    def test_method_loader(self):
+        from crudcast.methods import Method
+        from flask import Flask
+        from flask_restplus import Api
+        import tempfile
+        import os
+
+        source = 'from crudcast.resources import Resource\n\n\n' \
+                 'class Hello(Resource):\n' \
+                 '    def get(self):\n' \
+                 '        return {"version": %s}\n'
+
+        with tempfile.TemporaryDirectory() as root:
+            file = os.path.join(root, 'hello.py')
+            with open(file, 'w') as f:
+                f.write(source % 1)
+
+            method = Method(file, 'hello', 'Hello')
+            self.assertIs(method.get_resource(), method.get_resource())
+            self.assertIs(method.get_resource(), Method(file, 'hello2', 'hello.Hello').get_resource())
+
+            reloading = Method(file, 'hello', 'Hello', reload=True)
+            flask_app = Flask(__name__)
+            Api(flask_app).add_resource(reloading.get_api_resource(), '/hello')
+            client = flask_app.test_client()
+            self.assertEqual({'version': 1}, json.loads(client.get('/hello').data.decode()))
+            self.assertFalse(reloading.is_stale())
+
+            with open(file, 'w') as f:
+                f.write(source % 2)
+            mtime = os.path.getmtime(file) + 10
+            os.utime(file, (mtime, mtime))
+
+            self.assertTrue(reloading.is_stale())
+            self.assertEqual({'version': 2}, json.loads(client.get('/hello').data.decode()))
+            self.assertFalse(reloading.is_stale())
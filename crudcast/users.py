@@ -1,32 +1,44 @@
 from crudcast.models import Model
+from crudcast.indexes import Index
+from crudcast.cache import TTLCache
 from crudcast.exceptions import ValidationError
 from flask import abort
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import bcrypt
+import hashlib
+import os
 
 
 class User(Model):
     config = {
-        'username_field': 'username'
+        'username_field': 'username',
+        'auth_cache': {
+            'ttl': 60,
+            'max_entries': 10000,
+        },
+        'token_expiry': 3600,
     }  # default user config
 
     @property
     def username_field(self):
         return self.config['username_field']
 
-    def to_repr(self, **query):
+    @property
+    def readable_fields(self):
+        return ['_id', self.username_field] + [name for name in self.fieldnames if name != self.username_field]
+
+    def get_default_projection(self):
         """
-        Remove the hashed password from the response
+        The hashed password and salt are never read, except to authenticate a user
         """
-        output = super(User, self).to_repr(**query)
-        new_output = []
-        for user in output:
-            new_user = {}
-            for key, val in user.items():
-                if key not in ['password', 'salt']:
-                    new_user[key] = val
-            new_output.append(new_user)
+        return {'password': 0, 'salt': 0}
 
-        return new_output
+    def serialize(self, document):
+        """
+        Remove the hashed password from the response
+        """
+        user = super(User, self).serialize(document)
+        return {key: val for key, val in user.items() if key not in ['password', 'salt']}
 
     def __init__(self, app, **options):
         for key, val in options.items():
@@ -34,8 +46,67 @@ class User(Model):
 
         super().__init__('user', app=app)
 
+        # verified credentials are cached, so that repeat requests don't have to run bcrypt again. Cache keys are a
+        # keyed hash of the `Authorization` header, so the cache never holds a usable password
+        self.auth_cache = TTLCache(**self.config['auth_cache']) if self.config['auth_cache'] else None
+        self.auth_cache_key = os.urandom(32)
+
+        # tokens are signed with the app's `secret_key`. If there isn't one, a random key is used, which means that
+        # tokens are only valid in the process that issued them
+        secret_key = app.crudcast_config.get('secret_key') or os.urandom(32)
+        self.token_serializer = URLSafeTimedSerializer(secret_key, salt='crudcast-token')
+
+    def issue_token(self, username, password):
+        """
+        Checks a username and password, and returns a signed token that can be used to authenticate with the `token`
+        auth type
+
+        :rtype: dict
+        """
+        user = self.authenticate(username, password)
+        token = self.token_serializer.dumps({'_id': str(user['_id']), self.username_field: user[self.username_field]})
+        return {'token': token, 'expires_in': self.config['token_expiry']}
+
+    def verify_token(self, token):
+        """
+        Checks that a token was issued by `issue_token` and hasn't expired, or raises a 401 error
+
+        :return: the token payload
+        :rtype: dict
+        """
+        try:
+            return self.token_serializer.loads(token, max_age=self.config['token_expiry'])
+        except BadSignature:
+            abort(401)
+
+    def get_credentials_key(self, auth_header):
+        """
+        Returns the key under which an `Authorization` header is stored in `self.auth_cache`
+
+        :type auth_header: str
+        :rtype: bytes
+        """
+        return hashlib.blake2b(auth_header.encode(), key=self.auth_cache_key, digest_size=32).digest()
+
+    def clear_cached_credentials(self, _id):
+        """
+        Removes a user's verified credentials from `self.auth_cache`, e.g. because their password has changed
+
+        :param _id: the user's ID
+        """
+        if self.auth_cache is not None:
+            object_id = self.get_object_id(_id)
+            self.auth_cache.discard_where(lambda user: user['_id'] == object_id)
+
+    def get_indexes(self):
+        """
+        Usernames are indexed, so that authentication doesn't have to scan the user collection
+        """
+        username_index = Index([(self.username_field, 1)], unique=True)
+        return (username_index,) + tuple(index for index in super().get_indexes() if index.name != username_index.name)
+
     def user_exists(self, username):
-        return self.collection.find({self.username_field: username}).count() == 1
+        return self.exists_where({self.username_field: username})
 
     def check_invalid_keys(self, keys):
         key = None
@@ -70,16 +141,13 @@ class User(Model):
         if not username or not password:
             abort(401)
 
-        try:
-            users = self.find(**{self.username_field: username})
-            assert users.count() == 1
-            user = users[0]
-            self.verify_password(username, password)
-            return user
-
-        except AssertionError:
+        user = self.collection.find_one({self.username_field: username})
+        if user is None:
             abort(401)
 
+        self.verify_password(username, password, user=user)
+        return user
+
     def update(self, _id, data):
         """
         Method extended to hash the password, if a new one is provided
@@ -91,7 +159,18 @@ class User(Model):
         if data.get('password'):
             data['password'], data['salt'] = self.hash_password(data.pop('password'))
 
-        return super().update(_id, data)
+        # the credentials are cleared after the write, so that a request authenticated during the write can't cache
+        # the old ones again
+        try:
+            return super().update(_id, data)
+        finally:
+            self.clear_cached_credentials(_id)
+
+    def delete(self, _id):
+        try:
+            return super().delete(_id)
+        finally:
+            self.clear_cached_credentials(_id)
 
     def create(self, data):
         if data.get('password'):
@@ -99,10 +178,13 @@ class User(Model):
             data['password'], data['salt'] = self.hash_password(password)
         return super().create(data)
 
-    def verify_password(self, username, password):
-        users = self.find(**{self.username_field: username})
-        hash = users[0]['password']
-        salt = users[0]['salt']
+    def verify_password(self, username, password, user=None):
+        if user is None:
+            user = self.collection.find_one({self.username_field: username})
+        if user is None:
+            abort(401)
+        hash = user['password']
+        salt = user['salt']
         valid = bcrypt.hashpw(password.encode(), salt) == hash
         if not valid:
             abort(401)
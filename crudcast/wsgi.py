@@ -0,0 +1,67 @@
+"""
+Creates Crudcast apps for WSGI servers. For example, to run Crudcast with gunicorn::
+
+    gunicorn --workers 4 --threads 2 'crudcast.wsgi:create_app("config.yml")'
+
+If no config file is given, the `CRUDCAST_CONFIG_FILE` environment variable is used, and then `config.yml`
+"""
+from crudcast.api import get_api
+from crudcast.app import CrudcastApp
+from crudcast.exceptions import ValidationError, handle_invalid_usage
+from flask import request, jsonify
+from pymongo.errors import PyMongoError
+import os
+
+
+SWAGGER_URL = '/api/docs'  # URL for exposing Swagger UI (without trailing '/')
+STATS_URL = '/stats'  # URL for exposing `CrudcastApp.get_stats`, if the `stats` option is set
+
+
+def configure_app(app):
+    """
+    Prepares an app to serve requests: creates the indexes (unless `sync_indexes: false` is set), registers the API
+    resources, the error handler, the swagger views and the stats view (if `stats: true` is set), and builds the
+    swagger document
+
+    :type app: crudcast.app.CrudcastApp
+    :rtype: crudcast.app.CrudcastApp
+    """
+    if app.crudcast_config.get('sync_indexes', True):
+        try:
+            app.sync_indexes()
+        except PyMongoError as err:
+            print('Unable to create indexes: %s' % err)
+
+    for warning in app.get_ordering_warnings():
+        print('Warning: %s' % warning)
+
+    get_api(app)
+    app.register_error_handler(ValidationError, handle_invalid_usage)
+
+    app.register_blueprint(app.get_swagger_ui_view(), url_prefix=SWAGGER_URL)
+
+    # the swagger document is built up front, rather than on the first request for it
+    app.get_swagger_document()
+
+    @app.route('/swagger')
+    def swagger_file():
+        return app.get_swagger_document().response(request)
+
+    if app.crudcast_config.get('stats'):
+        @app.route(STATS_URL)
+        def stats():
+            return jsonify(app.get_stats())
+
+    return app
+
+
+def create_app(config_file=None, import_name='Crudcast'):
+    """
+    Creates an app that is ready to serve requests
+
+    :param config_file: Local path to a valid `config.yml`
+    :param import_name: The `import_name` parameter for Flask
+    :rtype: crudcast.app.CrudcastApp
+    """
+    config_file = config_file or os.environ.get('CRUDCAST_CONFIG_FILE', 'config.yml')
+    return configure_app(CrudcastApp(import_name=import_name, config_file=config_file))
@@ -36,6 +36,9 @@ setup(
         'passlib==1.7.1',
         'bcrypt==3.1.5'
     ],
+    extras_require={
+        'async': ['motor==2.0.0'],
+    },
     entry_points={
         'console_scripts': ['crudcast=crudcast.entrypoint:main'],
     }